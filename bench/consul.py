@@ -0,0 +1,105 @@
+"""
+Stand-in for the consul HTTP API of the simulated machines, used by the benchmark harness (bench/run.py).
+
+Like the stand-in engine API (bench/engine.py), one server listening on all addresses answers for all machines on the
+consul port (8500), plain HTTP like consul. Consul runs on a machine once dsc configured it for swarm, and only
+answers startup seconds after that (the age of its machine config). There is a leader once consul answers on every
+master, and a node is in the catalog once its own consul answers. Every request is appended to the call log as program
+"consul".
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stubs  # noqa: E402
+
+PORT = 8500
+
+
+class ConsulHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        address = self.connection.getsockname()[0]
+        stubs._log("consul", "api", [self.path], self.server.call_log)
+
+        name = self.server.machine_name(address)
+        if name is None or not self.server.running(name):
+            # Nothing listens on the port yet
+            self.close_connection = True
+            return self.connection.close()
+
+        if self.path == "/v1/status/leader":
+            masters = self.server.masters()
+            leader = masters and all([self.server.running(master) for master in masters])
+            return self._reply(200, "{}:8300".format(stubs.cluster_ip(masters[0])) if leader else "")
+        if self.path == "/v1/agent/self":
+            return self._reply(200, {"Config": {"NodeName": name.split(".")[0]}})
+        if self.path.startswith("/v1/catalog/node/"):
+            node = self.path[len("/v1/catalog/node/"):]
+            for machine in self.server.machines():
+                if machine.split(".")[0] == node and self.server.running(machine):
+                    return self._reply(200, {"Node": {"Node": node, "Address": stubs.cluster_ip(machine)}})
+            return self._reply(200, None)
+
+        return self._reply(404, "Invalid URL path")
+
+    def _reply(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConsulServer(ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, machine_dir: str, call_log: str = None, startup: float = 0):
+        super().__init__(("", PORT), ConsulHandler)
+        self.machine_dir = machine_dir
+        self.call_log = call_log
+        self.startup = startup
+
+    def machines(self) -> list:
+        return os.listdir(self.machine_dir) if os.path.isdir(self.machine_dir) else []
+
+    def machine_name(self, address: str):
+        for name in self.machines():
+            if stubs.public_ip(name) == address:
+                return name
+        return None
+
+    def masters(self) -> list:
+        return sorted([name for name in self.machines() if name.startswith("master")])
+
+    def running(self, name: str) -> bool:
+        path = os.path.join(self.machine_dir, name, "config.json")
+        try:
+            with open(path) as handle:
+                is_swarm = json.load(handle)["HostOptions"]["SwarmOptions"]["IsSwarm"]
+            return is_swarm and time.time() - os.path.getmtime(path) >= self.startup
+        except (OSError, ValueError, KeyError):
+            return False
+
+
+def serve(machine_dir: str, call_log: str = None, startup: float = 0) -> ConsulServer:
+    """
+    Start the stand-in consul API in a background thread
+    :param machine_dir:
+    :param call_log: file to log the requests to
+    :param startup: seconds consul takes to answer after a machine is configured for swarm
+    :return: the server, stop it with shutdown() and server_close()
+    """
+    server = ConsulServer(machine_dir, call_log, startup)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,140 @@
+"""
+Stand-in for the Docker Engine API of the simulated machines, used by the benchmark harness (bench/run.py).
+
+The stubs give every machine a loopback address (127.x.y.z), so one server listening on all addresses answers for all
+machines on the engine (2376) and swarm manager (3376) ports, over TLS with client certificates like docker does. The
+machine is identified by the address the client connected to; the swarm manager only answers once the machine config
+has swarm enabled. Every request is appended to the call log as program "engine".
+"""
+import json
+import os
+import ssl
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stubs  # noqa: E402
+
+PORTS = [2376, 3376]
+
+
+def make_certs(path: str, addresses: list) -> None:
+    """
+    Create a CA, a server certificate for the given addresses and a client certificate (ca.pem, cert.pem, key.pem)
+    :param path:
+    :param addresses: IP addresses the server certificate is valid for
+    """
+    def openssl(*args):
+        subprocess.run(["openssl"] + list(args), cwd=path, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+    with open(os.path.join(path, "server.ext"), "w") as handle:
+        handle.write("subjectAltName = {}\n".format(",".join(["IP:{}".format(address) for address in addresses])))
+    with open(os.path.join(path, "client.ext"), "w") as handle:
+        handle.write("extendedKeyUsage = clientAuth\n")
+
+    openssl("req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=dsc-bench-ca",
+            "-keyout", "ca-key.pem", "-out", "ca.pem")
+    for name, ext in [("server", "server.ext"), ("client", "client.ext")]:
+        openssl("req", "-newkey", "rsa:2048", "-nodes", "-subj", "/CN=dsc-bench-{}".format(name),
+                "-keyout", "{}-key.pem".format(name), "-out", "{}.csr".format(name))
+        openssl("x509", "-req", "-in", "{}.csr".format(name), "-CA", "ca.pem", "-CAkey", "ca-key.pem",
+                "-CAcreateserial", "-days", "1", "-extfile", ext, "-out", "{}.pem".format(name))
+
+    os.replace(os.path.join(path, "client.pem"), os.path.join(path, "cert.pem"))
+    os.replace(os.path.join(path, "client-key.pem"), os.path.join(path, "key.pem"))
+
+
+class EngineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        address, port = self.connection.getsockname()[:2]
+        stubs._log("engine", "api", [str(port), self.path], self.server.call_log)
+        time.sleep(self.server.latency)
+
+        config = self.server.machine_config(address)
+        if config is None:
+            return self._reply(404, {"message": "no machine with address {}".format(address)})
+        if port == 3376 and not config["HostOptions"]["SwarmOptions"]["IsSwarm"]:
+            return self._reply(503, {"message": "swarm manager is not running"})
+
+        if self.path == "/_ping":
+            return self._reply(200, b"OK")
+        if self.path == "/info":
+            return self._reply(200, {"Name": config["Name"], "Containers": 1})
+        if self.path == "/version":
+            return self._reply(200, {"Version": "1.12.6", "ApiVersion": "1.24"})
+        if self.path.startswith("/containers/json"):
+            # Consul runs once dsc configured the machine for swarm
+            if not config["HostOptions"]["SwarmOptions"]["IsSwarm"]:
+                return self._reply(200, [])
+            name = "consul-agent-server" if config["HostOptions"]["SwarmOptions"]["Master"] else "consul-agent"
+            return self._reply(200, [{"Names": ["/{}".format(name)], "State": "running", "Status": "Up 5 minutes"}])
+
+        return self._reply(404, {"message": "page not found"})
+
+    def _reply(self, status, body):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EngineServer(ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port: int, machine_dir: str, cert_path: str, call_log: str = None, latency: float = 0):
+        super().__init__(("", port), EngineHandler)
+        self.machine_dir = machine_dir
+        self.call_log = call_log
+        self.latency = latency
+        self.addresses = {}
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(os.path.join(cert_path, "server.pem"), os.path.join(cert_path, "server-key.pem"))
+        context.load_verify_locations(os.path.join(cert_path, "ca.pem"))
+        context.verify_mode = ssl.CERT_REQUIRED
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    def machine_config(self, address: str):
+        name = self.addresses.get(address)
+        if name is None:
+            for name in os.listdir(self.machine_dir) if os.path.isdir(self.machine_dir) else []:
+                if stubs.public_ip(name) == address:
+                    self.addresses[address] = name
+                    break
+            else:
+                return None
+
+        try:
+            with open(os.path.join(self.machine_dir, name, "config.json")) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+
+def serve(machine_dir: str, cert_path: str, call_log: str = None, latency: float = 0) -> list:
+    """
+    Start the stand-in engine API on all ports in background threads
+    :param machine_dir:
+    :param cert_path: directory with the certificates created by make_certs
+    :param call_log: file to log the requests to
+    :param latency: seconds every request takes
+    :return: the servers, stop them with shutdown() and server_close()
+    """
+    servers = [EngineServer(port, machine_dir, cert_path, call_log, latency) for port in PORTS]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Benchmark dsc against simulated docker-machine, docker-compose, docker and ssh binaries (see bench/stubs.py).
+
+For every cluster size a dsc.yaml is generated and `python -m dsc` is run against the stubs in a scratch HOME, so
+nothing touches real machines. The machines get loopback addresses and their engine API is answered by a stand-in
+server (see bench/engine.py) on ports 2376 and 3376 and their consul API by another one (see bench/consul.py) on port
+8500, so those ports have to be free. Reports wall-clock time, the number of spawned stub processes (and how many of
+them were ssh round-trips), the number of engine and consul API requests and the peak memory of the dsc process.
+
+    python bench/run.py --nodes 1 10 100 500 --parallel 1 16 --latency 0.05
+"""
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import consul
+import engine
+import stubs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+STUB_PROGRAMS = ["docker-machine", "docker-compose", "docker", "ssh"]
+SSH_KINDS = ["ssh", "scp"]
+API_PROGRAMS = ["engine", "consul"]
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark dsc against simulated docker binaries")
+    parser.add_argument("--nodes", metavar="N", type=int, nargs="+", default=[1, 10, 100, 500],
+                        help="Cluster sizes to benchmark")
+    parser.add_argument("--parallel", metavar="N", type=int, nargs="+", default=[1],
+                        help="Values for --parallel to benchmark each size with")
+    parser.add_argument("--command", default="start", help="dsc command to benchmark (default: start)")
+    parser.add_argument("--rerun", action="store_true",
+                        help="Also measure a second run against the machines created by the first")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every stub invocation takes")
+    parser.add_argument("--create-latency", type=float, default=None, help="Seconds a docker-machine create takes")
+    parser.add_argument("--provision-latency", type=float, default=None,
+                        help="Seconds a docker-machine provision takes")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="Seconds every engine API request takes")
+    parser.add_argument("--consul-startup", type=float, default=0.0,
+                        help="Seconds consul takes to answer after a machine is configured")
+    parser.add_argument("--image-prewarm", choices=["off", "pull", "load"], default="load",
+                        help="How nodes get the consul images (default: load)")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Chance that a create or provision fails")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Chance that a create is throttled by the provider API (retried by dsc)")
+    parser.add_argument("--output-lines", type=int, default=20,
+                        help="Lines of output printed by create and provision")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON to FILE")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directories")
+
+    return parser.parse_args()
+
+
+def make_config(path: str, nodes: int, parallel: int, image_prewarm: str = "load", throttled: bool = False) -> list:
+    """
+    Write a dsc.yaml with the given number of nodes (at least one master and one worker)
+    :return: machine names of the nodes in the config
+    """
+    masters = ["master{:03d}".format(index) for index in range(min(3, max(1, nodes // 10)))]
+    workers = ["worker{:04d}".format(index) for index in range(max(1, nodes - len(masters)))]
+
+    lines = [
+        "network:",
+        "  cluster-domain: bench.local",
+        "rollout:",
+        "  parallelism: {}".format(parallel),
+        "  image-prewarm: {}".format(image_prewarm),
+        # The stand-in consul server answers on loopback, so the readiness gate can be exercised
+        "  ready-timeout: 3600",
+        "nodes:",
+    ]
+    if throttled:
+        # Retry throttled creates quickly
+        lines[-1:-1] = ["drivers:", "  default:", "    retries: 5", "    backoff: 0.1", "    max-backoff: 1"]
+    for index, name in enumerate(masters):
+        lines.extend(["  {}:".format(name), "    type: master", "    machine-driver: generic",
+                      "    driver-opts: --generic-ip-address=192.0.2.{}".format(index + 1), "    engine-opts:"])
+    for name in workers:
+        lines.extend(["  {}:".format(name), "    type: worker", "    machine-driver: virtualbox",
+                      "    driver-opts:", "    engine-opts:"])
+
+    with open(os.path.join(path, "dsc.yaml"), "w") as handle:
+        handle.write("\n".join(lines) + "\n")
+
+    return ["{}.bench.local".format(name) for name in masters + workers]
+
+
+def make_env(args, home: str, bin_dir: str, cert_dir: str, call_log: str) -> dict:
+    env = os.environ.copy()
+    env.update({
+        "HOME": home,
+        "PATH": "{}:{}".format(bin_dir, env.get("PATH", "")),
+        "PYTHONPATH": ROOT_DIR,
+        "DSC_BENCH_LOG": call_log,
+        "DSC_BENCH_LATENCY": str(args.latency),
+        "DSC_BENCH_FAILURE_RATE": str(args.failure_rate),
+        "DSC_BENCH_THROTTLE_RATE": str(args.throttle_rate),
+        "DSC_BENCH_OUTPUT_LINES": str(args.output_lines),
+        "DSC_BENCH_CERTS": cert_dir,
+    })
+    if args.create_latency is not None:
+        env["DSC_BENCH_LATENCY_CREATE"] = str(args.create_latency)
+    if args.provision_latency is not None:
+        env["DSC_BENCH_LATENCY_PROVISION"] = str(args.provision_latency)
+
+    return env
+
+
+def make_bin_dir(path: str) -> str:
+    bin_dir = os.path.join(path, "bin")
+    os.makedirs(bin_dir)
+    for program in STUB_PROGRAMS:
+        os.symlink(os.path.join(BENCH_DIR, "stubs.py"), os.path.join(bin_dir, program))
+    return bin_dir
+
+
+def run_dsc(command: str, config_dir: str, env: dict, output: str) -> dict:
+    """
+    Run dsc once and measure it
+    :return: wall-clock time, exit code and peak RSS (of dsc or its largest child) in MB
+    """
+    started = time.monotonic()
+    with open(output, "a") as handle:
+        process = subprocess.Popen([sys.executable, "-m", "dsc", "-c", config_dir, command], env=env,
+                                   stdout=handle, stderr=subprocess.STDOUT, cwd=config_dir)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    return {
+        "seconds": round(time.monotonic() - started, 3),
+        "exit_code": process.returncode,
+        "peak_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+
+
+def count_calls(call_log: str) -> dict:
+    kinds = collections.Counter()
+    try:
+        with open(call_log) as handle:
+            for line in handle:
+                _, program, kind, _ = line.split("\t", 3)
+                kinds["{} {}".format(program, kind)] += 1
+    except FileNotFoundError:
+        pass
+
+    return {
+        "spawns": sum(count for name, count in kinds.items() if name.split(" ")[0] not in API_PROGRAMS),
+        "api_calls": sum(count for name, count in kinds.items() if name.split(" ")[0] in API_PROGRAMS),
+        "round_trips": sum(count for name, count in kinds.items() if name.split(" ")[-1] in SSH_KINDS),
+        "calls": dict(sorted(kinds.items())),
+    }
+
+
+def benchmark(args, nodes: int, parallel: int) -> list:
+    scratch = tempfile.mkdtemp(prefix="dsc-bench-")
+    try:
+        home = os.path.join(scratch, "home")
+        config_dir = os.path.join(scratch, "config")
+        os.makedirs(home)
+        os.makedirs(config_dir)
+        names = make_config(config_dir, nodes, parallel, args.image_prewarm, args.throttle_rate > 0)
+        node_count = len(names)
+        bin_dir = make_bin_dir(scratch)
+        cert_dir = os.path.join(scratch, "certs")
+        os.makedirs(cert_dir)
+        engine.make_certs(cert_dir, [stubs.public_ip(name) for name in names])
+        output = os.path.join(scratch, "dsc.log")
+
+        servers = engine.serve(os.path.join(home, ".docker", "machine", "machines"), cert_dir,
+                               latency=args.api_latency)
+        servers.append(consul.serve(os.path.join(home, ".docker", "machine", "machines"),
+                                    startup=args.consul_startup))
+        try:
+            results = []
+            for run in range(2 if args.rerun else 1):
+                call_log = os.path.join(scratch, "calls-{}.log".format(run))
+                for server in servers:
+                    server.call_log = call_log
+                result = run_dsc(args.command, config_dir, make_env(args, home, bin_dir, cert_dir, call_log), output)
+                result.update(count_calls(call_log))
+                result.update({"nodes": node_count, "parallel": parallel, "run": "rerun" if run else "first"})
+                results.append(result)
+
+                if result["exit_code"] != 0:
+                    with open(output) as handle:
+                        tail = handle.readlines()[-10:]
+                    sys.stderr.write("dsc exited with {} ({} nodes), last output:\n{}".format(
+                        result["exit_code"], node_count, "".join(tail)))
+        finally:
+            for server in servers:
+                server.shutdown()
+                server.server_close()
+
+        return results
+    finally:
+        if args.keep:
+            print("scratch directory: {}".format(scratch))
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main():
+    args = get_arguments()
+
+    header = "{:>6} {:>8} {:>6} {:>10} {:>8} {:>11} {:>9} {:>8} {:>5}".format(
+        "nodes", "parallel", "run", "seconds", "spawns", "round-trips", "api calls", "peak MB", "exit")
+    print(header)
+    print("-" * len(header))
+
+    results = []
+    for nodes in args.nodes:
+        for parallel in args.parallel:
+            for result in benchmark(args, nodes, parallel):
+                results.append(result)
+                print("{nodes:>6} {parallel:>8} {run:>6} {seconds:>10.2f} {spawns:>8} {round_trips:>11} "
+                      "{api_calls:>9} {peak_mb:>8} {exit_code:>5}".format(**result))
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    return 1 if any(result["exit_code"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Measure how long dsc takes to start, and fail when it is over its startup budget.
+
+dsc runs from monitoring loops (status, plan), so its startup counts. Every scenario is run in a fresh interpreter a
+number of times, and its median wall-clock time minus the median time of an empty interpreter (python -c pass) is
+compared to the budget of the scenario. The budgets leave about twice the time the scenarios take on a developer
+machine, and grow with the empty interpreter on machines where it starts slower than there, so a slow CI box does not
+fail them; the import checks catch the regressions that matter most (the CLI importing the orchestrator). The status
+scenario runs against a generated dsc.yaml in a scratch HOME whose nodes have no machines yet, so nothing is probed and
+the binaries do not have to be installed. It also checks that the CLI does not import what the command does not need,
+and that importing dsc does not change the environment. When a scenario is over budget, its slowest imports (python -X
+importtime) are printed.
+
+Exits with 1 when a scenario is over budget or a check fails.
+
+    python bench/startup.py --runs 20
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import run  # noqa: E402
+
+ROOT_DIR = run.ROOT_DIR
+
+# Arguments of the interpreter per scenario, and its budget in milliseconds on top of the empty interpreter
+SCENARIOS = OrderedDict([
+    ("import dsc.__main__", (["-c", "import dsc.__main__"], 80)),
+    ("dsc --help", (["-m", "dsc", "--help"], 100)),
+    ("import dsc.core", (["-c", "import dsc.core"], 300)),
+    ("dsc status", (["-m", "dsc", "-c", "{config_dir}", "status"], 400)),
+])
+# Milliseconds an empty interpreter takes on the machine the budgets were set on, the budgets are scaled up by the
+# factor it is slower here
+REFERENCE_BASELINE = 15.0
+
+# Modules the CLI must not import before it knows the command
+CLI_LAZY_MODULES = ["dsc.core", "yaml", "asyncio", "http.client", "concurrent.futures", "tarfile"]
+# Modules status must not import: it does not run any program
+STATUS_LAZY_MODULES = ["asyncio", "dsc.runner", "tarfile"]
+
+CHECK_SCRIPT = """
+import json, os, sys
+path = os.environ["PATH"]
+import dsc.__main__
+cli = [name for name in {cli} if name in sys.modules]
+dsc.__main__.main(["-c", {config_dir!r}, "status", "--json"])
+status = [name for name in {status} if name in sys.modules]
+sys.stderr.write(json.dumps({{"cli": cli, "status": status, "path_changed": os.environ["PATH"] != path}}) + "\\n")
+"""
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Measure the startup time of dsc against its budget")
+    parser.add_argument("--runs", metavar="N", type=int, default=10, help="Runs per scenario (default: 10)")
+    parser.add_argument("--nodes", metavar="N", type=int, default=10,
+                        help="Nodes in the config of the status scenario (default: 10)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply the budgets by this factor, for slow machines (default: 1)")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON to FILE")
+
+    return parser.parse_args()
+
+
+def measure(arguments: list, env: dict, cwd: str, runs: int) -> float:
+    """
+    Run the interpreter with some arguments
+    :return: median wall-clock time in milliseconds
+    :raises RuntimeError: when the interpreter exits with an error
+    """
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.run([sys.executable] + arguments, env=env, cwd=cwd, stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            raise RuntimeError("exited with {}: {}".format(process.returncode, process.stderr.strip()[-500:]))
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def slowest_imports(arguments: list, env: dict, cwd: str, count: int = 10) -> list:
+    """
+    Imports with the most cumulative time, from python -X importtime
+    :return: lines of the report
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime"] + arguments, env=env, cwd=cwd,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return ["{:>8.1f}ms {}".format(cumulative / 1000, name)
+            for cumulative, name in sorted(imports, reverse=True)[:count]]
+
+
+def check_imports(env: dict, cwd: str, config_dir: str) -> list:
+    """
+    Check that the CLI and status only import what they need, and that importing dsc leaves PATH alone
+    :return: the problems found
+    """
+    script = CHECK_SCRIPT.format(cli=CLI_LAZY_MODULES, status=STATUS_LAZY_MODULES, config_dir=config_dir)
+    process = subprocess.run([sys.executable, "-c", script], env=env, cwd=cwd, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        return ["the import check failed:\n{}".format(process.stderr)]
+    result = json.loads(process.stderr.splitlines()[-1])
+
+    problems = []
+    if result["cli"]:
+        problems.append("importing the CLI imports {}".format(", ".join(result["cli"])))
+    if result["status"]:
+        problems.append("status imports {}".format(", ".join(result["status"])))
+    if result["path_changed"]:
+        problems.append("importing dsc changes PATH")
+    return problems
+
+
+def main():
+    args = get_arguments()
+
+    scratch = tempfile.mkdtemp(prefix="dsc-startup-")
+    try:
+        home = os.path.join(scratch, "home")
+        config_dir = os.path.join(scratch, "config")
+        os.makedirs(home)
+        os.makedirs(config_dir)
+        run.make_config(config_dir, args.nodes, 1)
+        env = os.environ.copy()
+        env.update({"HOME": home, "PYTHONPATH": ROOT_DIR})
+
+        baseline = measure(["-c", "pass"], env, scratch, args.runs)
+        scale = args.scale * max(1.0, baseline / REFERENCE_BASELINE)
+        header = "{:<22} {:>10} {:>10} {:>10}".format("scenario", "ms", "budget", "result")
+        print("empty interpreter: {:.1f}ms (subtracted), budgets scaled by {:.2f}".format(baseline, scale))
+        print(header)
+        print("-" * len(header))
+
+        results = []
+        over = []
+        for name, (arguments, budget) in SCENARIOS.items():
+            arguments = [argument.format(config_dir=config_dir) for argument in arguments]
+            try:
+                elapsed = measure(arguments, env, scratch, args.runs) - baseline
+            except RuntimeError as ex:
+                print("{:<22} {}".format(name, ex))
+                results.append({"scenario": name, "error": str(ex), "passed": False})
+                over.append((name, arguments))
+                continue
+            budget *= scale
+            passed = elapsed <= budget
+            print("{:<22} {:>10.1f} {:>10.0f} {:>10}".format(name, elapsed, budget, "ok" if passed else "OVER"))
+            results.append({"scenario": name, "ms": round(elapsed, 1), "budget": budget, "passed": passed})
+            if not passed:
+                over.append((name, arguments))
+
+        for name, arguments in over:
+            print("\nSlowest imports of {}:".format(name))
+            print("\n".join(slowest_imports(arguments, env, scratch)))
+
+        problems = check_imports(env, scratch, config_dir)
+        for problem in problems:
+            print("FAIL: {}".format(problem))
+
+        if args.json:
+            with open(args.json, "w") as handle:
+                json.dump({"baseline": round(baseline, 1), "results": results, "problems": problems}, handle,
+                          indent=2)
+
+        return 1 if over or problems else 0
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
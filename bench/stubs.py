@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Stand-in for docker-machine, docker-compose, docker and ssh, used by the benchmark harness (bench/run.py).
+
+The program to emulate is taken from the name the stub is called with (the harness symlinks it). Machines are faked
+in the regular docker-machine layout (~/.docker/machine/machines/<name>/config.json), so dsc runs against the stubs
+without any changes. Every invocation is appended to the call log.
+
+Environment:
+    DSC_BENCH_LOG            file to append one line per invocation to
+    DSC_BENCH_LATENCY        seconds every invocation takes (default 0)
+    DSC_BENCH_LATENCY_<KIND> latency for one kind of invocation, e.g. DSC_BENCH_LATENCY_CREATE, _PROVISION, _SSH
+    DSC_BENCH_FAILURE_RATE   chance (0-1) that a create or provision fails (default 0)
+    DSC_BENCH_THROTTLE_RATE  chance (0-1) that a create is throttled by the provider API, a transient error (default 0)
+    DSC_BENCH_OUTPUT_LINES   number of progress lines printed by create and provision (default 20)
+    DSC_BENCH_CERTS          directory with the ca.pem, cert.pem and key.pem to give every machine, so dsc can reach
+                             the stand-in engine API (bench/engine.py) on the loopback address of the machine
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import time
+
+MACHINE_DIR = os.path.join(os.path.expanduser("~"), ".docker", "machine", "machines")
+CLIENT_CERTS = ["ca.pem", "cert.pem", "key.pem"]
+MACHINE_FILES = ["ca.pem", "ca-key.pem", "cert.pem", "key.pem", "server.pem", "server-key.pem", "id_rsa"]
+
+
+def main(program, args):
+    kind = _kind(program, args)
+    _log(program, kind, args)
+    time.sleep(float(os.environ.get("DSC_BENCH_LATENCY_{}".format(kind.upper()),
+                                    os.environ.get("DSC_BENCH_LATENCY", 0))))
+
+    handler = {
+        "docker-machine": docker_machine,
+        "docker-compose": docker_compose,
+        "docker": docker,
+        "ssh": ssh,
+    }.get(program)
+
+    if handler is None:
+        sys.stderr.write("unknown stub: {}\n".format(program))
+        return 127
+
+    return handler(args)
+
+
+def docker_machine(args):
+    command = args[0] if args else ""
+
+    if command == "create":
+        name = args[-1]
+        if random.random() < float(os.environ.get("DSC_BENCH_THROTTLE_RATE", 0)):
+            return _error("Error creating machine: Error in driver during machine creation: RequestLimitExceeded: "
+                          "Request limit exceeded. status code: 503")
+        _maybe_fail("create", name)
+        path = os.path.join(MACHINE_DIR, name)
+        os.makedirs(path, exist_ok=True)
+        for file in MACHINE_FILES:
+            with open(os.path.join(path, file), "w") as handle:
+                handle.write("{} {}\n".format(file, name))
+        cert_path = os.environ.get("DSC_BENCH_CERTS")
+        if cert_path:
+            for file in CLIENT_CERTS:
+                shutil.copy(os.path.join(cert_path, file), os.path.join(path, file))
+        with open(os.path.join(path, "config.json"), "w") as handle:
+            json.dump(_machine_config(name, path, args), handle)
+        _progress("create", name)
+        return 0
+
+    if command == "ip":
+        name = args[1]
+        if not os.path.isdir(os.path.join(MACHINE_DIR, name)):
+            return _error("Host does not exist: \"{}\"".format(name))
+        print(public_ip(name))
+        return 0
+
+    if command == "ssh":
+        return _remote(args[1], " ".join(args[2:]))
+
+    if command == "scp":
+        return 0
+
+    if command == "provision":
+        _maybe_fail("provision", args[1])
+        # Like docker-machine, provision generates a new server certificate (and copies it to the node)
+        with open(os.path.join(MACHINE_DIR, args[1], "server.pem"), "w") as handle:
+            handle.write("server.pem {} {}\n".format(args[1], time.time()))
+        _progress("provision", args[1])
+        return 0
+
+    if command == "rm":
+        for name in args[1:]:
+            if not name.startswith("-"):
+                shutil.rmtree(os.path.join(MACHINE_DIR, name), ignore_errors=True)
+        return 0
+
+    if command == "ls":
+        for name in sorted(os.listdir(MACHINE_DIR)) if os.path.isdir(MACHINE_DIR) else []:
+            print(name)
+        return 0
+
+    return 0
+
+
+def docker_compose(args):
+    return 0
+
+
+def docker(args):
+    if "DOCKER_HOST" not in os.environ and args and args[0] in ["pull", "inspect", "save"]:
+        # Local images, for image prewarming
+        if args[0] == "inspect":
+            print("sha256:{}".format("0" * 64))
+        elif args[0] == "save":
+            with open(args[args.index("-o") + 1], "wb") as handle:
+                handle.write(b"\0" * 1024)
+        return 0
+
+    cert_path = os.environ.get("DOCKER_CERT_PATH")
+    if cert_path is None or not os.path.isdir(cert_path):
+        return _error("Cannot connect to the Docker daemon. Is the docker daemon running on this host?")
+
+    if os.environ.get("DOCKER_HOST", "").endswith(":3376"):
+        with open(os.path.join(cert_path, "config.json")) as handle:
+            if not json.load(handle)["HostOptions"]["SwarmOptions"]["IsSwarm"]:
+                return _error("Cannot connect to the Docker daemon. Is the docker daemon running on this host?")
+
+    if args and args[0] == "info":
+        print("Containers: 1")
+        print("Name: {}".format(os.path.basename(cert_path)))
+
+    return 0
+
+
+def ssh(args):
+    if "-O" in args:
+        return 0
+
+    # The node is identified by its key, which docker-machine keeps in the machine directory
+    name = os.path.basename(os.path.dirname(args[args.index("-i") + 1]))
+    return _remote(name, args[-1])
+
+
+def public_ip(name):
+    # Loopback addresses, so the stand-in engine API can answer for every machine
+    return "127.{}.{}.{}".format(*_address(name))
+
+
+def cluster_ip(name):
+    return "10.{}.{}.{}".format(*_address(name))
+
+
+def _remote(name, command):
+    if not os.path.isdir(os.path.join(MACHINE_DIR, name)):
+        return _error("Host does not exist: \"{}\"".format(name))
+
+    if "cluster_ip=" in command:
+        # Facts script
+        print("cluster_ip={}/24".format(cluster_ip(name)))
+        print("addresses=127.0.0.1/8 {}/8 {}/24".format(public_ip(name), cluster_ip(name)))
+        print("cpus=2\nmemory_kb=2048000\nkernel=4.4.0-stub\ndocker_version=1.12.6\nconsul=")
+    elif "ip addr sh" in command:
+        print("{}/24".format(cluster_ip(name)))
+    elif "tar -xzf -" in command or command == "docker load":
+        # Remote batch or image: the archive comes in over stdin
+        sys.stdin.buffer.read()
+
+    return 0
+
+
+def _machine_config(name, path, args):
+    return {
+        "Name": name,
+        "DriverName": args[args.index("-d") + 1] if "-d" in args else "none",
+        "Driver": {
+            "IPAddress": public_ip(name),
+            "MachineName": name,
+            "SSHUser": "docker",
+            "SSHPort": 22,
+            "SSHKeyPath": os.path.join(path, "id_rsa"),
+            "SwarmMaster": False,
+            "SwarmHost": "tcp://0.0.0.0:3376",
+            "SwarmDiscovery": "",
+        },
+        "HostOptions": {
+            "EngineOptions": {"ArbitraryFlags": [], "Env": None, "Labels": []},
+            "SwarmOptions": {"IsSwarm": False, "Master": False, "Discovery": "", "ArbitraryFlags": []},
+            "AuthOptions": {"CertDir": path, "StorePath": path, "ServerCertSANs": []},
+        },
+    }
+
+
+def _address(name):
+    value = int(hashlib.md5(name.encode()).hexdigest()[:6], 16)
+    return (value >> 16) % 254 + 1, (value >> 8) % 256, value % 254 + 1
+
+
+def _kind(program, args):
+    if program == "docker-machine":
+        return args[0] if args else "machine"
+    if program == "docker-compose":
+        return "compose"
+    if program == "docker":
+        return args[0] if args else "docker"
+    return "ssh-control" if "-O" in args else "ssh"
+
+
+def _log(program, kind, args, path=None):
+    path = path or os.environ.get("DSC_BENCH_LOG")
+    if path is None:
+        return
+
+    # One short write per line with O_APPEND, so concurrent stubs never interleave
+    handle = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(handle, "{:.6f}\t{}\t{}\t{}\n".format(time.time(), program, kind, " ".join(args)[:200]).encode())
+    finally:
+        os.close(handle)
+
+
+def _progress(command, name):
+    for line in range(int(os.environ.get("DSC_BENCH_OUTPUT_LINES", 20))):
+        print("({}) {} step {}...".format(name, command, line + 1))
+
+
+def _maybe_fail(command, name):
+    if random.random() < float(os.environ.get("DSC_BENCH_FAILURE_RATE", 0)):
+        sys.exit(_error("Error {} {}: simulated failure".format(command, name)))
+
+
+def _error(message):
+    sys.stderr.write("{}\n".format(message))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(os.path.basename(sys.argv[0]), sys.argv[1:]))
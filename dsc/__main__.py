@@ -1,47 +1,76 @@
 import os
 import sys
 
-from dsc.const import DOCKER_MACHINE_BIN, DOCKER_COMPOSE_BIN, DOCKER_BIN, CONFIG_FILENAME
-from dsc.core import DSC, Config
-from dsc.startup import load_config_file, get_arguments, ensure_config_path
+from dsc.binaries import BinaryNotFound, require
+from dsc.const import CONFIG_FILENAME
+from dsc.startup import COMMANDS, load_config_file, get_arguments, ensure_config_path
+from dsc.trace import tracer
 
 
 def bootstrap(args):
     config_dir = os.path.join(os.getcwd(), args.config)
     ensure_config_path(config_dir)
 
-    # Check for docker-machine
-    if DOCKER_MACHINE_BIN is None:
-        print("Docker Machine not found! Refer to the Docker manual on how to install it for your platform.")
-        sys.exit(1)
+    # Check for the programs the command runs, the others are not looked up at all
+    if not args.dry_run:
+        try:
+            for program in COMMANDS[args.command].programs:
+                require(program)
+        except BinaryNotFound as ex:
+            print(ex)
+            sys.exit(1)
 
-    # Check for docker-compose
-    if DOCKER_COMPOSE_BIN is None:
-        print("Docker Compose not found! Refer to the Docker manual on how to install it for your platform.")
-        sys.exit(1)
-
-    # Check for docker
-    if DOCKER_BIN is None:
-        print("Docker not found! Refer to the Docker manual on how to install it for your platform.")
-        sys.exit(1)
+    # Imported here, so --help and argument errors do not load the whole orchestrator
+    from dsc.core import DSC, Config
 
     app = DSC()
     app.config = Config()
     app.config.config_dir = config_dir
-    app.config.machine_bin = DOCKER_MACHINE_BIN
-    app.config.compose_bin = DOCKER_COMPOSE_BIN
-    app.config.docker_bin = DOCKER_BIN
 
-    app = load_config_file(app.config.path(config_dir, CONFIG_FILENAME), app)
+    try:
+        app = load_config_file(app.config.path(config_dir, CONFIG_FILENAME), app)
+    except ValueError as ex:
+        print("Invalid configuration: {}".format(ex) if str(ex) else "Invalid configuration")
+        sys.exit(1)
+
+    if args.parallel is not None:
+        app.config.parallelism = args.parallel
+
+    app.config.resume = not args.fresh
 
     return app
 
 
-def main():
-    args = get_arguments()
+def main(argv=None):
+    args = get_arguments(argv=argv)
 
     app = bootstrap(args)
-    app.start()
+
+    commands = {
+        "start": app.start,
+        "plan": app.plan,
+        "apply": app.apply,
+        "add": lambda: app.add(args.nodes),
+        "remove": lambda: app.remove(args.nodes),
+        "status": lambda: app.status(args.json, args.timeout),
+        "destroy": lambda: app.destroy(args.yes),
+    }
+    if args.dry_run:
+        commands["start"] = app.dry_run
+        commands["apply"] = lambda: app.dry_run(force=False)
+    try:
+        commands[args.command]()
+    finally:
+        report_timings(args)
+
+
+def report_timings(args):
+    if args.trace:
+        tracer.export_jsonl(args.trace)
+    if args.trace_chrome:
+        tracer.export_chrome(args.trace_chrome)
+    if args.timings:
+        print(tracer.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+import io
+import os
+import posixpath
+import stat
+from typing import List, Tuple
+
+from dsc.nodes import Node
+
+BATCH_SCRIPT = "batch.sh"
+
+# Unpacks the archive from stdin into a temporary directory and runs the batch script from it
+BATCH_COMMAND = "d=$(mktemp -d) && tar -xzf - -C $d && sh $d/{script} $d; rc=$?; rm -rf $d; exit $rc".format(
+    script=BATCH_SCRIPT)
+
+
+class RemoteBatch(object):
+    """
+    Queue of file uploads and shell steps for a node, sent as one archive over stdin and executed as one script,
+    so the whole batch costs a single remote session instead of one scp/ssh per step
+    """
+
+    def __init__(self, node: Node):
+        self.node = node
+        self.uploads = []  # type: List[Tuple[str, bytes, int]]
+        self.steps = []  # type: List[str]
+
+    def __len__(self):
+        return len(self.uploads) + len(self.steps)
+
+    def upload(self, local_path: str, remote_path: str, mode: int = None) -> None:
+        """
+        Queue a local file for upload (as root) to remote_path
+        :param local_path:
+        :param remote_path:
+        :param mode: file mode on the node, defaults to the mode of the local file
+        """
+        with open(local_path, "rb") as handle:
+            data = handle.read()
+
+        if mode is None:
+            mode = stat.S_IMODE(os.stat(local_path).st_mode)
+
+        self.upload_data(data, remote_path, mode)
+
+    def upload_data(self, data: bytes, remote_path: str, mode: int = 0o644) -> None:
+        """
+        Queue data for upload (as root) to remote_path
+        :param data:
+        :param remote_path:
+        :param mode:
+        """
+        self.uploads.append((remote_path, data, mode))
+
+    def run(self, command: str, check: bool = True) -> None:
+        """
+        Queue a shell step
+        :param command:
+        :param check: abort the batch when the step fails
+        """
+        self.steps.append(_step(command, check))
+
+    def script(self) -> str:
+        """
+        Build the shell script that installs the uploads and runs the steps. It gets the directory holding the
+        unpacked archive as its first argument.
+        """
+        lines = []
+        for index, (remote_path, _, mode) in enumerate(self.uploads):
+            lines.append(_step("sudo mkdir -p {dir} && sudo install -m {mode:o} \"$1/{index}\" {path}".format(
+                dir=posixpath.dirname(remote_path), mode=mode, index=index, path=remote_path)))
+        lines.extend(self.steps)
+        return "\n".join(lines) + "\n"
+
+    def archive(self) -> bytes:
+        """
+        Build the gzipped tar archive with the uploads and the batch script
+        """
+        # Imported on first use, commands that do not change nodes never need it
+        import tarfile
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+            members = [(str(index), data, mode) for index, (_, data, mode) in enumerate(self.uploads)]
+            members.append((BATCH_SCRIPT, self.script().encode(), 0o755))
+            for name, data, mode in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = mode
+                archive.addfile(info, io.BytesIO(data))
+
+        return buffer.getvalue()
+
+    @staticmethod
+    def command() -> str:
+        return BATCH_COMMAND
+
+
+def _step(command: str, check: bool = True) -> str:
+    return "{{ {}; }} || {}".format(command, "exit $?" if check else "true")
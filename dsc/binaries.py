@@ -0,0 +1,80 @@
+import os
+import shutil
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+# Searched after PATH, the Docker installers put their programs there
+EXTRA_PATH = "/usr/local/bin"
+
+DOCKER_MACHINE = "docker-machine"
+DOCKER_COMPOSE = "docker-compose"
+DOCKER = "docker"
+SSH = "ssh"
+
+# Name of every program, for the error when it is missing
+PROGRAM_NAMES = OrderedDict([
+    (DOCKER_MACHINE, "Docker Machine"),
+    (DOCKER_COMPOSE, "Docker Compose"),
+    (DOCKER, "Docker"),
+    (SSH, "OpenSSH"),
+])
+
+
+class BinaryNotFound(RuntimeError):
+    def __init__(self, program: str):
+        super().__init__("{} not found! Refer to the Docker manual on how to install it for your platform.".format(
+            PROGRAM_NAMES.get(program, program)))
+        self.program = program
+
+
+@lru_cache(maxsize=None)
+def which(program: str) -> Optional[str]:
+    """
+    Path of a program, looked up once per process
+    :param program:
+    :return: None when it is not installed
+    """
+    return shutil.which(program, path=os.pathsep.join([os.environ.get("PATH", os.defpath), EXTRA_PATH]))
+
+
+def require(program: str) -> str:
+    """
+    Path of a program that has to be installed
+    :param program:
+    :return:
+    :raises BinaryNotFound:
+    """
+    path = which(program)
+    if path is None:
+        raise BinaryNotFound(program)
+    return path
+
+
+class Binary(object):
+    """
+    Attribute with the path of a program: looked up on first use, unless it was set
+    """
+
+    def __init__(self, program: str, required: bool = True):
+        """
+        :param program:
+        :param required: raise BinaryNotFound when the program is not installed, instead of returning None
+        """
+        self.program = program
+        self.required = required
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = "_" + name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        path = instance.__dict__.get(self.name)
+        if path is None:
+            path = require(self.program) if self.required else which(self.program)
+        return path
+
+    def __set__(self, instance, path: Optional[str]):
+        instance.__dict__[self.name] = path
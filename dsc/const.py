@@ -1,14 +1,30 @@
 import os
-import shutil
 
-os.environ["PATH"] += ":/usr/local/bin"
 CONFIG_FILENAME = "dsc.yaml"
-DOCKER_MACHINE_BIN = shutil.which("docker-machine")
-DOCKER_COMPOSE_BIN = shutil.which("docker-compose")
-DOCKER_BIN = shutil.which("docker")
+STATE_FILENAME = "state.json"
+APPLIED_FILENAME = "applied.json"
+JOURNAL_FILENAME = "journal.jsonl"
+LATENCIES_FILENAME = "latencies.json"
+FACTS_DIRNAME = "facts"
+MANIFESTS_DIRNAME = "manifests"
+LOGS_DIRNAME = "logs"
+IMAGES_DIRNAME = "images"
+# Size at which a node log file is rotated, and the number of rotated files kept per node
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
 
 DEFAULT_CLUSTER_INTERFACE = "eth1"
 
+# Seconds to wait for the engine API when probing the state of a node
+STATE_PROBE_TIMEOUT = 5
+# Number of nodes status probes at the same time
+STATUS_PARALLELISM = 256
+# Requests status makes to a node at most, one after the other: engine ping, swarm manager ping (masters) and the list
+# of consul containers
+STATUS_REQUESTS = 3
+# Number of machines destroy removes at the same time, unless parallelism is set higher
+DESTROY_PARALLELISM = 16
+
 MACHINE_DRIVERS = [
     "amazonec2", "azure", "digitalocean", "exoscale", "generic", "google", "hyperv", "openstack",
     "rackspace", "softlayer", "virtualbox", "vmwarevcloudair", "vmwarefusion", "vmwarevsphere"
@@ -16,6 +32,14 @@ MACHINE_DRIVERS = [
 
 CONSUL_SERVICE = "consul://consul.service.{domain}:8500"
 
+CONSUL_COMPOSE_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "compose", "consul"))
+
+CONSUL_CERTS = [
+    "ca.pem",
+    "server.pem",
+    "server-key.pem",
+]
+
 SWARM_MASTER_OPTIONS = [
     "replication=true",
     "advertise={}:3376",
@@ -1,12 +1,35 @@
-import re
+import json
+import queue
 import sys
-from typing import List
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
 
+from dsc.batch import RemoteBatch
+from dsc.binaries import Binary, DOCKER, DOCKER_COMPOSE, DOCKER_MACHINE, SSH, which
+from dsc.dryrun import CommandLatencies, DryRun
 from dsc.const import *
+from dsc.engine import EngineError, EnginePool
+from dsc.facts import FactStore, facts_script, parse_facts
+from dsc.images import ImagePrewarm, PREWARM_MODES, compose_images
+from dsc.inventory import ConfigError, Inventory
+from dsc.journal import StepJournal
+from dsc.machine import MachineConfigStore, engine_opt_flags, merge_flags, merge_list
 from dsc.nodes import NodeType, Node, NodeState
+from dsc.output import close_logs, log, open_logs, set_prefix
+from dsc.readiness import ConsulClient, NotReady, check, wait_for
+from dsc.reconcile import AppliedState, CONFIG_STEPS, CONSUL_STEPS, ROLLED_OUT_STEPS, digest, file_digest
+from dsc.scheduler import Scheduler, Task
+from dsc.ssh import SSHPool
+from dsc.state import StateCache
+from dsc.sync import FileSync
+from dsc.throttle import DriverLimiter, driver_limits
+from dsc.trace import traced, tracer
+from dsc.tuning import ConsulTuning
 from dsc.startup import get_default_config_dir
-from dsc.util import dict_has_item, get_machine_config, run_command, get_env_for_node, \
-    save_machine_config, write_file, read_file
+from dsc.util import run_command, get_env_for_node, write_file, read_file
 
 
 class DSC(object):
@@ -14,52 +37,641 @@ class DSC(object):
         self.config = Config()
         self.masters = None
         self.workers = None
+        self._ssh_pool = None
+        self._state_cache = None
+        self._applied = None
+        self._facts = None
+        self._file_sync = None
+        self._journal = None
+        self._images = None
+        self._driver_limiter = None
+        # Time (monotonic) by which the nodes of the running rollout have to be ready
+        self.ready_deadline = None
+        self.machine_configs = MachineConfigStore()
+        self.engines = EnginePool(STATE_PROBE_TIMEOUT)
+        self.run_command = run_command
 
-    def start(self) -> None:
+    @property
+    def ssh_pool(self) -> SSHPool:
+        if self._ssh_pool is None:
+            self._ssh_pool = SSHPool(self.config.ssh_bin if self.config.ssh_multiplexing else None,
+                                     self.machine_configs, self.config.ssh_idle_timeout)
+        return self._ssh_pool
+
+    @property
+    def state_cache(self) -> StateCache:
+        if self._state_cache is None:
+            self._state_cache = StateCache(self.config.path(STATE_FILENAME), self.config.state_ttl)
+        return self._state_cache
+
+    @property
+    def applied(self) -> AppliedState:
+        if self._applied is None:
+            self._applied = AppliedState(self.config.path(APPLIED_FILENAME))
+        return self._applied
+
+    @property
+    def facts(self) -> FactStore:
+        if self._facts is None:
+            self._facts = FactStore(self.config.path(FACTS_DIRNAME))
+        return self._facts
+
+    @property
+    def file_sync(self) -> FileSync:
+        if self._file_sync is None:
+            self._file_sync = FileSync(self.config.path(MANIFESTS_DIRNAME),
+                                       lambda node, command: self._run_ssh(node, command, show_output=False))
+        return self._file_sync
+
+    @property
+    def images(self) -> ImagePrewarm:
+        if self._images is None:
+            self._images = ImagePrewarm(self.config.path(IMAGES_DIRNAME), self.config.image_prewarm,
+                                        self.config.registry_mirror,
+                                        lambda command: self._run_docker(command, show_output=False),
+                                        lambda node, command, input=None: self._run_ssh(node, command,
+                                                                                        show_output=False,
+                                                                                        input=input))
+        return self._images
+
+    @property
+    def driver_limiter(self) -> DriverLimiter:
+        if self._driver_limiter is None:
+            self._driver_limiter = DriverLimiter(self.config.drivers)
+        return self._driver_limiter
+
+    @property
+    def journal(self) -> StepJournal:
+        if self._journal is None:
+            self._journal = StepJournal(self.config.path(JOURNAL_FILENAME))
+        return self._journal
+
+    def start(self, force: bool = True) -> None:
         """
         Create and configure the swarm
+        :param force: apply all configuration steps, also the ones of which the inputs did not change
+        """
+        self._load_nodes()
+        self._execute(self._schedule_rollout(force), "Creating swarm...", "Failed to create swarm", journaled=True)
+
+        removed = self._removed_nodes()
+        if removed:
+            print("{} node(s) are no longer in the config, remove them with `dsc remove`: {}".format(
+                len(removed), ", ".join([node.name for node in removed])))
+
+    def add(self, names: List[str] = None) -> None:
+        """
+        Roll out nodes without touching the rest of the cluster: only the consul servers are reconfigured, and only
+        when a master is added
+        :param names: nodes to add, defaults to the nodes in the config that have not been rolled out yet
+        """
+        self._load_nodes()
+        # Prewarming records the image before the node is configured, so a node that failed halfway is added again
+        nodes = self._select_nodes(names) if names else \
+            [node for node in self.masters + self.workers if not self.applied.known(node, ROLLED_OUT_STEPS)]
+        if not nodes:
+            print("No new nodes to add")
+            return
+
+        print("Adding node(s): {}".format(", ".join([node.name for node in nodes])))
+        self._execute(self._schedule_add(nodes), "Adding nodes...", "Failed to add nodes")
+
+    def remove(self, names: List[str] = None) -> None:
+        """
+        Drain and remove nodes concurrently. The consul servers that remain are reconfigured when a master is removed.
+        :param names: nodes to remove, defaults to the nodes that were rolled out but are no longer in the config
+        """
+        self._load_nodes()
+        nodes = self._select_nodes(names, known=True) if names else self._removed_nodes()
+        if not nodes:
+            print("No nodes to remove")
+            return
+
+        for node in nodes:
+            if node in self.masters + self.workers:
+                print("Note: {} is still in the config, the next start or apply creates it again".format(node.name))
+
+        print("Removing node(s): {}".format(", ".join([node.name for node in nodes])))
+        self._execute(self._schedule_remove(nodes), "Removing nodes...", "Failed to remove nodes")
+
+    def destroy(self, confirmed: bool = False) -> None:
+        """
+        Tear down the swarm: stop consul and remove the machines of all nodes concurrently (within the limits of their
+        drivers), and forget everything dsc knows about them
+        :param confirmed: do not ask for confirmation
         """
-        self.masters = self._create_nodes(NodeType.master)
-        print("Swarm master(s): {}".format(", ".join([node.name for node in self.masters])))
+        self._load_nodes(verbose=False)
+        nodes = [node for node in self.masters + self.workers + self._removed_nodes()
+                 if os.path.isdir(self.config.machine_path(node.name)) or self.applied.known(node)]
+        if not nodes:
+            print("No machines to destroy")
+            return
+
+        print("Machine(s) to destroy: {}".format(", ".join([node.name for node in nodes])))
+        if not confirmed:
+            if not sys.stdin.isatty():
+                print("Pass --yes to destroy the machines")
+                sys.exit(1)
+            if input("Destroy {} machine(s)? [y/N] ".format(len(nodes))).strip().lower() not in ["y", "yes"]:
+                print("Nothing destroyed")
+                return
 
-        self.workers = self._create_nodes(NodeType.worker)
-        print("Swarm worker(s): {}".format(", ".join([node.name for node in self.workers])))
+        parallelism = self.config.parallelism if self.config.parallelism > 1 else DESTROY_PARALLELISM
+        scheduler = Scheduler(min(parallelism, len(nodes)))
+        timings = OrderedDict([(node.name, None) for node in nodes])
+        for node in nodes:
+            scheduler.add("destroy {}".format(node.name), self._task(self._destroy_machine, node, timings), node)
 
-        print("Creating swarm master(s)...")
-        self._create_machines(self.masters)
+        self._execute(scheduler, "Destroying swarm...", "Failed to destroy swarm",
+                      summary=lambda: _describe_timings(timings))
+        # The whole cluster is gone, an interrupted rollout has nothing left to resume
+        self.journal.close(complete=True)
 
-        print("Creating swarm worker(s)...")
-        self._create_machines(self.workers)
+    def _execute(self, scheduler: Scheduler, message: str, failure: str, summary: Callable[[], str] = None,
+                 journaled: bool = False) -> None:
+        """
+        Run scheduled tasks with the log files open
+        :param scheduler:
+        :param message: printed when the tasks start
+        :param failure: printed (with the reason) when tasks failed
+        :param summary: returns what to print once the tasks are done, whether they succeeded or not
+        :param journaled: journal the steps and resume an interrupted run (the rollout); other commands leave the
+                          journal of an interrupted rollout alone
+        """
+        open_logs(self.config.path(LOGS_DIRNAME), LOG_MAX_BYTES, LOG_BACKUPS, self.config.compact_output)
+        if journaled:
+            resumed = self.journal.open(self.config.resume)
+            if resumed:
+                print("Resuming interrupted run, skipping {} completed step(s)".format(resumed))
 
+        try:
+            print(message)
+            self._rollout(scheduler)
+        except RuntimeError as rte:
+            print("{}: {}".format(failure, rte))
+            sys.exit(1)
+        finally:
+            self.journal.close()
+            self.ssh_pool.close_all()
+            self.engines.close_all()
+            self.state_cache.save()
+            self.applied.save()
+            CommandLatencies(self.config.path(LATENCIES_FILENAME)).update(tracer.finished())
+            close_logs()
+            if summary is not None:
+                print(summary())
+
+        if journaled:
+            self.journal.close(complete=True)
         print("All done!")
 
-    def _create_machines(self, nodes: List[Node]) -> None:
+    def apply(self) -> None:
         """
-        Create and configure machines
-        :param nodes:
+        Create the swarm, but only apply the configuration steps of which the inputs changed since the last run
+        """
+        self.start(force=False)
+
+    def dry_run(self, force: bool = True) -> None:
+        """
+        Run the rollout against a recording command backend: show the commands it would run per node and estimate
+        how long it would take, without changing anything
+        :param force: apply all configuration steps, also the ones of which the inputs did not change
+        """
+        self._load_nodes()
+        nodes = self.masters + self.workers
+        latencies = CommandLatencies(self.config.path(LATENCIES_FILENAME))
+
+        dry_run = DryRun(self.config, nodes)
+        self.run_command = dry_run.run_command
+        # The commands are only recorded, the programs do not have to be installed
+        for attribute, program in [("machine_bin", DOCKER_MACHINE), ("compose_bin", DOCKER_COMPOSE),
+                                   ("docker_bin", DOCKER)]:
+            setattr(self.config, attribute, which(program) or program)
+        self.engines = dry_run.engines(STATE_PROBE_TIMEOUT)
+        # The machines of the dry run never become ready, the rollout does not wait for them. The configured timeout
+        # is kept, as it decides the retry flags of the consul servers.
+        self._wait_ready = lambda node, stage: None
+        # Recorded commands do not reach the API of a driver and never fail transiently, so they are not throttled
+        self._run_driver = lambda node, command, cleanup=None: self._run_machine(command)
+
+        print("Dry run, commands are recorded instead of run...")
+        scheduler = self._schedule_rollout(force)
+        self.journal.open(self.config.resume)
+        try:
+            failed, skipped = scheduler.run()
+        finally:
+            self.journal.close()
+            self.engines.close_all()
+
+        print(dry_run.report(nodes, scheduler, latencies, self.config.parallelism))
+        if failed or skipped:
+            print("The dry run could not {}".format(_describe_tasks(failed, skipped)))
+            sys.exit(1)
+
+    def plan(self) -> None:
+        """
+        Show which machines would be created and which configuration steps would be applied, without changing
+        anything
         """
+        self._load_nodes()
+        nodes = self.masters + self.workers
+
+        try:
+            failed = self._run_parallel(nodes, self._discover_machine)
+        finally:
+            self.ssh_pool.close_all()
+            self.engines.close_all()
+            self.state_cache.save()
+
+        changed = 0
         for node in nodes:
-            self._create_machine(node)
+            if node in failed:
+                continue
+
+            steps = ["create"] + CONFIG_STEPS if node.state == NodeState.new else \
+                self._changed_steps(node, node.desired)
+            changed += 1 if steps else 0
+            print("* {}: {}".format(node.name, ", ".join(steps) if steps else "up to date"))
+
+        removed = self._removed_nodes()
+        for node in removed:
+            print("* {}: remove (no longer in the config)".format(node.name))
+
+        print("{} of {} node(s) to change".format(changed + len(removed), len(nodes) + len(removed)))
+        if failed:
+            print("Could not determine the state of {}".format(", ".join([node.name for node in failed])))
+            sys.exit(1)
+
+    def status(self, as_json: bool = False, timeout: float = STATE_PROBE_TIMEOUT) -> None:
+        """
+        Show the state of every node, its engine and its consul container. All nodes are probed at the same time,
+        states from the state snapshot are used while they are fresh.
+        :param as_json: print JSON instead of a table
+        :param timeout: seconds to wait for every request to a node
+        """
+        self._load_nodes(verbose=not as_json)
+        nodes = self.masters + self.workers
+        self.engines.timeout = timeout
+
+        # Daemon threads, so nodes that do not answer in time do not keep dsc waiting
+        pending = queue.Queue()
         for node in nodes:
-            self._config_machine(node)
+            pending.put(node)
+        results = {}
+        workers = min(len(nodes), STATUS_PARALLELISM)
+
+        def probe() -> None:
+            while True:
+                try:
+                    node = pending.get_nowait()
+                except queue.Empty:
+                    return
+                results[node.name] = self._node_status(node)
 
+        threads = [threading.Thread(target=probe, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        # Every worker probes its nodes one after the other, with up to STATUS_REQUESTS requests per node
+        deadline = time.monotonic() + timeout * STATUS_REQUESTS * -(-len(nodes) // workers) + 1
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        self.state_cache.save()
+        statuses = [results.get(node.name) or OrderedDict([
+            ("node", node.name), ("type", node.node_type.name), ("state", "unknown"), ("engine", "timeout"),
+            ("consul", None), ("cached", False)]) for node in nodes]
+
+        if as_json:
+            print(json.dumps(statuses, indent=2))
+            return
+
+        columns = ["node", "type", "state", "engine", "consul", "cached"]
+        rows = [[column.upper() for column in columns]]
+        rows.extend([["yes" if status[column] is True else "no" if status[column] is False else
+                      str(status[column] or "-") for column in columns] for status in statuses])
+        widths = [max([len(row[index]) for row in rows]) for index in range(len(columns))]
+        for row in rows:
+            print("  ".join([value.ljust(width) for value, width in zip(row, widths)]).rstrip())
+
+    def _node_status(self, node: Node) -> "OrderedDict[str, object]":
+        """
+        Probe a node for status
+        :param node:
+        :return: node, type, state, engine (up, down or None when its address is unknown), consul containers and
+                 whether the state came from the state snapshot
+        """
+        status = OrderedDict([("node", node.name), ("type", node.node_type.name), ("state", NodeState.new.name),
+                              ("engine", None), ("consul", None), ("cached", False)])
+        node.machine_path = self.config.machine_path(node.name)
+        if not os.path.isdir(node.machine_path):
+            return status
+
+        try:
+            node.public_ip = self.machine_configs.get(node)["Driver"].get("IPAddress")
+        except (FileNotFoundError, ValueError, KeyError):
+            node.public_ip = None
+
+        state = self.state_cache.get(node)
+        status["cached"] = state is not None
+        if state is None:
+            state = self._probe_state(node)
+            self.state_cache.set(node, state)
+        status["state"] = state.name
+
+        engine = self.engines.get(node)
+        if engine is not None:
+            try:
+                containers = engine.containers("consul")
+                status["engine"] = "up"
+                status["consul"] = ", ".join(["{} ({})".format(container["Names"][0].lstrip("/"),
+                                                               container.get("Status") or container.get("State"))
+                                              for container in containers]) or "missing"
+            except (EngineError, KeyError, IndexError, TypeError):
+                status["engine"] = "down"
+
+        return status
+
+    def _load_nodes(self, verbose: bool = True) -> None:
+        self.masters, self.workers = self._create_nodes()
+
+        if verbose:
+            print("Swarm master(s): {}".format(", ".join([node.name for node in self.masters])))
+            print("Swarm worker(s): {}".format(", ".join([node.name for node in self.workers])))
+
+    def _select_nodes(self, names: List[str], known: bool = False) -> List[Node]:
+        """
+        Look up nodes by (short) name
+        :param names:
+        :param known: also accept nodes that are no longer in the config, but were rolled out before
+        :return:
+        """
+        candidates = self.masters + self.workers + (self._removed_nodes() if known else [])
+        nodes = []
+        for name in names:
+            matches = [node for node in candidates if name in [node.name, node.shortname]]
+            if not matches:
+                print("Unknown node: {}".format(name))
+                sys.exit(1)
+            if matches[0] not in nodes:
+                nodes.append(matches[0])
+
+        return nodes
+
+    def _removed_nodes(self) -> List[Node]:
+        """
+        Nodes that were rolled out, but are no longer in the config
+        :return:
+        """
+        configured = [node.name for node in self.masters + self.workers]
+        domain = self.config.network["cluster-domain"]
+        nodes = []
+        for name in self.applied.nodes():
+            if name in configured:
+                continue
+            shortname = name[:-len(domain) - 1] if name.endswith("." + domain) else name.split(".")[0]
+            nodes.append(Node.load(name=name, shortname=shortname, domain=domain, config={}))
+
+        return nodes
+
+    def _rollout(self, scheduler: Scheduler) -> None:
+        """
+        Run the tasks of a rollout
+        :param scheduler:
+        """
+        # One deadline for the whole rollout, the waits of the stages and the worker waves do not add up
+        self.ready_deadline = time.monotonic() + self.config.ready_timeout
+        failed, skipped = scheduler.run()
+        if failed or skipped:
+            raise RuntimeError("could not {}".format(_describe_tasks(failed, skipped)))
+
+    def _schedule_rollout(self, force: bool = True) -> Scheduler:
+        """
+        Schedule the creation and configuration of all machines. Every step of every node is a task that runs as soon
+        as the steps it depends on are done, up to config.parallelism tasks at the same time:
+        - the primary master is created first, the other machines are created after it
+        - consul is set up on a node once all masters exist (their cluster IPs are needed for -retry-join)
+        - the primary master is provisioned once all consul servers are set up (the quorum for bootstrap-expect) and
+          its own consul answers, the other masters once the swarm manager of the primary master answers, and the
+          workers after their own consul setup
+        - a node is ready once consul has a leader and knows the node (and its swarm manager answers, for masters)
+        - workers are rolled out in waves of config.worker_wave_size nodes (0: all at once)
+        :param force: apply all configuration steps, also the ones of which the inputs did not change
+        """
+        scheduler = Scheduler(self.config.parallelism)
+        primary = self.masters[0]
+
+        created = {}
+        created[primary] = scheduler.add("create {}".format(primary.name), self._task(self._create_machine, primary),
+                                         primary)
+        for node in self.masters[1:]:
+            created[node] = scheduler.add("create {}".format(node.name), self._task(self._create_machine, node), node,
+                                          requires=[created[primary]])
+
+        masters_created = [created[master] for master in self.masters]
+        configured = {}
+        for node in self.masters:
+            configured[node] = scheduler.add("configure {}".format(node.name),
+                                             self._task(self._config_machine, node, force), node,
+                                             requires=masters_created,
+                                             after=self._schedule_prewarm(scheduler, node, created[node]))
+
+        consul_servers = [configured[master] for master in self.masters]
+        consul_up = scheduler.add("wait for consul {}".format(primary.name),
+                                  self._task(self._wait_ready, primary, "consul"), primary,
+                                  requires=[configured[primary]])
+        provisioned = {}
+        provisioned[primary] = scheduler.add("provision {}".format(primary.name),
+                                             self._task(self._provision_machine, primary), primary,
+                                             requires=consul_servers + [consul_up])
+        swarm_up = scheduler.add("wait for swarm {}".format(primary.name),
+                                 self._task(self._wait_ready, primary, "swarm"), primary,
+                                 requires=[provisioned[primary]])
+        for node in self.masters[1:]:
+            provisioned[node] = scheduler.add("provision {}".format(node.name),
+                                              self._task(self._provision_machine, node), node,
+                                              requires=[configured[node], swarm_up])
+
+        # Consul only has a leader once all servers are provisioned
+        masters_provisioned = [provisioned[master] for master in self.masters]
+        ready = {}
+        for node in self.masters:
+            ready[node] = scheduler.add("ready {}".format(node.name), self._task(self._wait_ready, node, "cluster"),
+                                        node, requires=masters_provisioned)
+
+        wave_size = self.config.worker_wave_size or len(self.workers)
+        previous_wave = []
+        for index in range(0, len(self.workers), wave_size):
+            wave = self.workers[index:index + wave_size]
+            for node in wave:
+                # A wave starts when the previous one is done, whether its nodes succeeded or not
+                created[node] = scheduler.add("create {}".format(node.name),
+                                              self._task(self._create_machine, node), node,
+                                              requires=[created[primary]], after=previous_wave)
+                configured[node] = scheduler.add("configure {}".format(node.name),
+                                                 self._task(self._config_machine, node, force), node,
+                                                 requires=[created[node]] + masters_created,
+                                                 after=self._schedule_prewarm(scheduler, node, created[node]))
+                provisioned[node] = scheduler.add("provision {}".format(node.name),
+                                                  self._task(self._provision_machine, node), node,
+                                                  requires=[configured[node]] + consul_servers)
+                ready[node] = scheduler.add("ready {}".format(node.name),
+                                            self._task(self._wait_ready, node, "cluster"), node,
+                                            requires=[provisioned[node]] + masters_provisioned)
+            previous_wave = [ready[node] for node in wave]
+
+        return scheduler
+
+    def _schedule_add(self, nodes: List[Node]) -> Scheduler:
+        """
+        Schedule the rollout of some nodes. The other masters are only loaded (from the facts cache) for the
+        -retry-join lists, and their consul config is only updated when a master is added.
+        :param nodes: nodes to roll out
+        """
+        scheduler = Scheduler(self.config.parallelism)
+        primary = self.masters[0]
+
+        known = {}
+        known[primary] = scheduler.add("create {}".format(primary.name), self._task(self._create_machine, primary),
+                                       primary) if primary in nodes else \
+            scheduler.add("load {}".format(primary.name), self._task(self._load_machine, primary), primary)
+        for node in self.masters[1:]:
+            known[node] = scheduler.add("create {}".format(node.name), self._task(self._create_machine, node), node,
+                                        requires=[known[primary]]) if node in nodes else \
+                scheduler.add("load {}".format(node.name), self._task(self._load_machine, node), node)
+
+        masters_known = [known[master] for master in self.masters]
+        masters_changed = len([master for master in self.masters if master in nodes]) > 0
+        configured = {}
+        for node in self.masters:
+            if node in nodes or masters_changed:
+                # Masters that are not added are not provisioned, only their consul config is updated
+                configured[node] = scheduler.add("configure {}".format(node.name),
+                                                 self._task(self._config_machine, node, False,
+                                                            None if node in nodes else CONSUL_STEPS), node,
+                                                 requires=masters_known,
+                                                 after=self._schedule_prewarm(scheduler, node, known[node])
+                                                 if node in nodes else [])
+
+        consul_servers = list(configured.values())
+        masters_provisioned = []
+        for node in self.masters:
+            if node in nodes:
+                masters_provisioned.append(scheduler.add("provision {}".format(node.name),
+                                                         self._task(self._provision_machine, node), node,
+                                                         requires=consul_servers))
+        for node in self.masters:
+            if node in nodes:
+                scheduler.add("ready {}".format(node.name), self._task(self._wait_ready, node, "cluster"), node,
+                              requires=masters_provisioned)
+
+        for node in self.workers:
+            if node not in nodes:
+                continue
+            created = scheduler.add("create {}".format(node.name), self._task(self._create_machine, node), node,
+                                    requires=[known[primary]])
+            configured[node] = scheduler.add("configure {}".format(node.name),
+                                             self._task(self._config_machine, node, False), node,
+                                             requires=[created] + masters_known,
+                                             after=self._schedule_prewarm(scheduler, node, created))
+            provisioned = scheduler.add("provision {}".format(node.name), self._task(self._provision_machine, node),
+                                        node, requires=[configured[node]] + consul_servers)
+            scheduler.add("ready {}".format(node.name), self._task(self._wait_ready, node, "cluster"), node,
+                          requires=[provisioned] + masters_provisioned)
+
+        return scheduler
+
+    def _schedule_remove(self, nodes: List[Node]) -> Scheduler:
+        """
+        Schedule the removal of nodes, and the reconfiguration of the remaining consul servers when masters are
+        removed
+        :param nodes: nodes to remove
+        """
+        scheduler = Scheduler(self.config.parallelism)
+        removed = [scheduler.add("remove {}".format(node.name), self._task(self._remove_machine, node), node)
+                   for node in nodes]
+
+        masters = [master for master in self.masters if master not in nodes]
+        masters_changed = len(masters) < len(self.masters) or \
+            len([node for node in nodes if node not in self.workers and self._was_master(node)]) > 0
+        if masters_changed and masters:
+            self.masters = masters
+            loaded = [scheduler.add("load {}".format(node.name), self._task(self._load_machine, node), node)
+                      for node in masters]
+            for node in masters:
+                # The remaining masters are not provisioned, only their consul config is updated
+                scheduler.add("configure {}".format(node.name),
+                              self._task(self._config_machine, node, False, CONSUL_STEPS), node,
+                              requires=loaded, after=removed)
+
+        return scheduler
+
+    def _schedule_prewarm(self, scheduler: Scheduler, node: Node, created: Task) -> List[Task]:
+        """
+        Schedule putting the consul image on a node as soon as it is created, while the other nodes are still being
+        created. Configuring the node waits for it, whether it succeeded or not.
+        :param scheduler:
+        :param node:
+        :param created: task that creates (or loads) the node
+        :return: the prewarm task, none when prewarming is off
+        """
+        if self.config.image_prewarm == "off":
+            return []
+
+        return [scheduler.add("prewarm {}".format(node.name), self._task(self._prewarm_machine, node), node,
+                              requires=[created])]
+
+    @staticmethod
+    def _task(action: Callable, node: Node, *args) -> Callable[[], None]:
+        return lambda: action(node, *args)
+
+    def _run_parallel(self, nodes: List[Node], action: Callable[[Node], None]) -> List[Node]:
+        """
+        Run an action for every node on a bounded worker pool. A failing node does not interrupt the others.
+        :param nodes:
+        :param action:
+        :return: failed nodes
+        """
+        parallelism = max(1, min(self.config.parallelism, len(nodes)))
+
+        def run(node: Node) -> bool:
+            set_prefix("[{}] ".format(node.shortname) if parallelism > 1 else "", node.name)
+            try:
+                action(node)
+                return True
+            except Exception as ex:
+                log("! {} failed: {}".format(node.name, ex))
+                return False
+            finally:
+                set_prefix()
+
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            results = list(executor.map(run, nodes))
+
+        return [node for node, success in zip(nodes, results) if not success]
+
+    @traced("create")
     def _create_machine(self, node: Node) -> None:
         """
         Create a new machine
         :param node:
         """
         if node.config["machine-driver"] not in MACHINE_DRIVERS:
-            print("Machine driver not supported/valid: {}".format(node.config["machine-driver"]))
-            sys.exit(1)
+            raise RuntimeError("Machine driver not supported/valid: {}".format(node.config["machine-driver"]))
 
-        print("* create {}: {}".format(node.name, node.config["machine-driver"]))
+        log("* create {}: {}".format(node.name, node.config["machine-driver"]))
 
         # Set machine path
-        node.machine_path = os.path.join(os.path.expanduser("~"), ".docker", "machine", "machines", node.name)
+        node.machine_path = self.config.machine_path(node.name)
 
-        # Determine current state of the node
-        node.state = self._get_state(node)
-        print("+ current state: {}".format(node.state.name.upper()))
+        # Determine current state of the node, an interrupted run may already have created it
+        create_digest = digest(node.config["machine-driver"], node.config["driver-opts"], node.config["engine-opts"])
+        if self.journal.done(node, "create", create_digest) and os.path.isdir(node.machine_path):
+            node.state = NodeState.bare
+            log("+ already created")
+        else:
+            node.state = self._get_state(node)
+            log("+ current state: {}".format(node.state.name.upper()))
 
         try:
             if node.state == NodeState.new:
@@ -69,272 +681,817 @@ class DSC(object):
                     "engine_options": node.config["engine-opts"] if node.config["engine-opts"] is not None else "",
                     "name": node.name
                 }
-                self._run_machine("create -d {driver} {driver_options} {engine_options} {name}".format(**options))
+                self._run_driver(node, "create -d {driver} {driver_options} {engine_options} {name}".format(**options),
+                                 cleanup=lambda: self._run_machine(["rm", "-y", node.name], raise_error=False,
+                                                                   show_output=False)
+                                 if os.path.isdir(node.machine_path) else None)
+                self.ssh_pool.invalidate(node)
+                self.engines.invalidate(node)
+                self.machine_configs.invalidate(node)
+                self.state_cache.invalidate(node)
+                self.facts.invalidate(node)
+                self.file_sync.reset(node)
+                # Nothing of an earlier machine with the same name has been applied to the new one
+                self.applied.forget(node)
+                self.journal.forget(node)
                 node.state = NodeState.bare
 
             node = self._save_node_data(node)
-            print("+ public IP: {}, cluster IP: {}".format(node.public_ip, node.cluster_ip))
+            log("+ public IP: {}, cluster IP: {}".format(node.public_ip, node.cluster_ip))
+            self.journal.record(node, "create", create_digest)
         except RuntimeError as rte:
-            print("Failed to create machine: {}".format(rte))
-            sys.exit(1)
+            raise RuntimeError("Failed to create machine: {}".format(rte))
+
+    @traced("prewarm")
+    def _prewarm_machine(self, node: Node) -> None:
+        """
+        Put the consul image on a machine before consul is set up. When that fails, docker-compose pulls the image
+        when consul starts, like it does without prewarming.
+        :param node:
+        """
+        image = compose_images(CONSUL_COMPOSE_DIR).get(node.node_type)
+        if image is None:
+            return
+
+        try:
+            # In load mode the id of the image is known here, so a node that got it before is not asked again. In
+            # pull and mirror mode only the node can tell whether the tag moved, it always pulls.
+            wanted = digest(self.config.image_prewarm, self.images.fetch(image)) \
+                if self.config.image_prewarm == "load" else None
+            if wanted is not None and self.applied.get(node, "image") == wanted and \
+                    node.state not in [NodeState.new, NodeState.bare]:
+                return
+
+            log("+ prewarm {} ({})".format(image, self.config.image_prewarm))
+            if not self.images.distribute(node, image):
+                log("+ {} is already on the node".format(image))
+            if wanted is not None:
+                self.applied.record(node, "image", wanted)
+        except RuntimeError as rte:
+            log("Prewarm failed, consul pulls its image when it starts: {}".format(rte))
+
+    @traced("wait-ready")
+    def _wait_ready(self, node: Node, stage: str) -> None:
+        """
+        Wait until a node that is provisioned in this run is ready for the next step, by polling its consul agent and
+        swarm manager, until the readiness deadline of the rollout (config.ready_timeout seconds after it started):
+        - consul: before it is provisioned, its consul agent answers (and has a leader when it is the only server)
+        - swarm: after it is provisioned, its swarm manager answers
+        - cluster: consul has a leader and knows the node, and the swarm manager of a master answers
+        :param node:
+        :param stage:
+        """
+        if self.config.ready_timeout <= 0 or "provision" not in node.steps:
+            return
+        if stage != "consul" and not self.journal.done(node, "provision", node.desired["provision"]):
+            raise RuntimeError("{} was not provisioned".format(node.name))
+
+        consul = ConsulClient(node.public_ip, STATE_PROBE_TIMEOUT)
+        checks = OrderedDict()
+        if stage == "consul":
+            checks["consul"] = check(lambda: consul.request("GET", "/v1/status/leader"))
+        if stage == "cluster" or (stage == "consul" and len(self.masters) == 1):
+            checks["consul leader"] = check(consul.leader)
+        if stage == "cluster":
+            checks["consul catalog"] = check(consul.registered)
+        if stage != "consul" and node.node_type == NodeType.master:
+            checks["swarm manager"] = check(lambda: self.engines.get(node, is_swarm=True).ping())
+
+        try:
+            # Past the deadline, the checks are still made once
+            waited = wait_for(checks, max(0.0, self.ready_deadline - time.monotonic()),
+                              "{} of {}".format(stage, node.name))
+            log("+ {} ready after {:.1f}s".format(stage, waited))
+        except NotReady as ex:
+            # Port 8500 is often not reachable from here (firewalls, private networks), so the rollout goes on as it
+            # did before there was a readiness gate
+            log("Warning: {}, continuing without waiting".format(ex))
+        finally:
+            consul.close()
+
+    @traced("discover")
+    def _discover_machine(self, node: Node) -> None:
+        """
+        Determine the state, the addresses and the desired state of a machine, without changing it
+        :param node:
+        """
+        node.machine_path = self.config.machine_path(node.name)
+        if os.path.isdir(node.machine_path):
+            self._save_node_data(node)
+
+        node.state = self._get_state(node)
+        if node.state == NodeState.new:
+            return
+
+        try:
+            node.desired = self._desired_state(node)
+        except FileNotFoundError as ex:
+            # e.g. a docker-machine create that failed halfway
+            raise RuntimeError("Machine {} is incomplete: {}".format(node.name, ex))
+
+    @traced("load")
+    def _load_machine(self, node: Node) -> None:
+        """
+        Load the addresses of an existing machine, without probing it
+        :param node:
+        """
+        node.machine_path = self.config.machine_path(node.name)
+        if not os.path.isdir(node.machine_path):
+            raise RuntimeError("Machine {} does not exist, roll it out with start or apply".format(node.name))
+
+        self._save_node_data(node)
+
+    @traced("destroy")
+    def _destroy_machine(self, node: Node, timings: "OrderedDict[str, Tuple[float, bool]]") -> None:
+        """
+        Remove a machine without draining it, the whole cluster goes
+        :param node:
+        :param timings: seconds it took and whether it succeeded, per node
+        """
+        start = time.monotonic()
+        try:
+            self._remove_machine(node, drain=False)
+            timings[node.name] = (time.monotonic() - start, True)
+        except Exception:
+            timings[node.name] = (time.monotonic() - start, False)
+            raise
+
+    @traced("remove")
+    def _remove_machine(self, node: Node, drain: bool = True) -> None:
+        """
+        Drain a machine (consul leaves the cluster) and remove it, together with everything dsc knows about it
+        :param node:
+        :param drain: let consul leave the cluster before it is stopped
+        """
+        log("* remove {}".format(node.name))
+        node.machine_path = self.config.machine_path(node.name)
+
+        if os.path.isdir(node.machine_path):
+            batch = RemoteBatch(node)
+            if drain:
+                for container in ["consul-agent-server", "consul-agent"]:
+                    batch.run("docker exec {} consul leave".format(container), check=False)
+            batch.run("docker stop consul-agent-server consul-agent", check=False)
+            try:
+                self._run_batch(batch, show_output=False)
+            except RuntimeError as rte:
+                log("+ could not {}: {}".format("drain" if drain else "stop consul", rte))
 
-    def _config_machine(self, node: Node) -> None:
+            self.ssh_pool.invalidate(node)
+            self.engines.invalidate(node)
+            self._run_driver(node, "rm -y {}".format(node.name))
+
+        self.machine_configs.invalidate(node)
+        self.state_cache.invalidate(node)
+        self.facts.invalidate(node)
+        self.file_sync.forget(node)
+        self.applied.forget(node)
+        self.journal.forget(node)
+        log("+ removed")
+
+    def _was_master(self, node: Node) -> bool:
+        """
+        Whether a machine was configured as a swarm master
+        :param node:
+        :return:
+        """
+        node.machine_path = self.config.machine_path(node.name)
+        try:
+            return bool(self.machine_configs.get(node)["HostOptions"]["SwarmOptions"].get("Master"))
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+
+    @traced("configure")
+    def _config_machine(self, node: Node, force: bool = True, only: List[str] = None) -> None:
         """
         Configure a machine as a swarm master or worker
         :param node:
+        :param force: apply all configuration steps, also the ones of which the inputs did not change
+        :param only: apply only these configuration steps, for nodes that are not provisioned in this run
         """
-        print("* configure {}: {}".format(node.name, node.config["machine-driver"]))
+        log("* configure {}: {}".format(node.name, node.config["machine-driver"]))
 
         # Determine current state of the node
         node.state = self._get_state(node)
-        print("+ current state: {}".format(node.state.name.upper()))
+        log("+ current state: {}".format(node.state.name.upper()))
+
+        desired = node.desired = self._desired_state(node)
+        if force:
+            # Global config is only applied when swarm is not running yet
+            steps = [step for step in CONFIG_STEPS
+                     if step != "machine-config" or node.state != NodeState.swarm_running]
+        else:
+            steps = self._changed_steps(node, desired)
+            if not steps:
+                log("+ up to date")
+            else:
+                log("+ changed: {}".format(", ".join(steps)))
+        if only is not None:
+            skipped = [step for step in steps if step not in only]
+            if skipped:
+                log("+ left for start or apply: {}".format(", ".join(skipped)))
+            steps = [step for step in steps if step in only]
+
+        # Provision after updating the machine config, and skip what an interrupted run already did
+        if "machine-config" in steps:
+            steps = steps + ["provision"]
+        desired["provision"] = desired["machine-config"]
+        remaining = [step for step in steps if not self.journal.done(node, step, desired[step])]
+        if remaining != steps:
+            log("+ resumed, remaining: {}".format(", ".join(remaining) if remaining else "none"))
+            # The interrupted run may not have saved the applied state of the steps it completed. The machine config
+            # only counts as applied once the machine was provisioned with it.
+            for step in steps:
+                if step not in remaining and step != "machine-config":
+                    self.applied.record(node, "machine-config" if step == "provision" else step, desired[step])
+
+        node.steps = steps = remaining
+        if not [step for step in steps if step != "provision"]:
+            return
 
         # Setup and start consul
-        self._setup_consul(node)
+        self._setup_consul(node, steps, desired)
+
+        # The remaining remote steps are sent to the node in one batch
+        batch = RemoteBatch(node)
 
         # Set up DNS (/etc/resolv.conf)
-        print("+ setup DNS")
-        self._run_machine(
-            "ssh {} 'sudo rm -f /etc/resolv.conf && sudo echo \"nameserver {}\" | sudo tee /etc/resolv.conf'".format(
-                node.name, node.cluster_ip))
+        if "dns" in steps:
+            log("+ setup DNS")
+            batch.run("sudo rm -f /etc/resolv.conf && echo \"nameserver {}\" | sudo tee /etc/resolv.conf".format(
+                node.cluster_ip))
 
-        # Global config
-        if node.state == NodeState.swarm_running:
-            return
+        if "machine-config" in steps:
+            self._update_machine_config(node)
 
-        self._update_machine_config(node)
+            # Make sure docker is still running
+            batch.run("sudo systemctl start docker || sudo /etc/init.d/docker start", check=False)
 
-        # Make sure docker is still running
-        self._run_machine("ssh {node} 'sudo systemctl start docker || sudo /etc/init.d/docker start'".format(node=node.name), raise_error=False,
-                          show_output=False)
+            # Somehow the provisioning fails when the consul image is still running on nodes except the primary
+            # master
+            if not node.is_primary:
+                batch.run("docker stop consul-agent-server consul-agent", check=False)
 
-        # Somehow the provisioning fails when the consul image is still running on nodes except the primary master
-        if not node.is_primary:
-            self._run_machine("ssh {node} 'docker stop consul-agent-server consul-agent'".format(node=node.name),
-                              raise_error=False, show_output=False)
+        if len(batch):
+            self._run_batch(batch)
+
+        if "dns" in steps:
+            self.journal.record(node, "dns", desired["dns"])
+            self.applied.record(node, "dns", desired["dns"])
+
+        if "machine-config" in steps:
+            self.journal.record(node, "machine-config", desired["machine-config"])
+
+    @traced("provision")
+    def _provision_machine(self, node: Node) -> None:
+        """
+        Re-provision a machine with its swarm config, when the configure step updated it
+        :param node:
+        """
+        if "provision" not in node.steps:
+            return
 
-        # Re-provision node
+        log("* provision {}".format(node.name))
         try:
             self._run_machine("provision {}".format(node.name))
+            self.engines.invalidate(node)
+            self.machine_configs.invalidate(node)
+            self.state_cache.invalidate(node)
+            self.journal.record(node, "provision", node.desired["provision"])
+            self.applied.record(node, "machine-config", node.desired["machine-config"])
+            self._record_provisioned_certs(node)
         except RuntimeError as rte:
-            print("Error provisioning node: {}".format(rte))
+            log("Error provisioning node: {}".format(rte))
 
-    def _update_machine_config(self, node: Node) -> None:
+    def _record_provisioned_certs(self, node: Node) -> None:
         """
-        Update docker-machine config (config.json) with swarm config
+        Provision generates a new server certificate and copies it to /etc/docker on the node. Record it as applied,
+        so the next run neither uploads it again nor restarts consul for it.
+        :param node:
+        """
+        self.file_sync.commit(node, OrderedDict([
+            ("/etc/docker/{}".format(file), file_digest(os.path.join(node.machine_path, file))) for file in CONSUL_CERTS
+        ]))
+
+        desired = self._desired_state(node)
+        for step in ["certs", "consul"]:
+            # Only steps that were in sync with the old certificate
+            if self.journal.done(node, step, node.desired[step]):
+                self.journal.record(node, step, desired[step])
+            if self.applied.get(node, step) == node.desired[step]:
+                self.applied.record(node, step, desired[step])
+            node.desired[step] = desired[step]
+
+    def _desired_state(self, node: Node) -> "OrderedDict[str, str]":
+        """
+        Content hashes of the inputs of every configuration step of a node
+        :param node:
+        :return: digest per step
+        """
+        certs = digest(*[file_digest(os.path.join(node.machine_path, file)) for file in CONSUL_CERTS])
+        _, config_data = self._render_consul_config(node, CONSUL_COMPOSE_DIR)
+        consul_config = digest(config_data)
+        # Agents only use -retry-join when they first join, so adding or removing masters does not change them
+        _, compose_data = self._render_consul_compose_file(node, CONSUL_COMPOSE_DIR,
+                                                           join=node.node_type == NodeType.master)
+
+        return OrderedDict([
+            ("certs", certs),
+            ("consul-config", consul_config),
+            ("consul", digest(compose_data, certs, consul_config)),
+            ("dns", digest(node.cluster_ip)),
+            ("machine-config", digest(json.dumps(self._machine_config_settings(node), sort_keys=True))),
+        ])
+
+    def _changed_steps(self, node: Node, desired: "OrderedDict[str, str]") -> List[str]:
+        """
+        Configuration steps that have to be applied to bring a node in the desired state
+        :param node:
+        :param desired: digest per step
+        :return:
+        """
+        steps = self.applied.changed(node, desired)
+
+        if "machine-config" in steps and node.state == NodeState.swarm_running and \
+                self.applied.get(node, "machine-config") is None:
+            # Adopt nodes that were configured before the applied state was recorded
+            steps.remove("machine-config")
+        elif "machine-config" not in steps and node.state != NodeState.swarm_running:
+            steps.append("machine-config")
+
+        return steps
+
+    def _machine_config_settings(self, node: Node) -> dict:
+        """
+        Swarm settings for the docker-machine config (config.json) of a node
         :param node:
+        :return:
         """
-        machine_config = get_machine_config(node)
         consul_service = CONSUL_SERVICE.format(domain=node.domain)
         engine_values = [node.cluster_iface, consul_service, node.cluster_ip, node.domain]
-        engine_options = machine_config["HostOptions"]["EngineOptions"]
-        engine_options["ArbitraryFlags"].extend(
-            [option.format(value) for option, value in zip(ENGINE_OPTIONS, engine_values)])
-        machine_config["HostOptions"]["EngineOptions"] = engine_options
-        driver_options = machine_config["Driver"]
-        driver_options["SwarmDiscovery"] = consul_service
-        swarm_options = machine_config["HostOptions"]["SwarmOptions"]
-        swarm_options["Discovery"] = consul_service
-        swarm_options["IsSwarm"] = True
-        auth_options = machine_config["HostOptions"]["AuthOptions"]
         tls_sans = [
             node.shortname,
             node.cluster_ip,
         ]
         if node.cluster_ip != node.public_ip:
             tls_sans.append(node.public_ip)
-        auth_options["ServerCertSANs"].extend(tls_sans)
-        if node.node_type == NodeType.master:
+
+        return {
+            "discovery": consul_service,
+            "engine-flags": [option.format(value) for option, value in zip(ENGINE_OPTIONS, engine_values)],
+            "tls-sans": tls_sans,
+            "master": node.node_type == NodeType.master,
+            "swarm-master-flags": [option.format(node.cluster_ip) for option in SWARM_MASTER_OPTIONS]
+            if node.node_type == NodeType.master else [],
+        }
+
+    @traced("update-machine-config")
+    def _update_machine_config(self, node: Node) -> None:
+        """
+        Update docker-machine config (config.json) with swarm config
+        :param node:
+        """
+        try:
+            machine_config = self.machine_configs.get(node)
+        except FileNotFoundError as ex:
+            raise RuntimeError("Machine config (config.json) not found: {}".format(ex))
+
+        settings = self._machine_config_settings(node)
+        engine_options = machine_config["HostOptions"]["EngineOptions"]
+        engine_options["ArbitraryFlags"] = merge_flags(engine_options.get("ArbitraryFlags"), settings["engine-flags"],
+                                                       engine_opt_flags(node.config["engine-opts"]))
+        machine_config["HostOptions"]["EngineOptions"] = engine_options
+        driver_options = machine_config["Driver"]
+        driver_options["SwarmDiscovery"] = settings["discovery"]
+        swarm_options = machine_config["HostOptions"]["SwarmOptions"]
+        swarm_options["Discovery"] = settings["discovery"]
+        swarm_options["IsSwarm"] = True
+        auth_options = machine_config["HostOptions"]["AuthOptions"]
+        auth_options["ServerCertSANs"] = merge_list(auth_options.get("ServerCertSANs"), settings["tls-sans"])
+        if settings["master"]:
             driver_options["SwarmMaster"] = True
             swarm_options["Master"] = True
-            swarm_options["ArbitraryFlags"].extend(
-                [option.format(node.cluster_ip) for option in SWARM_MASTER_OPTIONS])
+            swarm_options["ArbitraryFlags"] = merge_flags(swarm_options.get("ArbitraryFlags"),
+                                                          settings["swarm-master-flags"])
         machine_config["Driver"] = driver_options
         machine_config["HostOptions"]["SwarmOptions"] = swarm_options
         machine_config["HostOptions"]["AuthOptions"] = auth_options
-        save_machine_config(node, machine_config)
+        if self.machine_configs.save(node):
+            self.state_cache.invalidate(node)
 
-    def _create_nodes(self, node_type: NodeType) -> List[Node]:
+    def _create_nodes(self) -> Tuple[List[Node], List[Node]]:
         """
-        Create a list of nodes of specified type
-        :param node_type:
-        :return: nodes
+        Create the nodes of the config, in one pass
+        :return: masters and workers
         """
-        nodes = [Node.load(name="{}.{}".format(name, self.config.network["cluster-domain"]), config=config,
-                           shortname=name, node_type=node_type, domain=self.config.network["cluster-domain"])
-                 for name, config in self.config.nodes.items()
-                 if dict_has_item(config, "type", node_type.name)]
+        domain = self.config.network["cluster-domain"]
+        nodes = {NodeType.master: [], NodeType.worker: []}
+        for name, config in self.config.nodes.items():
+            node_type = NodeType[config["type"]]
+            nodes[node_type].append(Node.load(name="{}.{}".format(name, domain), config=config, shortname=name,
+                                              node_type=node_type, domain=domain))
 
-        if len(nodes) == 0:
-            print("No swarm {nodetype} configured. Please add at least one node with type: {nodetype}".format(
-                nodetype=node_type.name))
-            sys.exit(1)
+        for node_type in [NodeType.master, NodeType.worker]:
+            if len(nodes[node_type]) == 0:
+                print("No swarm {nodetype} configured. Please add at least one node with type: {nodetype}".format(
+                    nodetype=node_type.name))
+                sys.exit(1)
 
         # Set the first master node as primary
-        if node_type == NodeType.master:
-            nodes[0].is_primary = True
+        nodes[NodeType.master][0].is_primary = True
 
-        return nodes
+        return nodes[NodeType.master], nodes[NodeType.worker]
 
-    def _setup_consul(self, node: Node) -> None:
+    @traced("setup-consul")
+    def _setup_consul(self, node: Node, steps: List[str], desired: "OrderedDict[str, str]") -> None:
         """
         Setup Consul on a node
         :param node:
+        :param steps: configuration steps to apply
+        :param desired: digest per step
         """
-        print("+ setup consul")
-        files = [
-            "ca.pem",
-            "server.pem",
-            "server-key.pem",
-        ]
+        files = []
+        if "certs" in steps:
+            files.extend([(os.path.join(node.machine_path, file), "/etc/docker/{}".format(file))
+                          for file in CONSUL_CERTS])
 
-        for file in files:
-            self._run_machine("scp {machine_path}/{file} {node}:/tmp/".format(machine_path=node.machine_path, file=file,
-                                                                              node=node.name))
-
-        self._run_machine("ssh {node} 'sudo mv /tmp/*.pem /etc/docker/'".format(node=node.name))
+        # Copy consul config
+        if "consul-config" in steps:
+            config_file, config_data = self._render_consul_config(node, CONSUL_COMPOSE_DIR)
+            write_file(config_file, config_data)
+            files.append((config_file, "/etc/consul/consul.json"))
 
-        # Get compose dir of consul
-        compose_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "compose", "consul"))
+        # Only send the files that are not on the node yet
+        batch = RemoteBatch(node)
+        uploads = self.file_sync.queue(node, batch, files)
+        if len(batch):
+            log("+ setup consul")
+            self._run_batch(batch)
+            self.file_sync.commit(node, uploads)
 
-        # Copy consul config
-        consul_config = os.path.join(compose_dir, "config", "consul.json")
-        self._run_machine("scp {consul_config} {node}:/tmp/".format(consul_config=consul_config, node=node.name))
-        self._run_machine("ssh {node} 'sudo mkdir -p /etc/consul/ && sudo mv /tmp/consul.json /etc/consul/'".format(
-            node=node.name))
+        for step in ["certs", "consul-config"]:
+            if step in steps:
+                self.journal.record(node, step, desired[step])
+                self.applied.record(node, step, desired[step])
 
         # Set up compose file and start consul
-        self._build_consul_compose_file(node, compose_dir)
+        if "consul" in steps and self._build_consul_compose_file(node, CONSUL_COMPOSE_DIR):
+            self.journal.record(node, "consul", desired["consul"])
+            self.applied.record(node, "consul", desired["consul"])
 
-    def _build_consul_compose_file(self, node: Node, compose_dir: str) -> None:
+    def _build_consul_compose_file(self, node: Node, compose_dir: str) -> bool:
         """
         Create the Consul docker-compose file for this node
         :param node:
         :param compose_dir:
+        :return: whether consul was started
+        """
+        compose_file, compose_data = self._render_consul_compose_file(node, compose_dir)
+        changed = not os.path.isfile(compose_file) or read_file(compose_file) != compose_data
+        write_file(compose_file, compose_data)
+
+        # up -d recreates the container when the compose file changed (e.g. -bootstrap-expect, -retry-join, GOMAXPROCS),
+        # but leaves it alone otherwise: when only consul.json or the certs changed, consul is restarted to read them
+        return self.start_consul(node, compose_file, restart=node.state == NodeState.swarm_running and not changed)
+
+    def _render_consul_config(self, node: Node, compose_dir: str) -> Tuple[str, str]:
+        """
+        Render the Consul config (consul.json) for this node, tuned to its hardware
+        :param node:
+        :param compose_dir:
+        :return: path and contents of the config file
         """
+        settings = self.config.consul.settings(node.node_type.name, node.facts)
+        return os.path.join(node.machine_path, "consul.json"), \
+            self.config.consul.render_config(read_file(os.path.join(compose_dir, "config", "consul.json")), settings)
+
+    def _render_consul_compose_file(self, node: Node, compose_dir: str, join: bool = True) -> Tuple[str, str]:
+        """
+        Render the Consul docker-compose file for this node
+        :param node:
+        :param compose_dir:
+        :param join: add the -retry-join list of an agent
+        :return: path and contents of the compose file
+        """
+        gomaxprocs = self.config.consul.settings(node.node_type.name, node.facts)["gomaxprocs"]
         if node.node_type == NodeType.master:
             compose_data = read_file(os.path.join(compose_dir, "server.yml"))
             compose_file = os.path.join(node.machine_path, "consul-server.yml")
             retry_join = ""
 
             if len(self.masters) > 1:
-                params = ["-retry-interval 10s", "-retry-max 3"]
+                # With the readiness gate, servers keep trying to join until the other servers are provisioned and dsc
+                # waits for the leader. Without it, they give up like they always did and the rollout goes on.
+                params = ["-retry-interval 5s"] if self.config.ready_timeout > 0 else \
+                    ["-retry-interval 10s", "-retry-max 3"]
                 params.extend(["--retry-join {cluster_ip}".format(cluster_ip=master.cluster_ip)
                                for master in self.masters if node.name != master.name])
 
                 retry_join = " ".join(params)
 
-            write_file(compose_file,
-                       compose_data.format(master_count=len(self.masters), cluster_ip=node.cluster_ip,
-                                           domain=node.domain, retry_join=retry_join, nodename=node.shortname))
+            return compose_file, compose_data.format(master_count=len(self.masters), cluster_ip=node.cluster_ip,
+                                                     domain=node.domain, retry_join=retry_join,
+                                                     nodename=node.shortname, gomaxprocs=gomaxprocs)
         else:
             compose_data = read_file(os.path.join(compose_dir, "agent.yml"))
             compose_file = os.path.join(node.machine_path, "consul-agent.yml")
             params = ["-retry-interval 10s"]
-            for master in self.masters:
-                params.append("-retry-join {cluster_ip}".format(cluster_ip=master.cluster_ip))
+            if join:
+                for master in self.masters:
+                    params.append("-retry-join {cluster_ip}".format(cluster_ip=master.cluster_ip))
 
-            retry_join = " ".join(params)
-            write_file(os.path.join(node.machine_path, compose_file),
-                       compose_data.format(cluster_ip=node.cluster_ip, domain=node.domain, retry_join=retry_join,
-                                           nodename=node.shortname))
+            return compose_file, compose_data.format(cluster_ip=node.cluster_ip, domain=node.domain,
+                                                     retry_join=" ".join(params), nodename=node.shortname,
+                                                     gomaxprocs=gomaxprocs)
 
-        self.start_consul(node, compose_file, restart=(node.state == NodeState.swarm_running))
-
-    def start_consul(self, node: Node, compose_file: str, restart: bool = False) -> None:
+    def start_consul(self, node: Node, compose_file: str, restart: bool = False) -> bool:
         """
         Start or restart Consul on node
         :param node:
         :param compose_file:
         :param restart:
+        :return: whether consul was started
         """
-        print("+ start consul")
+        log("+ start consul")
         compose_command = "restart" if restart else "up -d"
         try:
             self._run_compose("-f {} {}".format(os.path.join(node.machine_path, compose_file), compose_command),
                               env=get_env_for_node(node))
+            return True
         except RuntimeError as rte:
-            print("Start consul failed: {}".format(rte))
+            log("Start consul failed: {}".format(rte))
+            return False
 
+    @traced("save-node-data")
     def _save_node_data(self, node: Node) -> Node:
         """
-        Save machine data to node
+        Save machine data to node, from the facts cache when the machine did not change
         :param node:
         :return:
         """
-        node.public_ip = self._run_machine("ip {}".format(node.name), show_output=False)
         node.cluster_iface = node.config.get("cluster-interface", DEFAULT_CLUSTER_INTERFACE)
+        try:
+            node.public_ip = self.machine_configs.get(node)["Driver"].get("IPAddress")
+        except (FileNotFoundError, ValueError, KeyError):
+            node.public_ip = None
+        if not node.public_ip:
+            node.public_ip = self._run_machine("ip {}".format(node.name), show_output=False)
 
-        result = self._run_machine("ssh {} \"ip addr sh {} | awk '/inet / {{ print \$2 }}'\"".format(
-            node.name, node.cluster_iface),
-            use_shell=True, show_output=False)
+        facts = self.facts.get(node)
+        if facts is None:
+            facts = self._gather_facts(node)
+            if facts["addresses"] and node.public_ip not in facts["addresses"]:
+                # A DHCP driver (e.g. virtualbox) may have given the machine another address than the one in its
+                # config.json. Behind NAT (most clouds) the public IP is not on the node at all, docker-machine knows.
+                self._refresh_public_ip(node)
+            self.facts.set(node, facts)
 
-        node.cluster_ip = re.sub("/[0-9]+$", "", result)
+        node.facts = facts
+        node.cluster_ip = facts["cluster_ip"]
 
         return node
 
+    def _refresh_public_ip(self, node: Node) -> None:
+        """
+        Ask docker-machine for the public IP of a machine, and record it in its config.json when it changed
+        :param node:
+        """
+        public_ip = self._run_machine("ip {}".format(node.name), show_output=False).strip()
+        if not public_ip or public_ip == node.public_ip:
+            return
+
+        log("+ public IP changed from {} to {}".format(node.public_ip, public_ip))
+        node.public_ip = public_ip
+        try:
+            self.machine_configs.get(node)["Driver"]["IPAddress"] = public_ip
+            self.machine_configs.save(node)
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        self.ssh_pool.invalidate(node)
+        self.engines.invalidate(node)
+        self.state_cache.invalidate(node)
+
+    @traced("gather-facts")
+    def _gather_facts(self, node: Node) -> dict:
+        """
+        Gather the facts of a node in one remote call
+        :param node:
+        :return:
+        """
+        facts = parse_facts(self._run_ssh(node, facts_script(node.cluster_iface), show_output=False))
+        if not facts["cluster_ip"]:
+            raise RuntimeError("No address found on cluster interface {}".format(node.cluster_iface))
+
+        return facts
+
+    @traced("state")
     def _get_state(self, node: Node) -> NodeState:
         """
-        Get state of a node
+        Get state of a node, from the state cache when it is still valid
+        :param node:
+        :return:
+        """
+        state = self.state_cache.get(node)
+        if state is None:
+            state = self._probe_state(node)
+            self.state_cache.set(node, state)
+
+        return state
+
+    def _probe_state(self, node: Node) -> NodeState:
+        """
+        Probe the state of a node
         :param node:
         :return:
         """
         state = NodeState.new
         # Check if the machine exists
-        if os.path.isdir(os.path.join(os.path.expanduser("~"), ".docker", "machine", "machines", node.name)):
+        if os.path.isdir(self.config.machine_path(node.name)):
             state = NodeState.bare
 
         # Check if docker is running
-        try:
-            self._run_docker("info", show_output=False, env=get_env_for_node(node))
+        engine = self.engines.get(node)
+        if engine is not None and engine.ping():
             state = NodeState.running
-        except RuntimeError:
-            pass
 
         # Check if swarm has been configured
         try:
-            swarm_options = get_machine_config(node, True)["HostOptions"]["SwarmOptions"]
+            swarm_options = self.machine_configs.get(node)["HostOptions"]["SwarmOptions"]
             if not swarm_options["IsSwarm"]:
                 return state
         except FileNotFoundError:
             return state
 
+        is_running = state == NodeState.running
         state = NodeState.swarm_configured
 
         # If docker is running on a worker node and swarm is configured, we assume swarm is running (might need a
         # better way to determine this in the future)
-        if node.node_type == NodeType.worker and state.value >= NodeState.running.value:
+        if node.node_type == NodeType.worker and is_running:
             return NodeState.swarm_running
 
         # Check if docker swarm is running on the masters
-        try:
-            self._run_docker("info", show_output=False, env=get_env_for_node(node, True))
+        swarm = self.engines.get(node, is_swarm=True)
+        if swarm is not None and swarm.ping():
             return NodeState.swarm_running
-        except RuntimeError:
-            return state
 
-    def _run_machine(self, command, raise_error=True, use_shell=False, show_output=True, env=None):
-        return run_command(self.config.machine_bin, command, raise_error, use_shell, show_output, env)
+        return state
 
-    def _run_compose(self, command, raise_error=True, use_shell=False, show_output=True, env=None):
-        return run_command(self.config.compose_bin, command, raise_error, use_shell, show_output, env)
+    def _run_batch(self, batch: RemoteBatch, show_output: bool = True) -> str:
+        """
+        Send a batch of uploads and shell steps to its node in a single docker-machine ssh session
+        :param batch:
+        :param show_output:
+        :return: output of the batch
+        """
+        return self._run_ssh(batch.node, batch.command(), show_output=show_output, input=batch.archive())
 
-    def _run_docker(self, command, raise_error=True, use_shell=False, show_output=True, env=None):
-        return run_command(self.config.docker_bin, command, raise_error, use_shell, show_output, env)
+    def _run_ssh(self, node: Node, command: str, raise_error=True, show_output=True, timeout=None, input=None):
+        """
+        Run a shell command on a node, over its multiplexed ssh connection when possible
+        :param node:
+        :param command:
+        :return: output of the command
+        """
+        connection = self.ssh_pool.get(node)
+        if connection is None:
+            return self._run_machine(["ssh", node.name, command], raise_error, show_output=show_output,
+                                     timeout=timeout, input=input)
+
+        return self.run_command(self.config.ssh_bin, connection.command(command), raise_error,
+                                show_output=show_output, timeout=timeout, input=input)
+
+    def _run_driver(self, node: Node, command: str, cleanup: Callable[[], None] = None) -> str:
+        """
+        Run a docker-machine command that goes to the API of the driver of a node, within the concurrency and rate
+        limits of the driver, and retry it when it fails with a transient error
+        :param node:
+        :param command:
+        :param cleanup: removes what a failed attempt left behind, before the next attempt
+        :return: output of the command
+        """
+        driver = (node.config or {}).get("machine-driver")
+        if driver is None:
+            # Removed nodes are not in the config anymore
+            try:
+                driver = self.machine_configs.get(node).get("DriverName")
+            except (FileNotFoundError, ValueError):
+                pass
+
+        def retry(error: Exception, attempt: int, delay: float) -> None:
+            lines = str(error).strip().splitlines()
+            log("+ {} failed, retry {} in {:.1f}s: {}".format(command.split(" ", 1)[0], attempt, delay,
+                                                             lines[-1] if lines else error))
+            if cleanup is not None:
+                cleanup()
+
+        return self.driver_limiter.call(driver or "default", lambda: self._run_machine(command), retry)
+
+    def _run_machine(self, command, raise_error=True, use_shell=False, show_output=True, env=None, timeout=None,
+                     input=None):
+        return self.run_command(self.config.machine_bin, command, raise_error, use_shell, show_output, env, timeout,
+                                input)
+
+    def _run_compose(self, command, raise_error=True, use_shell=False, show_output=True, env=None, timeout=None,
+                     input=None):
+        return self.run_command(self.config.compose_bin, command, raise_error, use_shell, show_output, env, timeout,
+                                input)
+
+    def _run_docker(self, command, raise_error=True, use_shell=False, show_output=True, env=None, timeout=None,
+                    input=None):
+        return self.run_command(self.config.docker_bin, command, raise_error, use_shell, show_output, env, timeout,
+                                input)
+
+
+def _describe_timings(timings: "OrderedDict[str, Tuple[float, bool]]") -> str:
+    width = max([len(name) for name in timings])
+    lines = ["Timings:"]
+    for name, timing in timings.items():
+        if timing is None:
+            result = "not started"
+        else:
+            result = "{:.1f}s{}".format(timing[0], "" if timing[1] else " (failed)")
+        lines.append("  {:<{width}}  {}".format(name, result, width=width))
+    return "\n".join(lines)
+
+
+def _describe_tasks(failed: List[Task], skipped: List[Task]) -> str:
+    return "; ".join(["{} ({})".format(", ".join([task.name for task in tasks]), reason)
+                      for tasks, reason in [(failed, "failed"), (skipped, "skipped")] if tasks])
 
 
 class Config(object):
+    # Paths of the programs dsc runs, looked up when they are first needed
+    machine_bin = Binary(DOCKER_MACHINE)
+    compose_bin = Binary(DOCKER_COMPOSE)
+    docker_bin = Binary(DOCKER)
+    ssh_bin = Binary(SSH, required=False)
+
     def __init__(self):
         self.nodes = None
-        self.machine_bin = None
-        self.compose_bin = None
-        self.docker_bin = None
         self.network = None
+        self.parallelism = 1
+        self.ssh_multiplexing = True
+        self.ssh_idle_timeout = 300
+        self.state_ttl = 0
+        self.worker_wave_size = 0
+        self.resume = True
+        self.output = None
+        self.consul = ConsulTuning()
+        self.image_prewarm = "load"
+        self.ready_timeout = 0
+        self.drivers = driver_limits(None)
+        self.registry_mirror = None
         self.config_dir = get_default_config_dir()
+        self.machine_dir = os.path.join(os.path.expanduser("~"), ".docker", "machine", "machines")
 
     def path(self, *path):
         return os.path.join(self.config_dir, *path)
 
+    @property
+    def compact_output(self) -> bool:
+        """
+        Whether command output only goes to the log files, by default when nodes are rolled out in parallel
+        """
+        if self.output is None:
+            return self.parallelism > 1
+        return self.output == "compact"
+
+    def machine_path(self, name):
+        return os.path.join(self.machine_dir, name)
+
     def from_dict(self, config_dict: dict):
-        self.nodes = config_dict.get("nodes", {})
+        self.nodes = Inventory(config_dict.get("nodes", {}), config_dict.get("groups", {}),
+                               config_dict.get("templates", {}))
+        self.nodes.validate()
         self.network = config_dict.get("network", {})
+        if not self.network.get("cluster-domain"):
+            raise ConfigError("network.cluster-domain is not set")
+        self.consul = ConsulTuning(config_dict.get("consul"))
+        self.consul.validate()
+        self.drivers = driver_limits(config_dict.get("drivers"))
+        rollout = config_dict.get("rollout", {})
+        self.parallelism = int(rollout.get("parallelism") or self.parallelism)
+        self.ssh_multiplexing = bool(rollout.get("ssh-multiplexing", self.ssh_multiplexing))
+        self.ssh_idle_timeout = int(rollout.get("ssh-idle-timeout") or self.ssh_idle_timeout)
+        self.state_ttl = int(rollout.get("state-ttl") or self.state_ttl)
+        self.worker_wave_size = rollout.get("worker-wave-size") or self.worker_wave_size
+        if not isinstance(self.worker_wave_size, int) or isinstance(self.worker_wave_size, bool) or \
+                self.worker_wave_size < 0:
+            raise ConfigError("rollout.worker-wave-size must be a number of workers (0: all at once), not {}".format(
+                self.worker_wave_size))
+        self.ready_timeout = float(rollout.get("ready-timeout", self.ready_timeout) or 0)
+        self.registry_mirror = rollout.get("registry-mirror") or self.registry_mirror
+        # The nodes pull from the mirror when there is one, YAML reads off as false
+        image_prewarm = rollout.get("image-prewarm")
+        if image_prewarm is None:
+            image_prewarm = "mirror" if self.registry_mirror else self.image_prewarm
+        self.image_prewarm = "off" if image_prewarm is False else str(image_prewarm)
+        if self.image_prewarm not in PREWARM_MODES:
+            raise ConfigError("rollout.image-prewarm must be one of {}, not {}".format(", ".join(PREWARM_MODES),
+                                                                                     self.image_prewarm))
+        if self.image_prewarm == "mirror" and not self.registry_mirror:
+            raise ConfigError("rollout.image-prewarm is mirror, but rollout.registry-mirror is not set")
+        self.output = rollout.get("output") or self.output
+        if self.output not in [None, "full", "compact"]:
+            raise ConfigError("rollout.output must be full or compact, not {}".format(self.output))
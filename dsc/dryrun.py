@@ -0,0 +1,259 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+
+from dsc.const import CONSUL_CERTS, IMAGES_DIRNAME, LOGS_DIRNAME
+from dsc.engine import EngineClient, EnginePool
+from dsc.nodes import Node
+from dsc.output import get_node
+from dsc.scheduler import Scheduler, Task, current_task
+from dsc.trace import Span, command_name, redact_command
+from dsc.util import write_file_atomic
+
+# Seconds a command is estimated to take when no run has timed it yet
+DEFAULT_LATENCIES = {
+    "docker-machine create": 90.0,
+    "docker-machine provision": 60.0,
+    "docker-compose": 10.0,
+}
+DEFAULT_LATENCY = 1.0
+
+# Remote commands go through docker-machine ssh, or through ssh directly when the connection is multiplexed
+REMOTE_COMMANDS = ["ssh", "docker-machine ssh", "docker-machine scp"]
+
+# Machine files that are copied into the scratch directory, disk images are left alone
+MACHINE_FILE_MAX_BYTES = 1024 * 1024
+
+
+class CommandLatencies(object):
+    """
+    Mean duration per kind of command (e.g. "docker-machine create"), taken from the command spans of earlier runs
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.latencies = None  # type: Optional[Dict[str, dict]]
+
+    def update(self, spans: List[Span]) -> None:
+        """
+        Add the durations of the commands of a run and save the result
+        :param spans:
+        """
+        latencies = self._load()
+        for span in spans:
+            if "command" not in span.attrs:
+                continue
+            entry = latencies.setdefault(span.name, {"count": 0, "mean": 0.0})
+            entry["count"] += 1
+            entry["mean"] += (span.duration - entry["mean"]) / entry["count"]
+
+        if latencies:
+            write_file_atomic(self.path, json.dumps(latencies, indent=2, sort_keys=True))
+
+    def estimate(self, name: str) -> float:
+        """
+        Estimated duration of a command
+        :param name: kind of command, see trace.command_name
+        :return: seconds
+        """
+        latencies = self._load()
+        if name in latencies:
+            return latencies[name]["mean"]
+
+        if name in REMOTE_COMMANDS:
+            measured = [latencies[remote]["mean"] for remote in REMOTE_COMMANDS if remote in latencies]
+            if measured:
+                return measured[0]
+
+        return DEFAULT_LATENCIES.get(name, DEFAULT_LATENCY)
+
+    def measured(self) -> int:
+        """
+        Number of commands the estimates are based on
+        """
+        return sum([entry["count"] for entry in self._load().values()])
+
+    def _load(self) -> Dict[str, dict]:
+        if self.latencies is None:
+            try:
+                with open(self.path) as handle:
+                    self.latencies = json.load(handle)
+            except (OSError, ValueError):
+                self.latencies = {}
+
+        return self.latencies
+
+
+class RecordedCommand(object):
+    def __init__(self, node: Optional[str], task: Optional[Task], name: str, command: str):
+        """
+        :param node: name of the node the command was run for
+        :param task: rollout task the command was run by
+        :param name: kind of command, see trace.command_name
+        :param command: command line
+        """
+        self.node = node
+        self.task = task
+        self.name = name
+        self.command = command
+
+
+class DryRunEnginePool(EnginePool):
+    """
+    Engine pool that does not try to reach the machines that only exist in the dry run
+    """
+
+    def __init__(self, timeout: float, simulated: set):
+        super().__init__(timeout)
+        self.simulated = simulated
+
+    def get(self, node: Node, is_swarm: bool = False) -> Optional[EngineClient]:
+        if node.name in self.simulated:
+            return None
+        return super().get(node, is_swarm)
+
+
+class DryRun(object):
+    """
+    Recording command backend. Commands are recorded instead of run, and answered with placeholder output where dsc
+    parses it (addresses, facts). The config dir and the machine dirs of the nodes are copied into a scratch directory
+    first, so the rollout can write its compose files, machine configs and state there without changing anything. The
+    logs and the saved images are not copied: the recorded docker save only leaves an empty placeholder archive.
+    """
+
+    def __init__(self, config, nodes: List[Node]):
+        """
+        :param config: Config of the run, its paths are pointed to the scratch directory
+        :param nodes:
+        """
+        self.path = tempfile.mkdtemp(prefix="dsc-dry-run-")
+        self.commands = []  # type: List[RecordedCommand]
+        self.simulated = set()
+        self.lock = threading.Lock()
+
+        shutil.copytree(config.config_dir, os.path.join(self.path, "config"),
+                        ignore=shutil.ignore_patterns(LOGS_DIRNAME, IMAGES_DIRNAME))
+        config.config_dir = os.path.join(self.path, "config")
+
+        machine_dir = os.path.join(self.path, "machines")
+        os.makedirs(machine_dir)
+        for node in nodes:
+            source = config.machine_path(node.name)
+            if os.path.isdir(source):
+                _copy_machine(source, os.path.join(machine_dir, node.name))
+        config.machine_dir = machine_dir
+
+        # Remote commands are recorded as docker-machine ssh, there are no connections to multiplex
+        config.ssh_multiplexing = False
+        self.machine_dir = machine_dir
+
+    def engines(self, timeout: float) -> EnginePool:
+        return DryRunEnginePool(timeout, self.simulated)
+
+    def run_command(self, program: str, command: Union[str, List[str]], raise_error: bool = True,
+                    use_shell: bool = False, show_output: bool = True, extra_env: dict = None, timeout: float = None,
+                    input: bytes = None) -> str:
+        """
+        Record a command, same signature as util.run_command
+        :return: placeholder output of the command
+        """
+        args = command if isinstance(command, list) else command.split()
+        line = command if isinstance(command, str) else " ".join(command)
+        name = command_name(program, command)
+        with self.lock:
+            self.commands.append(RecordedCommand(get_node(), current_task(), name,
+                                                 redact_command("{} {}".format(os.path.basename(program), line))))
+
+        if name == "docker-machine create":
+            self._create(args[-1])
+        elif name == "docker-machine ip":
+            return _public_ip(args[1])
+        elif name == "docker inspect":
+            return "sha256:dry-run\n"
+        elif name == "docker save":
+            # Images are streamed from the saved archive
+            open(args[args.index("-o") + 1], "wb").close()
+        elif name in REMOTE_COMMANDS and "cluster_ip=" in line:
+            # Facts script
+            return "cluster_ip={cluster_ip}/24\naddresses={public_ip} {cluster_ip}/24\n".format(
+                cluster_ip=_cluster_ip(get_node() or ""), public_ip=_public_ip(get_node() or ""))
+
+        return ""
+
+    def report(self, nodes: List[Node], scheduler: Scheduler, latencies: CommandLatencies, parallelism: int) -> str:
+        """
+        The recorded commands per node, the number of spawns and round-trips, and the estimated duration of the
+        rollout
+        :param nodes:
+        :param scheduler: scheduler the rollout ran on
+        :param latencies:
+        :param parallelism:
+        :return:
+        """
+        per_node = OrderedDict([(node.name, []) for node in nodes])
+        for command in self.commands:
+            per_node.setdefault(command.node or "dsc", []).append(command)
+
+        lines = []
+        for node, commands in per_node.items():
+            lines.append("* {}: {}".format(node, "{} command(s)".format(len(commands)) if commands else "no commands"))
+            for command in commands:
+                first = command.command.strip().splitlines()[0]
+                lines.append("  {}".format(first if len(first) <= 116 else first[:113] + "..."))
+
+        durations = {}  # type: Dict[Task, float]
+        for command in self.commands:
+            if command.task is not None:
+                durations[command.task] = durations.get(command.task, 0.0) + latencies.estimate(command.name)
+
+        round_trips = len([command for command in self.commands if command.name in REMOTE_COMMANDS])
+        parallel = parallelism if parallelism > 1 else len(nodes)
+        lines.append("{} command(s), {} ssh/scp round-trip(s)".format(len(self.commands), round_trips))
+        lines.append("Estimated time: {:.0f}s sequential, {:.0f}s with parallelism {} ({})".format(
+            scheduler.makespan(durations, 1), scheduler.makespan(durations, parallel), parallel,
+            "based on {} timed command(s)".format(latencies.measured()) if latencies.measured() else
+            "no timings of earlier runs, using defaults"))
+        lines.append("Compose files and machine configs of the dry run are in {}".format(self.path))
+
+        return "\n".join(lines)
+
+    def _create(self, name: str) -> None:
+        path = os.path.join(self.machine_dir, name)
+        os.makedirs(path, exist_ok=True)
+        for file in CONSUL_CERTS:
+            with open(os.path.join(path, file), "w") as handle:
+                handle.write("dry run {} {}\n".format(file, name))
+
+        with open(os.path.join(path, "config.json"), "w") as handle:
+            json.dump({
+                "Name": name,
+                "Driver": {"IPAddress": _public_ip(name)},
+                "HostOptions": {
+                    "EngineOptions": {"ArbitraryFlags": []},
+                    "SwarmOptions": {"IsSwarm": False, "Master": False, "Discovery": "", "ArbitraryFlags": []},
+                    "AuthOptions": {"ServerCertSANs": []},
+                },
+            }, handle)
+
+        with self.lock:
+            self.simulated.add(name)
+
+
+def _copy_machine(source: str, destination: str) -> None:
+    os.makedirs(destination)
+    for file in os.listdir(source):
+        path = os.path.join(source, file)
+        if os.path.isfile(path) and os.path.getsize(path) <= MACHINE_FILE_MAX_BYTES:
+            shutil.copy2(path, os.path.join(destination, file))
+
+
+def _public_ip(name: str) -> str:
+    return "<{}:public-ip>".format(name.split(".")[0])
+
+
+def _cluster_ip(name: str) -> str:
+    return "<{}:cluster-ip>".format(name.split(".")[0])
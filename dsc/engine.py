@@ -0,0 +1,175 @@
+import http.client
+import json
+import os
+import socket
+import ssl
+import threading
+import urllib.parse
+from typing import Dict, Optional, Tuple
+
+from dsc.nodes import Node
+from dsc.trace import tracer
+
+ENGINE_PORT = 2376
+SWARM_PORT = 3376
+
+
+class EngineError(RuntimeError):
+    pass
+
+
+class EngineClient(object):
+    """
+    Minimal Docker Engine API client that keeps one persistent connection open. Uses TLS with the client certificates
+    docker-machine keeps in the machine directory (ca.pem, cert.pem, key.pem), or plain HTTP when no cert path is
+    given.
+    """
+
+    # Name of the API in spans and errors
+    service = "engine"
+
+    def __init__(self, host: str, port: int, cert_path: Optional[str] = None, timeout: float = 5):
+        self.host = host
+        self.port = port
+        self.cert_path = cert_path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connection = None  # type: Optional[http.client.HTTPConnection]
+
+    def ping(self) -> bool:
+        """
+        Check whether the engine answers
+        :return:
+        """
+        try:
+            return self.request("GET", "/_ping").strip() == b"OK"
+        except EngineError:
+            return False
+
+    def info(self) -> dict:
+        return self._json(self.request("GET", "/info"))
+
+    def version(self) -> dict:
+        return self._json(self.request("GET", "/version"))
+
+    def containers(self, name: str = None) -> list:
+        """
+        Containers on the engine, the stopped ones included
+        :param name: only the containers of which the name contains this
+        :return:
+        """
+        path = "/containers/json?all=1"
+        if name is not None:
+            path += "&filters={}".format(urllib.parse.quote(json.dumps({"name": [name]})))
+        return self._json(self.request("GET", path))
+
+    def request(self, method: str, path: str) -> bytes:
+        """
+        Send a request over the persistent connection, reconnecting once when a reused connection turns out to be
+        closed by the engine
+        :param method:
+        :param path:
+        :return: response body
+        """
+        with self.lock, tracer.span("{} {} {}".format(self.service, method, path),
+                                    endpoint="{}:{}".format(self.host, self.port)):
+            for attempt in range(2):
+                reused = self.connection is not None
+                try:
+                    if self.connection is None:
+                        self.connection = self._connect()
+                    self.connection.request(method, path, headers={"Accept": "application/json"})
+                    response = self.connection.getresponse()
+                    body = response.read()
+                except socket.timeout as ex:
+                    self._close()
+                    raise EngineError("{} {}:{} timed out: {}".format(self.service, self.host, self.port, ex))
+                except (http.client.HTTPException, OSError) as ex:
+                    self._close()
+                    if reused and attempt == 0:
+                        continue
+                    raise EngineError("{} {}:{} not reachable: {}".format(self.service, self.host, self.port, ex))
+
+                if response.will_close:
+                    self._close()
+
+                if response.status >= 400:
+                    raise EngineError("{} {}:{} {} {}: {} {}".format(self.service, self.host, self.port, method,
+                                                                        path, response.status, self._message(body)))
+                return body
+
+    def close(self) -> None:
+        with self.lock:
+            self._close()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.cert_path is None:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        context = ssl.create_default_context(cafile=os.path.join(self.cert_path, "ca.pem"))
+        context.load_cert_chain(os.path.join(self.cert_path, "cert.pem"), os.path.join(self.cert_path, "key.pem"))
+        return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=context)
+
+    def _close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _json(self, body: bytes) -> dict:
+        try:
+            return json.loads(body.decode())
+        except ValueError as ex:
+            raise EngineError("{} {}:{} sent invalid JSON: {}".format(self.service, self.host, self.port, ex))
+
+    @staticmethod
+    def _message(body: bytes) -> str:
+        try:
+            return json.loads(body.decode())["message"]
+        except (ValueError, KeyError, TypeError):
+            return body.decode(errors="replace").strip()
+
+
+class EnginePool(object):
+    """
+    Engine API clients, one per endpoint (the docker engine on 2376 and the swarm manager on 3376 of every node)
+    """
+
+    def __init__(self, timeout: float = 5):
+        self.timeout = timeout
+        self.clients = {}  # type: Dict[Tuple[str, str, int], EngineClient]
+        self.lock = threading.Lock()
+
+    def get(self, node: Node, is_swarm: bool = False) -> Optional[EngineClient]:
+        """
+        Get the client for the engine or the swarm manager of a node
+        :param node:
+        :param is_swarm:
+        :return: None when the address of the node is not known yet
+        """
+        if node.public_ip is None or node.machine_path is None:
+            return None
+
+        key = (node.name, node.public_ip, SWARM_PORT if is_swarm else ENGINE_PORT)
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = EngineClient(node.public_ip, key[2], node.machine_path, self.timeout)
+            return self.clients[key]
+
+    def invalidate(self, node: Node) -> None:
+        """
+        Close the connections of a node (e.g. after provisioning regenerated its certificates)
+        :param node:
+        """
+        with self.lock:
+            clients = [self.clients.pop(key) for key in list(self.clients) if key[0] == node.name]
+
+        for client in clients:
+            client.close()
+
+    def close_all(self) -> None:
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients = {}
+
+        for client in clients:
+            client.close()
@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from dsc.nodes import Node
+from dsc.reconcile import digest, file_digest
+from dsc.util import write_file_atomic
+
+# Collects all facts of a node in one remote call, one key=value per line
+FACTS_SCRIPT = """echo "cluster_ip=$(ip addr sh {iface} | awk '/inet / {{ print $2; exit }}')"
+echo "addresses=$(ip -4 -o addr sh 2>/dev/null | awk '{{ print $4 }}' | tr '\\n' ' ')"
+echo "cpus=$(nproc 2>/dev/null || grep -c ^processor /proc/cpuinfo)"
+echo "memory_kb=$(awk '/MemTotal/ {{ print $2 }}' /proc/meminfo)"
+echo "kernel=$(uname -r)"
+echo "docker_version=$(docker version --format '{{{{.Server.Version}}}}' 2>/dev/null)"
+echo "consul=$(docker ps --filter name=consul --format '{{{{.Names}}}}' 2>/dev/null | tr '\\n' ' ')"
+"""
+
+
+def facts_script(iface: str) -> str:
+    return FACTS_SCRIPT.format(iface=iface)
+
+
+def parse_facts(output: str) -> dict:
+    """
+    Parse the output of the facts script
+    :param output:
+    :return: facts, with numbers converted and the addresses and consul containers as lists
+    """
+    values = {}
+    for line in output.splitlines():
+        key, separator, value = line.strip().partition("=")
+        if separator:
+            values[key] = value.strip()
+
+    def number(key: str) -> Optional[int]:
+        try:
+            return int(values.get(key))
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "cluster_ip": re.sub("/[0-9]+$", "", values.get("cluster_ip", "")),
+        "addresses": [re.sub("/[0-9]+$", "", address) for address in values.get("addresses", "").split()],
+        "cpus": number("cpus"),
+        "memory_kb": number("memory_kb"),
+        "kernel": values.get("kernel") or None,
+        "docker_version": values.get("docker_version") or None,
+        "consul": values.get("consul", "").split(),
+    }
+
+
+def fingerprint(node: Node) -> str:
+    """
+    Identity of the machine the facts were gathered from: its address, the cluster interface and its ssh key (a
+    recreated machine gets a new key)
+    :param node:
+    :return:
+    """
+    key_path = os.path.join(node.machine_path or "", "id_rsa")
+    return digest(node.name, node.public_ip, node.cluster_iface,
+                  file_digest(key_path) if os.path.isfile(key_path) else None)
+
+
+class FactStore(object):
+    """
+    Facts per node, kept as JSON files (one per node) so later runs do not have to gather them again. Facts are only
+    served while the fingerprint of the node matches the one they were gathered with, and are invalidated when dsc
+    creates or removes the machine. The consul containers are the ones that ran when the facts were gathered: they
+    change whenever consul is started, so they do not invalidate the facts and nothing relies on them being current.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.facts = {}  # type: Dict[str, dict]
+        self.lock = threading.Lock()
+
+    def get(self, node: Node) -> Optional[dict]:
+        """
+        Get the facts of a node, or None if they have to be gathered
+        :param node:
+        :return:
+        """
+        with self.lock:
+            entry = self.facts.get(node.name)
+            if entry is None:
+                try:
+                    with open(self._file(node)) as handle:
+                        entry = self.facts[node.name] = json.load(handle)
+                except (OSError, ValueError):
+                    return None
+
+        if entry.get("fingerprint") != fingerprint(node):
+            return None
+
+        return entry.get("facts")
+
+    def set(self, node: Node, facts: dict) -> None:
+        entry = {"fingerprint": fingerprint(node), "time": time.time(), "facts": facts}
+        with self.lock:
+            self.facts[node.name] = entry
+            os.makedirs(self.path, exist_ok=True)
+            write_file_atomic(self._file(node), json.dumps(entry, indent=2, sort_keys=True))
+
+    def invalidate(self, node: Node) -> None:
+        """
+        Forget the facts of a node (e.g. after dsc changed it)
+        :param node:
+        """
+        with self.lock:
+            self.facts.pop(node.name, None)
+            try:
+                os.unlink(self._file(node))
+            except FileNotFoundError:
+                pass
+
+    def _file(self, node: Node) -> str:
+        return os.path.join(self.path, "{}.json".format(node.name))
@@ -0,0 +1,134 @@
+import os
+import re
+import shlex
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from dsc.nodes import Node, NodeType
+
+# How nodes get the consul images before consul is set up:
+# - off: docker-compose pulls them when consul starts
+# - pull: every node pulls them from the registry itself, in a step of its own
+# - load: they are pulled once on this machine and streamed to the nodes (docker save | docker load), the default
+# - mirror: every node pulls them from a local registry mirror, the default when there is one
+PREWARM_MODES = ["off", "pull", "load", "mirror"]
+
+# Compose template of the consul container per node type
+CONSUL_COMPOSE_FILES = OrderedDict([(NodeType.master, "server.yml"), (NodeType.worker, "agent.yml")])
+
+IMAGE_PATTERN = re.compile(r"^\s*image:\s*[\"']?([^\"'\s]+)", re.MULTILINE)
+
+
+def compose_images(compose_dir: str) -> Dict[NodeType, str]:
+    """
+    Image of the consul container per node type, from the compose templates
+    :param compose_dir:
+    :return:
+    """
+    images = {}
+    for node_type, file in CONSUL_COMPOSE_FILES.items():
+        with open(os.path.join(compose_dir, file)) as handle:
+            match = IMAGE_PATTERN.search(handle.read())
+        if match:
+            images[node_type] = match.group(1)
+    return images
+
+
+def image_id_command(image: str) -> str:
+    return "docker inspect --type image --format '{{{{.Id}}}}' {} 2>/dev/null".format(shlex.quote(image))
+
+
+class ImagePrewarm(object):
+    """
+    Puts the consul images on the nodes before consul is set up, so starting consul does not wait for the registry.
+    Images are compared by id (the digest of their content), not by tag, so a tag that moved to a new image is
+    updated. In load mode every image is pulled and saved on this machine once per run (kept in images/ in the config
+    dir, by image id) and streamed to all nodes that do not have that id yet. In pull and mirror mode the nodes pull
+    the image, which only downloads it when the digest in the registry differs from the one they have.
+    """
+
+    def __init__(self, path: str, mode: str, mirror: Optional[str], run_docker: Callable[[List[str]], str],
+                 run_remote: Callable[..., str]):
+        """
+        :param path: directory for the saved images
+        :param mode: one of PREWARM_MODES
+        :param mirror: address of the registry mirror (host:port), for mirror mode
+        :param run_docker: runs a local docker command and returns its output
+        :param run_remote: runs a shell command on a node (node, command, input) and returns its output
+        """
+        self.path = path
+        self.mode = mode
+        self.mirror = mirror
+        self.run_docker = run_docker
+        self.run_remote = run_remote
+        self.archives = {}  # type: Dict[str, bytes]
+        self.image_ids = {}  # type: Dict[str, str]
+        self.errors = {}  # type: Dict[str, RuntimeError]
+        self.lock = threading.Lock()
+
+    def distribute(self, node: Node, image: str) -> bool:
+        """
+        Put an image on a node, unless it is there already
+        :param node:
+        :param image:
+        :return: whether the image was sent to or pulled by the node
+        """
+        if self.mode == "load":
+            image_id = self.fetch(image)
+            remote_id = self.run_remote(node, "{}; true".format(image_id_command(image))).strip()
+            if remote_id == image_id:
+                return False
+            self.run_remote(node, "docker load", self.archives[image])
+            return True
+
+        if self.mode == "mirror":
+            source = "{}/{}".format(self.mirror.rstrip("/"), image)
+            command = "docker pull {source} && docker tag {source} {image}".format(source=shlex.quote(source),
+                                                                                 image=shlex.quote(image))
+        else:
+            command = "docker pull {}".format(shlex.quote(image))
+
+        # The pull is a no-op when the node has the image of the registry already, the id tells whether it changed
+        output = self.run_remote(node, "before=$({id}); {{ {pull}; }} >/dev/null && "
+                                       "{{ [ \"$before\" = \"$({id})\" ] && echo present; true; }}".format(
+                                           id=image_id_command(image), pull=command))
+        return output.strip() != "present"
+
+    def fetch(self, image: str) -> str:
+        """
+        Pull and save an image on this machine, once. When the pull fails (e.g. no registry access), the image this
+        machine has already is used; when there is none, every node fails with the same error.
+        :param image:
+        :return: id of the image
+        """
+        with self.lock:
+            if image in self.image_ids:
+                return self.image_ids[image]
+            if image in self.errors:
+                raise self.errors[image]
+
+            try:
+                try:
+                    self.run_docker(["pull", image])
+                except RuntimeError:
+                    pass
+                image_id = self._image_id(image)
+            except RuntimeError as rte:
+                self.errors[image] = rte
+                raise
+
+            archive = os.path.join(self.path, "{}-{}.tar".format(re.sub(r"[^a-zA-Z0-9.\-]", "_", image),
+                                                                 image_id.split(":")[-1][:12]))
+            if not os.path.isfile(archive):
+                os.makedirs(self.path, exist_ok=True)
+                self.run_docker(["save", "-o", archive + ".tmp", image])
+                os.replace(archive + ".tmp", archive)
+
+            with open(archive, "rb") as handle:
+                self.archives[image] = handle.read()
+            self.image_ids[image] = image_id
+            return image_id
+
+    def _image_id(self, image: str) -> str:
+        return self.run_docker(["inspect", "--type", "image", "--format", "{{.Id}}", image]).strip()
@@ -0,0 +1,145 @@
+import re
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dsc.const import MACHINE_DRIVERS
+
+# Settings a node gets from its template (and the templates that one inherits from)
+TEMPLATE_KEYS = ["machine-driver", "driver-opts", "engine-opts", "cluster-interface"]
+
+NODE_TYPES = ["master", "worker"]
+
+# Machine names docker-machine accepts
+NAME_PATTERN = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9\-.]*$")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class Inventory(object):
+    """
+    The nodes of dsc.yaml: nodes listed one by one under nodes, and groups of count nodes that are named after a pattern
+    (e.g. "worker-{index:03d}"). Nodes and groups take machine-driver, driver-opts, engine-opts and cluster-interface
+    from a template (templates can inherit from another template), their own settings win. The config is validated
+    once, nodes of groups are only expanded when they are iterated.
+    """
+
+    def __init__(self, nodes: dict = None, groups: dict = None, templates: dict = None):
+        self.nodes = nodes or {}
+        self.groups = groups or {}
+        self.templates = templates or {}
+        self.resolved = {}  # type: Dict[str, dict]
+        self.group_configs = None  # type: Optional[List[Tuple[str, dict, dict]]]
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        """
+        Name and settings of every node, the listed nodes first and then the nodes of every group
+        """
+        for name, settings in self.nodes.items():
+            yield str(name), self._node_config(settings or {}, "node {}".format(name))
+
+        for name, group, config in self._groups():
+            for index in range(group["start"], group["start"] + group["count"]):
+                # All nodes of a group share their settings
+                yield group["name"].format(index=index, group=name), config
+
+    def validate(self) -> None:
+        """
+        Check the whole config, once
+        :raises ConfigError:
+        """
+        for name in self.templates:
+            self._template(name, [])
+
+        names = set()
+        for name, _ in self.items():
+            if not NAME_PATTERN.match(name):
+                raise ConfigError("Invalid node name {}: only letters, digits, dashes and dots are allowed".format(
+                    name))
+            if name in names:
+                raise ConfigError("Node {} is configured more than once".format(name))
+            names.add(name)
+
+    def _groups(self) -> List[Tuple[str, dict, dict]]:
+        if self.group_configs is None:
+            self.group_configs = []
+            for name, settings in self.groups.items():
+                what = "group {}".format(name)
+                settings = settings or {}
+                count = settings.get("count")
+                if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+                    raise ConfigError("{}: count must be a number of nodes".format(what))
+                start = settings.get("start", 1)
+                if not isinstance(start, int) or isinstance(start, bool):
+                    raise ConfigError("{}: start must be a number".format(what))
+                pattern = str(settings.get("name", "{group}-{index}"))
+                try:
+                    pattern.format(index=start, group=name)
+                except (KeyError, IndexError, ValueError) as ex:
+                    raise ConfigError("{}: invalid name pattern {} ({})".format(what, pattern, ex))
+                if count > 1 and "{index" not in pattern:
+                    raise ConfigError("{}: the name pattern needs {{index}} to name {} nodes".format(what, count))
+
+                node_settings = OrderedDict([(key, value) for key, value in settings.items()
+                                             if key not in ["count", "start", "name"]])
+                self.group_configs.append((str(name), {"count": count, "start": start, "name": pattern},
+                                           self._node_config(node_settings, what)))
+
+        return self.group_configs
+
+    def _node_config(self, settings: dict, what: str) -> dict:
+        """
+        Settings of a node or group, merged with its template
+        :param settings:
+        :param what: description of the node or group for errors
+        :return:
+        """
+        if not isinstance(settings, dict):
+            raise ConfigError("{}: settings must be a mapping".format(what))
+
+        config = OrderedDict([("driver-opts", None), ("engine-opts", None)])
+        if settings.get("template") is not None:
+            config.update(self._template(settings["template"], [], what))
+        config.update([(key, value) for key, value in settings.items() if key != "template"])
+
+        if config.get("type") not in NODE_TYPES:
+            raise ConfigError("{}: type must be one of {}, not {}".format(what, ", ".join(NODE_TYPES),
+                                                                           config.get("type")))
+        if config.get("machine-driver") not in MACHINE_DRIVERS:
+            raise ConfigError("{}: machine-driver must be one of {}, not {}".format(
+                what, ", ".join(MACHINE_DRIVERS), config.get("machine-driver")))
+
+        return config
+
+    def _template(self, name: str, seen: List[str], what: str = None) -> dict:
+        """
+        Settings of a template, merged with the templates it inherits from
+        :param name:
+        :param seen: templates that inherit from this one (to detect cycles)
+        :param what: description of the node or group that uses the template, for errors
+        :return:
+        """
+        if name in self.resolved:
+            return self.resolved[name]
+
+        if name not in self.templates:
+            raise ConfigError("{}unknown template {}".format("{}: ".format(what) if what else "", name))
+        if name in seen:
+            raise ConfigError("Template {} inherits from itself".format(" -> ".join(seen + [name])))
+
+        settings = self.templates[name] or {}
+        if not isinstance(settings, dict):
+            raise ConfigError("Template {}: settings must be a mapping".format(name))
+        unknown = [key for key in settings if key not in TEMPLATE_KEYS + ["template"]]
+        if unknown:
+            raise ConfigError("Template {}: unknown setting(s) {}, templates can set {}".format(
+                name, ", ".join(unknown), ", ".join(TEMPLATE_KEYS)))
+
+        template = OrderedDict()
+        if settings.get("template") is not None:
+            template.update(self._template(settings["template"], seen + [name], what))
+        template.update([(key, value) for key, value in settings.items() if key != "template"])
+
+        self.resolved[name] = template
+        return template
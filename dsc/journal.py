@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, TextIO, Tuple
+
+from dsc.nodes import Node
+
+
+class StepJournal(object):
+    """
+    Append-only journal of the steps completed per node during a run, with the digest of their inputs. Every step is
+    written as one JSON line the moment it completes, so the journal survives a crash or Ctrl-C halfway through a
+    rollout. The journal is removed once a run completes; the next run after an interrupted one resumes from it and
+    skips the steps that were already completed with the same inputs.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.steps = {}  # type: Dict[Tuple[str, str], str]
+        self.handle = None  # type: Optional[TextIO]
+        self.lock = threading.Lock()
+
+    def open(self, resume: bool = True) -> int:
+        """
+        Start journaling a run
+        :param resume: continue the journal of an interrupted run, otherwise start an empty one
+        :return: number of steps resumed from an interrupted run
+        """
+        with self.lock:
+            self.steps = {}
+            if resume:
+                try:
+                    with open(self.path) as handle:
+                        for line in handle:
+                            try:
+                                entry = json.loads(line)
+                                if entry.get("forget"):
+                                    self._drop(entry["node"])
+                                    continue
+                                self.steps[(entry["node"], entry["step"])] = entry["digest"]
+                            except (ValueError, KeyError, TypeError, AttributeError):
+                                # A crash can leave a partial last line behind
+                                continue
+                except OSError:
+                    pass
+
+            self.handle = open(self.path, "a" if resume else "w")
+            return len(self.steps)
+
+    def done(self, node: Node, step: str, step_digest: str) -> bool:
+        """
+        Whether a step was completed for a node with the given inputs
+        :param node:
+        :param step:
+        :param step_digest:
+        :return:
+        """
+        with self.lock:
+            return self.steps.get((node.name, step)) == step_digest
+
+    def record(self, node: Node, step: str, step_digest: str) -> None:
+        """
+        Record that a step has been completed for a node
+        :param node:
+        :param step:
+        :param step_digest:
+        """
+        with self.lock:
+            self.steps[(node.name, step)] = step_digest
+            if self.handle is not None:
+                self.handle.write(json.dumps({"node": node.name, "step": step, "digest": step_digest,
+                                              "time": round(time.time(), 3)}) + "\n")
+                self.handle.flush()
+
+    def forget(self, node: Node) -> None:
+        """
+        Forget the steps completed for a node, e.g. when its machine was created again or removed, so a resumed run
+        does not skip them on the new machine
+        :param node:
+        """
+        with self.lock:
+            self._drop(node.name)
+            entry = json.dumps({"node": node.name, "forget": True, "time": round(time.time(), 3)}) + "\n"
+            if self.handle is not None:
+                self.handle.write(entry)
+                self.handle.flush()
+            elif os.path.isfile(self.path):
+                # Another command than the rollout: the journal of an interrupted rollout must forget the node too
+                with open(self.path, "a") as handle:
+                    handle.write(entry)
+
+    def close(self, complete: bool = False) -> None:
+        """
+        Stop journaling
+        :param complete: the run completed, remove the journal so the next run starts from scratch
+        """
+        with self.lock:
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+
+            if complete:
+                self.steps = {}
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+
+    def _drop(self, name: str) -> None:
+        for key in [key for key in self.steps if key[0] == name]:
+            del self.steps[key]
@@ -0,0 +1,140 @@
+import json
+import os
+import shlex
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from dsc.nodes import Node
+from dsc.util import write_file_atomic
+
+
+def merge_list(items: Optional[List[str]], additions: List[str]) -> List[str]:
+    """
+    Add items to a list that are not in it yet, keeping the order
+    :param items:
+    :param additions:
+    :return:
+    """
+    items = list(items or [])
+    for item in additions:
+        if item not in items:
+            items.append(item)
+    return items
+
+
+# Flags the engine or swarm manager takes only once, an updated value has to replace the old one. Other flags (e.g.
+# dns, dns-search) can be given more than once, also through engine-opts: the values dsc set are replaced, the ones of
+# engine-opts are kept.
+SINGLE_VALUED_FLAGS = ["cluster-advertise", "cluster-store", "advertise", "replication"]
+
+
+def engine_opt_flags(engine_opts: Optional[str]) -> List[str]:
+    """
+    Engine flags given with --engine-opt in the engine-opts of a node, as docker-machine stores them
+    :param engine_opts:
+    :return:
+    """
+    try:
+        args = shlex.split(engine_opts or "")
+    except ValueError:
+        args = (engine_opts or "").split()
+
+    flags = []
+    for index, arg in enumerate(args):
+        if arg.startswith("--engine-opt="):
+            flags.append(arg.split("=", 1)[1])
+        elif arg == "--engine-opt" and index + 1 < len(args):
+            flags.append(args[index + 1])
+    return flags
+
+
+def merge_flags(flags: Optional[List[str]], additions: List[str], keep: Optional[List[str]] = None) -> List[str]:
+    """
+    Merge key=value flags: a flag of the additions replaces the existing flags with the same key, except for the
+    flags in keep (given by the user) of keys that can be given more than once
+    :param flags:
+    :param additions:
+    :param keep:
+    :return:
+    """
+    keys = [flag.split("=", 1)[0] for flag in additions if "=" in flag]
+    flags = [flag for flag in flags or [] if "=" not in flag or flag.split("=", 1)[0] not in keys or
+             (flag.split("=", 1)[0] not in SINGLE_VALUED_FLAGS and flag in (keep or []))]
+    return merge_list(flags, additions)
+
+
+class MachineConfigStore(object):
+    """
+    Cache of docker-machine configs (config.json) per node. A config is re-read only when its file changed on disk,
+    and only written back when it was actually modified, using a temporary file and a rename so a crash never leaves
+    a truncated config.json behind.
+    """
+
+    def __init__(self):
+        self.configs = {}  # type: Dict[str, Tuple[int, str, dict]]
+        self.lock = threading.Lock()
+
+    def get(self, node: Node) -> dict:
+        """
+        Get the machine config of a node
+        :param node:
+        :return:
+        :raises FileNotFoundError: when the machine has no config.json (yet)
+        """
+        path = _config_path(node)
+        mtime = os.stat(path).st_mtime_ns
+
+        with self.lock:
+            cached = self.configs.get(node.name)
+            if cached is not None and cached[0] == mtime:
+                return cached[2]
+
+        with open(path) as config_file:
+            data = config_file.read()
+
+        config = json.loads(data)
+        with self.lock:
+            self.configs[node.name] = (mtime, _serialize(config), config)
+
+        return config
+
+    def save(self, node: Node) -> bool:
+        """
+        Write the machine config of a node, if it changed since it was read
+        :param node:
+        :return: whether the config was written
+        """
+        with self.lock:
+            cached = self.configs.get(node.name)
+            if cached is None:
+                return False
+
+            _, original, config = cached
+            data = _serialize(config)
+            if data == original:
+                return False
+
+            try:
+                write_file_atomic(_config_path(node), json.dumps(config))
+            except OSError as ex:
+                raise RuntimeError("Error writing machine config: {}".format(ex))
+
+            self.configs[node.name] = (os.stat(_config_path(node)).st_mtime_ns, data, config)
+
+        return True
+
+    def invalidate(self, node: Node) -> None:
+        """
+        Drop the cached config of a node (e.g. after docker-machine rewrote it)
+        :param node:
+        """
+        with self.lock:
+            self.configs.pop(node.name, None)
+
+
+def _config_path(node: Node) -> str:
+    return os.path.join(node.machine_path, "config.json")
+
+
+def _serialize(config: dict) -> str:
+    return json.dumps(config, sort_keys=True)
@@ -10,10 +10,13 @@ class Node(object):
         self.public_ip = None
         self.cluster_ip = None
         self.cluster_iface = None
+        self.facts = {}
         self.is_primary = False
         self.domain = None
         self.config = None
         self.machine_path = None
+        self.steps = []
+        self.desired = None
 
     @classmethod
     def load(cls, **kwargs):
@@ -0,0 +1,197 @@
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Optional, TextIO
+
+_prefix = ContextVar("prefix", default="")
+_node = ContextVar("node", default=None)
+_lock = threading.Lock()
+
+# Latest line of command output per running node, shown in the progress line in compact mode
+_progress = OrderedDict()  # type: OrderedDict[str, str]
+_compact = False
+_logs = None  # type: Optional[LogFiles]
+
+
+class LogFile(object):
+    """
+    Append-only log file that is rotated to <name>.1 ... <name>.<backups> once it grows over max_bytes
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.handle = None  # type: Optional[TextIO]
+        self.size = 0
+
+    def write(self, data: str) -> None:
+        if self.handle is None:
+            self.handle = open(self.path, "a", errors="replace")
+            self.size = self.handle.tell()
+
+        if self.size > 0 and self.size + len(data) > self.max_bytes:
+            self._rotate()
+
+        self.handle.write(data)
+        self.size += len(data)
+
+    def flush(self) -> None:
+        if self.handle is not None:
+            self.handle.flush()
+
+    def close(self) -> None:
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def _rotate(self) -> None:
+        self.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists("{}.{}".format(self.path, index)):
+                os.replace("{}.{}".format(self.path, index), "{}.{}".format(self.path, index + 1))
+        if self.backups > 0:
+            os.replace(self.path, "{}.1".format(self.path))
+        else:
+            os.unlink(self.path)
+        self.handle = open(self.path, "a", errors="replace")
+        self.size = 0
+
+
+class LogFiles(object):
+    """
+    One log file per node (<node>.log) in a directory, plus dsc.log for output that does not belong to a node
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.files = {}  # type: Dict[str, LogFile]
+
+    def write(self, node: Optional[str], data: str) -> None:
+        name = node or "dsc"
+        if name not in self.files:
+            os.makedirs(self.path, exist_ok=True)
+            self.files[name] = LogFile(os.path.join(self.path, "{}.log".format(name)), self.max_bytes,
+                                       self.backups)
+        self.files[name].write(data)
+
+    def flush(self) -> None:
+        for log_file in self.files.values():
+            log_file.flush()
+
+    def close(self) -> None:
+        for log_file in self.files.values():
+            log_file.close()
+        self.files = {}
+
+
+def set_prefix(prefix: str = "", node: str = None) -> None:
+    """
+    Set the output prefix for the current thread or task (used to tag output per node)
+    :param prefix:
+    :param node: name of the node the output belongs to, selects its log file
+    """
+    _prefix.set(prefix)
+    _node.set(node)
+
+
+def get_prefix() -> str:
+    return _prefix.get()
+
+
+def get_node() -> Optional[str]:
+    return _node.get()
+
+
+def open_logs(path: str, max_bytes: int, backups: int, compact: bool = False) -> None:
+    """
+    Start writing all output to per-node log files
+    :param path: directory for the log files
+    :param max_bytes: size at which a log file is rotated
+    :param backups: number of rotated log files to keep per node
+    :param compact: do not mirror command output to the console, show the latest line per node instead
+    """
+    global _logs, _compact
+    with _lock:
+        _logs = LogFiles(path, max_bytes, backups)
+        _compact = compact
+
+
+def close_logs() -> None:
+    global _logs
+    with _lock:
+        _clear_progress()
+        _progress.clear()
+        if _logs is not None:
+            _logs.close()
+            _logs = None
+
+
+def write(message: str) -> None:
+    """
+    Write a message to stdout, prefixed with the prefix of the current thread or task, and to the log file of its node
+    :param message:
+    """
+    with _lock:
+        _clear_progress()
+        sys.stdout.write("{}{}".format(get_prefix(), message))
+        sys.stdout.flush()
+        if _logs is not None:
+            _logs.write(_node.get(), message)
+        _draw_progress()
+
+
+def log(message: str) -> None:
+    write("{}\n".format(message))
+
+
+def command_output(line: str, show_output: bool = True) -> None:
+    """
+    Handle a line of command output: it always goes to the log file, and to the console when show_output is set
+    (in compact mode only as the progress line of the node)
+    :param line:
+    :param show_output:
+    """
+    if show_output and not _compact:
+        write("++ {}\n".format(line))
+        return
+
+    with _lock:
+        if _logs is not None:
+            _logs.write(_node.get(), "++ {}\n".format(line))
+        if show_output:
+            _clear_progress()
+            _progress[_node.get() or "dsc"] = line
+            _draw_progress()
+
+
+def command_done() -> None:
+    """
+    Flush the log file and remove the progress of the current node once its command is done
+    """
+    with _lock:
+        if _logs is not None:
+            _logs.flush()
+        if _progress.pop(_node.get() or "dsc", None) is not None:
+            _clear_progress()
+            _draw_progress()
+
+
+def _clear_progress() -> None:
+    if _progress and sys.stdout.isatty():
+        sys.stdout.write("\r\x1b[K")
+
+
+def _draw_progress() -> None:
+    if not _progress or not sys.stdout.isatty():
+        return
+
+    width = shutil.get_terminal_size().columns - 1
+    status = " | ".join(["{}: {}".format(node.split(".")[0], line) for node, line in _progress.items()])
+    sys.stdout.write(status[:width])
+    sys.stdout.flush()
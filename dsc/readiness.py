@@ -0,0 +1,91 @@
+import random
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from dsc.engine import EngineClient, EngineError
+
+CONSUL_HTTP_PORT = 8500
+
+# Seconds between polls: the first poll comes quickly, every poll that finds nothing new waits longer, up to the maximum
+POLL_INITIAL = 0.2
+POLL_MAXIMUM = 5.0
+POLL_FACTOR = 1.5
+
+
+class NotReady(RuntimeError):
+    pass
+
+
+class ConsulClient(EngineClient):
+    """
+    Client for the HTTP API of the consul agent of a node
+    """
+
+    service = "consul"
+
+    def __init__(self, host: str, timeout: float = 5):
+        super().__init__(host, CONSUL_HTTP_PORT, None, timeout)
+        self.node_name = None  # type: Optional[str]
+
+    def leader(self) -> Optional[str]:
+        """
+        Address of the raft leader, None while there is none
+        :return:
+        """
+        return self._json(self.request("GET", "/v1/status/leader")) or None
+
+    def registered(self) -> bool:
+        """
+        Whether the node of the agent is in the catalog
+        :return:
+        """
+        if self.node_name is None:
+            self.node_name = self._json(self.request("GET", "/v1/agent/self"))["Config"]["NodeName"]
+        return self._json(self.request("GET", "/v1/catalog/node/{}".format(urllib.parse.quote(self.node_name)))) \
+            is not None
+
+
+def check(probe: Callable[[], object]) -> Callable[[], bool]:
+    """
+    Turn a probe into a check: passed when it returns something, not passed (yet) when it fails to reach the node
+    :param probe:
+    :return:
+    """
+    def run() -> bool:
+        try:
+            return bool(probe())
+        except (EngineError, KeyError, TypeError):
+            return False
+    return run
+
+
+def wait_for(checks: "OrderedDict[str, Callable[[], bool]]", timeout: float, what: str) -> float:
+    """
+    Poll checks until all of them passed, with adaptive backoff: polling starts fast and slows down while nothing
+    changes, and speeds up again whenever a check passes
+    :param checks: check per description, a check that passed is not polled again
+    :param timeout: seconds to wait at most
+    :param what: description of what is waited for, for the error
+    :return: seconds waited
+    :raises NotReady: when not all checks passed before the deadline
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    pending = OrderedDict(checks)
+    delay = POLL_INITIAL
+    while True:
+        passed = [name for name, test in pending.items() if test()]
+        for name in passed:
+            del pending[name]
+        if not pending:
+            return time.monotonic() - start
+
+        now = time.monotonic()
+        if now >= deadline:
+            raise NotReady("{} not ready after {:g}s: {}".format(what, timeout, ", ".join(pending)))
+
+        delay = POLL_INITIAL if passed else min(POLL_MAXIMUM, delay * POLL_FACTOR)
+        # Jitter, so the nodes that wait at the same time do not poll in lockstep
+        time.sleep(min(deadline - now, delay * random.uniform(0.8, 1.2)))
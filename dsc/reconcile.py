@@ -0,0 +1,115 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+
+from dsc.nodes import Node
+from dsc.util import write_file_atomic
+
+# Configuration steps of a node, in the order they are applied
+CONFIG_STEPS = ["certs", "consul-config", "consul", "dns", "machine-config"]
+# Steps that only touch consul, they can be applied to a node without provisioning it
+CONSUL_STEPS = ["certs", "consul-config", "consul"]
+# Steps after which a node counts as rolled out: consul was set up on it, or it was provisioned with its swarm config
+ROLLED_OUT_STEPS = ["consul", "machine-config"]
+
+
+def digest(*parts: Union[str, bytes, None]) -> str:
+    """
+    Content hash of one or more inputs
+    :param parts:
+    :return:
+    """
+    sha = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = ""
+        sha.update(part if isinstance(part, bytes) else str(part).encode())
+        sha.update(b"\x00")
+    return sha.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as handle:
+        return hashlib.sha256(handle.read()).hexdigest()
+
+
+class AppliedState(object):
+    """
+    Record of the input hashes of the last successfully applied step per node. Records are kept in memory and written
+    with save() once a run is done; the step journal covers a crash halfway through a run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.applied = None  # type: Optional[Dict[str, Dict[str, str]]]
+        self.dirty = False
+
+    def get(self, node: Node, step: str) -> Optional[str]:
+        with self.lock:
+            return self._load().get(node.name, {}).get(step)
+
+    def record(self, node: Node, step: str, step_digest: str) -> None:
+        """
+        Record that a step has been applied to a node with the given inputs
+        :param node:
+        :param step:
+        :param step_digest:
+        """
+        with self.lock:
+            self._load().setdefault(node.name, {})[step] = step_digest
+            self.dirty = True
+
+    def known(self, node: Node, steps: List[str] = None) -> bool:
+        """
+        Whether any step has been applied to a node
+        :param node:
+        :param steps: only count these steps, defaults to all
+        :return:
+        """
+        with self.lock:
+            applied = self._load().get(node.name) or {}
+            return bool([step for step in applied if steps is None or step in steps])
+
+    def nodes(self) -> List[str]:
+        """
+        Names of the nodes steps have been applied to
+        :return:
+        """
+        with self.lock:
+            return sorted([name for name, steps in self._load().items() if steps])
+
+    def forget(self, node: Node) -> None:
+        with self.lock:
+            if self._load().pop(node.name, None) is not None:
+                self.dirty = True
+
+    def save(self) -> None:
+        """
+        Write the applied state to disk, if anything was recorded or forgotten since it was read
+        """
+        with self.lock:
+            if self.dirty:
+                write_file_atomic(self.path, json.dumps(self.applied, indent=2, sort_keys=True))
+                self.dirty = False
+
+    def changed(self, node: Node, desired: "OrderedDict[str, str]") -> List[str]:
+        """
+        Steps of which the desired inputs differ from the last applied inputs
+        :param node:
+        :param desired: digest per step
+        :return:
+        """
+        return [step for step, step_digest in desired.items() if self.get(node, step) != step_digest]
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if self.applied is None:
+            try:
+                with open(self.path) as handle:
+                    self.applied = json.load(handle)
+            except (OSError, ValueError):
+                self.applied = {}
+
+        return self.applied
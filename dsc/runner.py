@@ -0,0 +1,165 @@
+import asyncio
+import os
+import re
+from collections import deque
+from asyncio.subprocess import DEVNULL, PIPE, STDOUT
+from typing import List, Optional, Tuple, Union
+
+from dsc.output import command_done, command_output
+from dsc.trace import command_name, redact_command, tracer
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Lines of output kept in memory per command, for the value it returns and its error message (the log file of the
+# node gets all of it)
+OUTPUT_LINES = 1000
+
+
+class CommandError(RuntimeError):
+    def __init__(self, exit_code: int, output: str):
+        super().__init__("command error %s: %s" % (exit_code, output))
+        self.exit_code = exit_code
+        self.output = output
+
+
+class CommandTimeout(CommandError):
+    def __init__(self, timeout: float, output: str):
+        super().__init__(None, output)
+        self.args = ("command timed out after %ss: %s" % (timeout, output),)
+        self.timeout = timeout
+
+
+def build_command(command):
+    command = re.sub(r"\"", "'", command)
+    return [part.replace("\x00", " ") for part in
+            re.sub("'(.+?)'", lambda m: m.group(1).replace(" ", "\x00"), command).split()]
+
+
+def prepare_command(program: str, command: Union[str, List[str]],
+                    use_shell: bool = False) -> Union[str, List[str]]:
+    """
+    Build the argument list (or shell command line) for a program
+    :param program:
+    :param command: command line, or a list of arguments that is passed as is
+    :param use_shell:
+    :return:
+    """
+    if isinstance(command, list):
+        return [program] + command
+
+    if use_shell:
+        return "{} {}".format(program, command)
+
+    command = re.sub(r"\s+", " ", command)
+    return [program] + build_command(command)
+
+
+def command_env(extra_env: dict = None) -> dict:
+    env = os.environ.copy()
+    env["PATH"] += ":/usr/local/bin"
+    if extra_env is not None:
+        env.update(extra_env)
+    return env
+
+
+async def run_command_async(program: str, command: Union[str, List[str]], raise_error: bool = True,
+                            use_shell: bool = False, show_output: bool = True, extra_env: dict = None,
+                            timeout: float = None, input: bytes = None) -> str:
+    """
+    Run a command without blocking the event loop, streaming its output while it runs. Cancelling the task that awaits
+    it kills the command; util.run_command, which dsc uses, waits for it and cannot be cancelled.
+    :param program:
+    :param command:
+    :param raise_error: raise a CommandError when the command exits with a non-zero exit code
+    :param use_shell:
+    :param show_output: mirror the output to the console
+    :param extra_env:
+    :param timeout: seconds after which the command is killed and a CommandTimeout is raised
+    :param input: data to send to stdin of the command
+    :return: output (stdout and stderr) of the command, the last OUTPUT_LINES lines of it
+    """
+    args = prepare_command(program, command, use_shell)
+    options = dict(stdin=PIPE if input is not None else DEVNULL, stdout=PIPE, stderr=STDOUT, env=command_env(extra_env))
+
+    with tracer.span(command_name(program, command), command=_describe(args)) as span:
+        exit_code, output = await _execute(args, use_shell, options, show_output, timeout, input)
+        span.attrs["exit_code"] = exit_code
+
+        if exit_code and raise_error:
+            raise CommandError(exit_code, output)
+
+    return output
+
+
+async def _execute(args: Union[str, List[str]], use_shell: bool, options: dict, show_output: bool,
+                   timeout: Optional[float], input: Optional[bytes]) -> Tuple[int, str]:
+    if use_shell:
+        process = await asyncio.create_subprocess_shell(args, **options)
+    else:
+        process = await asyncio.create_subprocess_exec(*args, **options)
+
+    lines = deque(maxlen=OUTPUT_LINES)
+
+    def emit(line: bytes):
+        line = line.decode(errors="replace").rstrip("\r")
+        lines.append(line.strip())
+        command_output(line, show_output)
+
+    async def feed_input():
+        try:
+            process.stdin.write(input)
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
+
+    async def communicate():
+        feeder = asyncio.ensure_future(feed_input()) if input is not None else None
+
+        # Read in chunks instead of lines, so very long lines do not overrun the stream buffer
+        pending = b""
+        while True:
+            chunk = await process.stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            *complete, pending = (pending + chunk).split(b"\n")
+            for line in complete:
+                emit(line)
+            if len(pending) > READ_CHUNK_SIZE:
+                emit(pending)
+                pending = b""
+        if pending:
+            emit(pending)
+
+        if feeder is not None:
+            await feeder
+
+        return await process.wait()
+
+    try:
+        exit_code = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        _kill(process)
+        await process.wait()
+        raise CommandTimeout(timeout, "\n".join(lines).strip())
+    except asyncio.CancelledError:
+        _kill(process)
+        await process.wait()
+        raise
+    finally:
+        command_done()
+
+    return exit_code, "\n".join(lines).strip()
+
+
+def _describe(args: Union[str, List[str]]) -> str:
+    command = redact_command(args if isinstance(args, str) else " ".join(args))
+    return command if len(command) <= 200 else command[:197] + "..."
+
+
+def _kill(process) -> None:
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,146 @@
+import heapq
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dsc.nodes import Node
+from dsc.output import log, set_prefix
+
+_current = ContextVar("task", default=None)
+
+
+class Task(object):
+    def __init__(self, name: str, action: Callable[[], None], node: Optional[Node] = None,
+                 requires: List["Task"] = None, after: List["Task"] = None):
+        """
+        :param name:
+        :param action:
+        :param node: node the task works on (used to prefix its output)
+        :param requires: tasks that have to succeed before this task can run
+        :param after: tasks that have to be finished (successfully or not) before this task can run
+        """
+        self.name = name
+        self.action = action
+        self.node = node
+        self.requires = list(requires or [])
+        self.after = list(after or [])
+
+
+def current_task() -> Optional[Task]:
+    """
+    The task the current thread is running, if any
+    """
+    return _current.get()
+
+
+class Scheduler(object):
+    """
+    Runs tasks as soon as their dependencies are done, at most max_workers at the same time. Ready tasks start in
+    the order they were added. When a task fails, every task that requires it (directly or indirectly) is skipped.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max(1, max_workers)
+        self.tasks = []  # type: List[Task]
+
+    def add(self, name: str, action: Callable[[], None], node: Optional[Node] = None,
+            requires: List[Task] = None, after: List[Task] = None) -> Task:
+        task = Task(name, action, node, requires, after)
+        self.tasks.append(task)
+        return task
+
+    def run(self) -> Tuple[List[Task], List[Task]]:
+        """
+        Run all tasks
+        :return: failed tasks and skipped tasks
+        """
+        order, waiting, dependents, ready = self._graph()
+        failed = []
+        skipped = []
+
+        def finish(task: Task, success: bool) -> None:
+            for dependent in dependents[task]:
+                if waiting[dependent] < 0:
+                    continue
+                if not success and task in dependent.requires:
+                    waiting[dependent] = -1
+                    skipped.append(dependent)
+                    finish(dependent, False)
+                    continue
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, (order[dependent], dependent))
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while ready or running:
+                while ready and len(running) < self.max_workers:
+                    _, task = heapq.heappop(ready)
+                    running[executor.submit(self._run_task, task)] = task
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    if not future.result():
+                        failed.append(task)
+                    finish(task, future.result())
+
+        return failed, skipped
+
+    def makespan(self, durations: Dict[Task, float], max_workers: int = None) -> float:
+        """
+        Wall-clock time it takes to run all tasks when they take the given number of seconds, started in the same
+        order as run starts them
+        :param durations: seconds per task, tasks that are missing take no time
+        :param max_workers: defaults to the max_workers of the scheduler
+        :return:
+        """
+        max_workers = max(1, max_workers or self.max_workers)
+        order, waiting, dependents, ready = self._graph()
+        running = []  # type: List[Tuple[float, int, Task]]
+        now = 0.0
+        while ready or running:
+            while ready and len(running) < max_workers:
+                _, task = heapq.heappop(ready)
+                heapq.heappush(running, (now + durations.get(task, 0.0), order[task], task))
+
+            now, _, task = heapq.heappop(running)
+            for dependent in dependents[task]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, (order[dependent], dependent))
+
+        return now
+
+    def _graph(self) -> Tuple[Dict[Task, int], Dict[Task, int], Dict[Task, List[Task]], List[Tuple[int, Task]]]:
+        """
+        :return: position of every task, number of unfinished dependencies per task, dependents per task and the
+                 heap of tasks that are ready to run
+        """
+        order = {task: index for index, task in enumerate(self.tasks)}
+        waiting = {}  # type: Dict[Task, int]
+        dependents = {task: [] for task in self.tasks}  # type: Dict[Task, List[Task]]
+        ready = []
+        for task in self.tasks:
+            dependencies = set(task.requires + task.after)
+            waiting[task] = len(dependencies)
+            for dependency in dependencies:
+                dependents[dependency].append(task)
+            if not dependencies:
+                heapq.heappush(ready, (order[task], task))
+
+        return order, waiting, dependents, ready
+
+    def _run_task(self, task: Task) -> bool:
+        _current.set(task)
+        set_prefix("[{}] ".format(task.node.shortname) if task.node is not None and self.max_workers > 1 else "",
+                   task.node.name if task.node is not None else None)
+        try:
+            task.action()
+            return True
+        except Exception as ex:
+            log("! {} failed: {}".format(task.name, ex))
+            return False
+        finally:
+            _current.set(None)
+            set_prefix()
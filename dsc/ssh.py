@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from dsc.machine import MachineConfigStore
+from dsc.nodes import Node
+from dsc.util import run_command
+
+# Same options docker-machine uses for its external ssh client, without disabling connection sharing
+SSH_OPTIONS = [
+    "-F", "/dev/null",
+    "-o", "ConnectionAttempts=3",
+    "-o", "ConnectTimeout=10",
+    "-o", "LogLevel=quiet",
+    "-o", "PasswordAuthentication=no",
+    "-o", "IdentitiesOnly=yes",
+    "-o", "ServerAliveInterval=60",
+    "-o", "StrictHostKeyChecking=no",
+    "-o", "UserKnownHostsFile=/dev/null",
+]
+
+
+class SSHConnection(object):
+    """
+    Multiplexed ssh connection to a machine. The first command starts a control master that is kept open in the
+    background, later commands reuse it without a new handshake.
+    """
+
+    def __init__(self, ssh_bin: str, host: str, user: str, port: int, key_path: str, control_path: str,
+                 idle_timeout: int):
+        self.ssh_bin = ssh_bin
+        self.host = host
+        self.user = user
+        self.port = port
+        self.key_path = key_path
+        self.control_path = control_path
+        self.idle_timeout = idle_timeout
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        self.is_open = False
+
+    def args(self, *extra: str) -> List[str]:
+        return SSH_OPTIONS + [
+            "-o", "ControlMaster=auto",
+            "-o", "ControlPath={}".format(self.control_path),
+            "-o", "ControlPersist={}".format(self.idle_timeout),
+            "-i", self.key_path,
+            "-p", str(self.port),
+        ] + list(extra) + ["{}@{}".format(self.user, self.host)]
+
+    def open(self) -> None:
+        """
+        Start the control master, once
+        """
+        with self.lock:
+            if not self.is_open:
+                run_command(self.ssh_bin, self.args() + ["true"], show_output=False)
+                self.is_open = True
+
+    def command(self, remote_command: str) -> List[str]:
+        self.last_used = time.monotonic()
+        return self.args() + [remote_command]
+
+    def close(self) -> None:
+        with self.lock:
+            if self.is_open:
+                run_command(self.ssh_bin, self.args("-O", "exit"), raise_error=False, show_output=False)
+                self.is_open = False
+
+
+class SSHPool(object):
+    """
+    Pool of multiplexed ssh connections, one per machine, keyed by node name
+    """
+
+    def __init__(self, ssh_bin: Optional[str], machine_configs: MachineConfigStore, idle_timeout: int = 300):
+        self.ssh_bin = ssh_bin
+        self.machine_configs = machine_configs
+        self.idle_timeout = idle_timeout
+        self.connections = {}  # type: Dict[str, Optional[SSHConnection]]
+        self.lock = threading.Lock()
+        self.control_dir = None
+
+    def get(self, node: Node) -> Optional[SSHConnection]:
+        """
+        Get the (opened) connection for a node. Returns None when the node cannot be reached with plain ssh (no ssh
+        binary or no key in its machine config), the caller should fall back to docker-machine ssh then.
+        :param node:
+        :return:
+        """
+        if self.ssh_bin is None:
+            return None
+
+        self.evict_idle()
+
+        with self.lock:
+            if node.name not in self.connections:
+                self.connections[node.name] = self._connect(node)
+            connection = self.connections[node.name]
+
+        if connection is not None:
+            try:
+                connection.open()
+            except RuntimeError:
+                # Fall back to docker-machine ssh for this node
+                with self.lock:
+                    self.connections[node.name] = None
+                return None
+
+        return connection
+
+    def _connect(self, node: Node) -> Optional[SSHConnection]:
+        if node.machine_path is None:
+            return None
+
+        try:
+            driver = self.machine_configs.get(node)["Driver"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+        key_path = driver.get("SSHKeyPath")
+        if not driver.get("IPAddress") or not key_path or not os.path.isfile(key_path):
+            return None
+
+        if self.control_dir is None:
+            # Keep the socket path short, unix sockets are limited to ~100 characters
+            self.control_dir = tempfile.mkdtemp(prefix="dsc-ssh-")
+
+        return SSHConnection(self.ssh_bin, driver["IPAddress"], driver.get("SSHUser") or "root",
+                             driver.get("SSHPort") or 22, key_path, os.path.join(self.control_dir, "%C"),
+                             self.idle_timeout)
+
+    def evict_idle(self) -> None:
+        """
+        Close connections that have not been used for idle_timeout seconds
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [name for name, connection in self.connections.items()
+                    if connection is not None and connection.last_used < deadline]
+            connections = [self.connections.pop(name) for name in idle]
+
+        for connection in connections:
+            connection.close()
+
+    def invalidate(self, node: Node) -> None:
+        """
+        Forget the connection of a node (e.g. after its machine config changed)
+        :param node:
+        """
+        with self.lock:
+            connection = self.connections.pop(node.name, None)
+
+        if connection is not None:
+            connection.close()
+
+    def close_all(self) -> None:
+        with self.lock:
+            connections = [connection for connection in self.connections.values() if connection is not None]
+            self.connections = {}
+
+        for connection in connections:
+            connection.close()
+
+        if self.control_dir is not None:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
@@ -1,25 +1,138 @@
 import argparse
 import os
 import sys
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, namedtuple
+from typing import List
 
+from dsc.binaries import DOCKER, DOCKER_COMPOSE, DOCKER_MACHINE
+from dsc.const import STATE_PROBE_TIMEOUT
 from dsc.util import load_yaml
 
+Command = namedtuple("Command", ["help", "programs"])
+
+ROLLOUT_PROGRAMS = [DOCKER_MACHINE, DOCKER_COMPOSE, DOCKER]
+
+# The commands, with the programs they run: only those have to be installed (status and plan only read state)
+COMMANDS = OrderedDict([
+    ("start", Command("create and configure the swarm", ROLLOUT_PROGRAMS)),
+    ("plan", Command("show what apply would change", [])),
+    ("apply", Command("only apply what changed since the last run", ROLLOUT_PROGRAMS)),
+    ("add", Command("roll out new nodes without touching the others", ROLLOUT_PROGRAMS)),
+    # Removing a master reconfigures the remaining consul servers
+    ("remove", Command("drain and remove nodes", [DOCKER_MACHINE, DOCKER_COMPOSE])),
+    ("status", Command("show the state of every node", [])),
+    ("destroy", Command("remove the machines of all nodes", [DOCKER_MACHINE])),
+])
+DEFAULT_COMMAND = "start"
+# Commands that can be run against the recording command backend
+DRY_RUN_COMMANDS = ["start", "apply"]
+
 
 def get_default_config_dir():
     return "{}/{}".format(os.getcwd(), "config")
 
 
-def get_arguments(description: str = None):
+def get_arguments(description: str = None, argv: List[str] = None):
     parser = argparse.ArgumentParser(
         description=description)
+    _add_options(parser, defaults=True)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With start (the default command) or apply: record the commands instead of running them, show them per "
+             "node and estimate how long the rollout would take")
+    # Options of the commands, for when no command is given
+    parser.set_defaults(nodes=[], json=False, timeout=STATE_PROBE_TIMEOUT, yes=False)
+
+    subparsers = parser.add_subparsers(
+        dest="command",
+        metavar="command",
+        title="commands",
+        description="default: {}".format(DEFAULT_COMMAND))
+    for name, command in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=command.help, description=command.help.capitalize())
+        # The options can also come after the command
+        _add_options(subparser, defaults=False)
+        if name in DRY_RUN_COMMANDS:
+            subparser.add_argument(
+                "--dry-run",
+                action="store_true",
+                default=argparse.SUPPRESS,
+                help="Record the commands instead of running them, show them per node and estimate how long the "
+                     "rollout would take")
+        if name in ["add", "remove"]:
+            subparser.add_argument(
+                "nodes",
+                nargs="*",
+                help="Nodes to {} (default: the nodes that were {} the config)".format(
+                    name, "added to" if name == "add" else "removed from"))
+        if name == "status":
+            subparser.add_argument(
+                "--json",
+                action="store_true",
+                help="Print JSON instead of a table")
+            subparser.add_argument(
+                "--timeout",
+                metavar="seconds",
+                type=float,
+                default=STATE_PROBE_TIMEOUT,
+                help="Seconds to wait for every request to a node (default: %(default)s)")
+        if name == "destroy":
+            subparser.add_argument(
+                "-y", "--yes",
+                action="store_true",
+                help="Do not ask for confirmation")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args.command = DEFAULT_COMMAND
+    # Only the rollout can be recorded, a preview must never run a command that changes or removes machines
+    if args.dry_run and args.command not in DRY_RUN_COMMANDS:
+        parser.error("--dry-run only works with {}, not {}".format(" and ".join(DRY_RUN_COMMANDS), args.command))
+    return args
+
+
+def _add_options(parser: argparse.ArgumentParser, defaults: bool):
+    """
+    Options of every command, they can come before and after the command
+    :param parser:
+    :param defaults: whether the options get their defaults, the parser of a command must not override the values of
+                     the options before it
+    """
+    def default(value):
+        return value if defaults else argparse.SUPPRESS
+
     parser.add_argument(
         "-c", "--config",
         metavar="path_to_config_dir",
-        default=get_default_config_dir(),
+        default=default(get_default_config_dir()),
         help="Directory that contains the configuration")
-
-    return parser.parse_args()
+    parser.add_argument(
+        "-p", "--parallel",
+        metavar="N",
+        type=int,
+        default=default(None),
+        help="Number of nodes to create and configure at the same time (overrides rollout.parallelism)")
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        default=default(False),
+        help="Do not resume an interrupted run, apply every step again")
+    parser.add_argument(
+        "--trace",
+        metavar="file",
+        default=default(None),
+        help="Write timings of all steps and commands to this file (JSON lines)")
+    parser.add_argument(
+        "--trace-chrome",
+        metavar="file",
+        default=default(None),
+        help="Write timings of all steps and commands to this file (Chrome trace-event format)")
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        default=default(False),
+        help="Print a summary of the slowest nodes and steps when done")
 
 
 def ensure_config_path(config_dir: str):
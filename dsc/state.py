@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from dsc.nodes import Node, NodeState
+from dsc.util import write_file_atomic
+
+
+class StateCache(object):
+    """
+    Cache of probed node states. States are kept in memory until they are invalidated (whenever dsc changes a
+    node), and are optionally snapshotted to disk so later runs can reuse them for ttl seconds. A state is only valid
+    for the public IP it was probed with, since the probes connect to that address.
+    """
+
+    def __init__(self, snapshot_path: str = None, ttl: int = 0):
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.states = {}  # type: Dict[str, NodeState]
+        self.snapshot = None  # type: Optional[Dict[str, dict]]
+        self.lock = threading.Lock()
+
+    def get(self, node: Node) -> Optional[NodeState]:
+        """
+        Get the cached state of a node, or None if it has to be probed
+        :param node:
+        :return:
+        """
+        key = _key(node)
+        with self.lock:
+            if key in self.states:
+                return self.states[key]
+
+            entry = self._load_snapshot().get(key)
+
+        if entry is None or time.time() - entry["time"] > self.ttl:
+            return None
+
+        try:
+            state = NodeState[entry["state"]]
+        except KeyError:
+            return None
+
+        # Never trust a snapshot that contradicts the machine directory
+        if (state == NodeState.new) == os.path.isdir(node.machine_path or ""):
+            return None
+
+        return state
+
+    def set(self, node: Node, state: NodeState) -> None:
+        with self.lock:
+            self.states[_key(node)] = state
+            self._load_snapshot()[_key(node)] = {"state": state.name, "time": time.time()}
+
+    def invalidate(self, node: Node) -> None:
+        """
+        Forget the state of a node, the next get will return None
+        :param node:
+        """
+        with self.lock:
+            for states in [self.states, self._load_snapshot()]:
+                for key in [key for key in states if key.split("@")[0] == node.name]:
+                    del states[key]
+
+    def save(self) -> None:
+        """
+        Write the snapshot to disk (only when a TTL is configured)
+        """
+        if self.snapshot_path is None or self.ttl <= 0:
+            return
+
+        with self.lock:
+            write_file_atomic(self.snapshot_path, json.dumps(self._load_snapshot(), indent=2, sort_keys=True))
+
+    def _load_snapshot(self) -> Dict[str, dict]:
+        if self.snapshot is None:
+            self.snapshot = {}
+            if self.snapshot_path is not None and self.ttl > 0:
+                try:
+                    with open(self.snapshot_path) as handle:
+                        self.snapshot = json.load(handle)
+                except (OSError, ValueError):
+                    pass
+
+        return self.snapshot
+
+
+def _key(node: Node) -> str:
+    return "{}@{}".format(node.name, node.public_ip or "")
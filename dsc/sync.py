@@ -0,0 +1,135 @@
+import json
+import os
+import shlex
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+
+from dsc.batch import RemoteBatch
+from dsc.nodes import Node
+from dsc.reconcile import file_digest
+from dsc.util import write_file_atomic
+
+
+def remote_digests_command(paths: List[str]) -> str:
+    """
+    Command that prints the SHA-256 of every existing file of paths, in sha256sum format
+    :param paths:
+    :return:
+    """
+    return "sudo sha256sum {} 2>/dev/null; true".format(" ".join([shlex.quote(path) for path in paths]))
+
+
+def parse_remote_digests(output: str) -> Dict[str, str]:
+    digests = {}
+    for line in output.splitlines():
+        parts = line.strip().split(None, 1)
+        if len(parts) == 2 and len(parts[0]) == 64:
+            digests[parts[1].lstrip("*")] = parts[0]
+    return digests
+
+
+class FileSync(object):
+    """
+    Content-addressed file uploads. A manifest per node records the SHA-256 of every file dsc put on it, by
+    destination path, so files that are already on the node are not sent again. Files the manifest does not know
+    about yet are checked against the node in one call, unless the manifest is complete (the node was created by dsc,
+    so every file on it was put there through the manifest).
+    """
+
+    def __init__(self, path: str, run_remote: Callable[[Node, str], str]):
+        """
+        :param path: directory for the manifests
+        :param run_remote: runs a shell command on a node and returns its output
+        """
+        self.path = path
+        self.run_remote = run_remote
+        self.manifests = {}  # type: Dict[str, dict]
+        self.lock = threading.Lock()
+
+    def queue(self, node: Node, batch: RemoteBatch, files: List[Tuple[str, str]]) -> Dict[str, str]:
+        """
+        Queue the uploads of the files that are missing or different on the node
+        :param node:
+        :param batch: batch to queue the uploads in
+        :param files: local path and destination path of every file
+        :return: digest per queued destination path, pass it to commit once the batch ran
+        """
+        local = OrderedDict([(remote_path, (local_path, file_digest(local_path))) for local_path, remote_path in files])
+        with self.lock:
+            complete = self._load(node)["complete"]
+            manifest = dict(self._load(node)["files"])
+
+        unknown = [remote_path for remote_path in local if remote_path not in manifest and not complete]
+        if unknown:
+            remote = parse_remote_digests(self.run_remote(node, remote_digests_command(unknown)))
+            self.commit(node, {remote_path: remote[remote_path] for remote_path in unknown if remote_path in remote})
+            manifest = self.manifest(node)
+
+        queued = OrderedDict()
+        for remote_path, (local_path, local_digest) in local.items():
+            if manifest.get(remote_path) != local_digest:
+                batch.upload(local_path, remote_path)
+                queued[remote_path] = local_digest
+
+        return queued
+
+    def commit(self, node: Node, digests: Dict[str, str]) -> None:
+        """
+        Record that files are on the node
+        :param node:
+        :param digests: digest per destination path
+        """
+        if not digests:
+            return
+
+        with self.lock:
+            self._load(node)["files"].update(digests)
+            self._save(node)
+
+    def manifest(self, node: Node) -> Dict[str, str]:
+        """
+        Digest per destination path of the files known to be on the node
+        :param node:
+        :return:
+        """
+        with self.lock:
+            return dict(self._load(node)["files"])
+
+    def reset(self, node: Node) -> None:
+        """
+        Start a complete, empty manifest for a node that was just created
+        :param node:
+        """
+        with self.lock:
+            self.manifests[node.name] = {"complete": True, "files": {}}
+            self._save(node)
+
+    def forget(self, node: Node) -> None:
+        """
+        Forget which files are on a node (e.g. after it was removed)
+        :param node:
+        """
+        with self.lock:
+            self.manifests.pop(node.name, None)
+            try:
+                os.unlink(self._file(node))
+            except FileNotFoundError:
+                pass
+
+    def _load(self, node: Node) -> dict:
+        if node.name not in self.manifests:
+            try:
+                with open(self._file(node)) as handle:
+                    self.manifests[node.name] = json.load(handle)
+            except (OSError, ValueError):
+                self.manifests[node.name] = {"complete": False, "files": {}}
+
+        return self.manifests[node.name]
+
+    def _save(self, node: Node) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        write_file_atomic(self._file(node), json.dumps(self.manifests[node.name], indent=2, sort_keys=True))
+
+    def _file(self, node: Node) -> str:
+        return os.path.join(self.path, "{}.json".format(node.name))
@@ -0,0 +1,204 @@
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, TypeVar
+
+from dsc.const import MACHINE_DRIVERS
+from dsc.inventory import ConfigError
+
+T = TypeVar("T")
+
+# Limits of a driver, the ones under drivers.default in dsc.yaml apply to every driver without its own
+DRIVER_LIMITS = OrderedDict([
+    # Machine commands (create, rm) of the driver running at the same time (0: no limit)
+    ("concurrency", 0),
+    # Machine commands started per second, and the number that can be started at once after a quiet period (0: no
+    # limit)
+    ("rate", 0.0),
+    ("burst", 1),
+    # Attempts after a command failed with a transient error, with exponential backoff from backoff seconds up to
+    # max-backoff seconds (full jitter)
+    ("retries", 3),
+    ("backoff", 5.0),
+    ("max-backoff", 60.0),
+])
+
+# Error of docker-machine when a driver failed for a reason that may be gone on the next attempt: throttling by the
+# provider API, provider errors and network errors. Only the error docker-machine ended with is matched, not the log
+# lines before it.
+TRANSIENT_ERRORS = re.compile("|".join([
+    r"rate ?limit", r"request ?limit ?exceeded", r"throttl", r"too many requests",
+    r"(status|status code|http)[: ]+(429|50[234])\b", r"service unavailable", r"bad gateway", r"gateway time-?out",
+    r"\binternal ?(server ?)?error\b", r"server ?busy", r"try again", r"temporar(y|ily) (failure|unavailable)",
+    r"timed out", r"i/o timeout", r"deadline exceeded", r"TLS handshake timeout", r"connection (reset|refused)",
+    r"broken pipe", r"unexpected EOF", r"no such host",
+]), re.IGNORECASE)
+
+# First line of the error docker-machine ends with
+ERROR_LINE = re.compile(r"^(error|fatal)\b", re.IGNORECASE)
+
+
+def driver_limits(settings: Optional[dict]) -> Dict[str, dict]:
+    """
+    Limits per driver from the drivers section of dsc.yaml
+    :param settings:
+    :return: complete limits per driver name, and under default for the other drivers
+    :raises ConfigError:
+    """
+    settings = settings or {}
+    if not isinstance(settings, dict):
+        raise ConfigError("drivers must be a mapping of driver names to limits")
+
+    for driver, limits in settings.items():
+        what = "drivers.{}".format(driver)
+        if driver != "default" and driver not in MACHINE_DRIVERS:
+            raise ConfigError("{}: unknown driver, use default or one of {}".format(what, ", ".join(MACHINE_DRIVERS)))
+        if not isinstance(limits, dict):
+            raise ConfigError("{}: limits must be a mapping".format(what))
+        unknown = [key for key in limits if key not in DRIVER_LIMITS]
+        if unknown:
+            raise ConfigError("{}: unknown setting(s) {}, use {}".format(what, ", ".join(unknown),
+                                                                       ", ".join(DRIVER_LIMITS)))
+        for key, value in limits.items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                raise ConfigError("{}: {} must be a number of at least 0".format(what, key))
+        if limits.get("burst") == 0:
+            raise ConfigError("{}: burst must be at least 1".format(what))
+
+    default = OrderedDict(DRIVER_LIMITS)
+    default.update(settings.get("default") or {})
+    result = {"default": default}
+    for driver, limits in settings.items():
+        if driver != "default":
+            result[driver] = OrderedDict(default)
+            result[driver].update(limits)
+    return result
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether a failed machine command is worth another attempt
+    :param error:
+    :return:
+    """
+    # Only needed once a command failed, importing the runner (and asyncio) up front would slow down every command
+    from dsc.runner import CommandTimeout
+
+    return isinstance(error, CommandTimeout) or TRANSIENT_ERRORS.search(error_message(error)) is not None
+
+
+def error_message(error: Exception) -> str:
+    """
+    The error a failed command ended with: the output from its last line that starts with Error, or its last line
+    :param error:
+    :return:
+    """
+    output = getattr(error, "output", None)
+    lines = [line.strip() for line in (str(error) if output is None else output).splitlines() if line.strip()]
+    for index in range(len(lines) - 1, -1, -1):
+        if ERROR_LINE.match(lines[index]):
+            return "\n".join(lines[index:])
+    return lines[-1] if lines else ""
+
+
+def backoff(attempt: int, base: float, maximum: float) -> float:
+    """
+    Seconds to wait before an attempt: exponential backoff with full jitter, so throttled nodes do not all retry at the
+    same moment
+    :param attempt: the attempt that failed, starting at 1
+    :param base:
+    :param maximum:
+    :return:
+    """
+    return random.uniform(0, min(maximum, base * 2 ** (attempt - 1)))
+
+
+class TokenBucket(object):
+    """
+    Allows rate calls per second on average, and burst calls at once
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take a token, wait for one when there are none left
+        :return: seconds waited
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Take the token up front, callers that come in while this one waits queue up behind it
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class DriverLimiter(object):
+    """
+    Keeps the machine commands of every driver within its concurrency and rate limits, and retries them when they
+    fail with a transient error (e.g. throttling by the provider API)
+    """
+
+    def __init__(self, limits: Dict[str, dict]):
+        """
+        :param limits: limits per driver, see driver_limits()
+        """
+        self.limits = limits
+        self.slots = {}  # type: Dict[str, threading.BoundedSemaphore]
+        self.buckets = {}  # type: Dict[str, TokenBucket]
+        self.lock = threading.Lock()
+
+    def call(self, driver: str, action: Callable[[], T],
+             on_retry: Callable[[Exception, int, float], None] = None) -> T:
+        """
+        Run a machine command of a driver
+        :param driver:
+        :param action: runs the command
+        :param on_retry: called with the error, the attempt that failed and the delay before the next attempt
+        :return: result of the action
+        """
+        limits = self.limits.get(driver, self.limits["default"])
+        attempt = 1
+        while True:
+            try:
+                return self._run(driver, limits, action)
+            except RuntimeError as error:
+                if attempt > limits["retries"] or not is_transient(error):
+                    raise
+                delay = backoff(attempt, limits["backoff"], limits["max-backoff"])
+                if on_retry is not None:
+                    on_retry(error, attempt, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def _run(self, driver: str, limits: dict, action: Callable[[], T]) -> T:
+        with self.lock:
+            if driver not in self.slots:
+                self.slots[driver] = threading.BoundedSemaphore(int(limits["concurrency"])) \
+                    if int(limits["concurrency"]) > 0 else None
+                self.buckets[driver] = TokenBucket(limits["rate"], int(limits["burst"])) \
+                    if limits["rate"] > 0 else None
+            slot = self.slots[driver]
+            bucket = self.buckets[driver]
+
+        if slot is not None:
+            slot.acquire()
+        try:
+            if bucket is not None:
+                bucket.acquire()
+            return action()
+        finally:
+            if slot is not None:
+                slot.release()
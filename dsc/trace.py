@@ -0,0 +1,181 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+_current = ContextVar("span", default=None)
+
+# Flags whose value is a secret (e.g. --vmwarevsphere-password, --amazonec2-secret-key in driver-opts)
+SECRET_FLAG = re.compile(r"(--[\w-]*(?:password|secret|token|key|credential)[\w-]*)(=|\s+)('[^']*'|\"[^\"]*\"|\S+)",
+                         re.IGNORECASE)
+
+
+class Span(object):
+    def __init__(self, span_id: int, name: str, node: Optional[str], parent: Optional["Span"], attrs: dict):
+        self.id = span_id
+        self.name = name
+        self.node = node
+        self.parent_id = parent.id if parent is not None else None
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.duration = None
+
+    def to_dict(self) -> dict:
+        return OrderedDict([
+            ("id", self.id),
+            ("parent", self.parent_id),
+            ("name", self.name),
+            ("node", self.node),
+            ("start", round(self.start, 6)),
+            ("duration", round(self.duration, 6) if self.duration is not None else None),
+            ("thread", self.thread),
+            ("attrs", self.attrs),
+        ])
+
+
+class Tracer(object):
+    """
+    Records nested, timed spans (per node and per command) and exports them as JSON lines or Chrome trace events
+    """
+
+    def __init__(self):
+        self.spans = []  # type: List[Span]
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, node: str = None, **attrs) -> Iterator[Span]:
+        """
+        Time a block of code. Spans nest within the current thread or task, and inherit the node of their parent.
+        :param name:
+        :param node:
+        :param attrs: extra attributes, the span can add more while it runs
+        """
+        parent = _current.get()
+        if node is None and parent is not None:
+            node = parent.node
+
+        with self.lock:
+            span = Span(len(self.spans) + 1, name, node, parent, attrs)
+            self.spans.append(span)
+
+        token = _current.set(span)
+        started = time.monotonic()
+        try:
+            yield span
+        except BaseException as ex:
+            span.attrs.setdefault("error", (str(ex) or ex.__class__.__name__)[:200])
+            raise
+        finally:
+            span.duration = time.monotonic() - started
+            _current.reset(token)
+
+    def finished(self) -> List[Span]:
+        with self.lock:
+            return [span for span in self.spans if span.duration is not None]
+
+    def export_jsonl(self, path: str) -> None:
+        with open(path, "w") as handle:
+            for span in self.finished():
+                handle.write(json.dumps(span.to_dict()) + "\n")
+
+    def export_chrome(self, path: str) -> None:
+        """
+        Export in Chrome trace-event format (chrome://tracing, Perfetto), with one row per node
+        :param path:
+        """
+        spans = self.finished()
+        rows = OrderedDict()
+        for span in spans:
+            rows.setdefault(span.node or "dsc", len(rows) + 1)
+
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": row}}
+                  for row, tid in rows.items()]
+        events.extend([{
+            "name": span.name,
+            "cat": "command" if "command" in span.attrs else "step",
+            "ph": "X",
+            "ts": int(span.start * 1000000),
+            "dur": int(span.duration * 1000000),
+            "pid": 1,
+            "tid": rows[span.node or "dsc"],
+            "args": span.attrs,
+        } for span in spans])
+
+        with open(path, "w") as handle:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, handle)
+
+    def summary(self, limit: int = 10) -> str:
+        """
+        Table of the slowest nodes, the slowest steps and the total time per kind of step
+        :param limit: number of rows per section
+        """
+        spans = self.finished()
+        if not spans:
+            return "No timings recorded"
+
+        nodes = OrderedDict()
+        for span in spans:
+            if span.node is not None:
+                start, end = nodes.get(span.node, (span.start, span.start))
+                nodes[span.node] = (min(start, span.start), max(end, span.start + span.duration))
+
+        steps = OrderedDict()
+        for span in spans:
+            count, total, slowest = steps.get(span.name, (0, 0.0, 0.0))
+            steps[span.name] = (count + 1, total + span.duration, max(slowest, span.duration))
+
+        lines = ["Slowest nodes:", "  {:<40} {:>10}".format("node", "seconds")]
+        for node, (start, end) in sorted(nodes.items(), key=lambda item: item[1][0] - item[1][1])[:limit]:
+            lines.append("  {:<40} {:>10.2f}".format(node, end - start))
+
+        lines.extend(["Slowest steps:", "  {:<40} {:<30} {:>10}".format("step", "node", "seconds")])
+        for span in sorted(spans, key=lambda item: -item.duration)[:limit]:
+            lines.append("  {:<40} {:<30} {:>10.2f}".format(span.name[:40], (span.node or "-")[:30], span.duration))
+
+        lines.extend(["Time per step:", "  {:<40} {:>6} {:>10} {:>10}".format("step", "count", "total", "max")])
+        for name, (count, total, slowest) in sorted(steps.items(), key=lambda item: -item[1][1])[:limit]:
+            lines.append("  {:<40} {:>6} {:>10.2f} {:>10.2f}".format(name[:40], count, total, slowest))
+
+        return "\n".join(lines)
+
+
+tracer = Tracer()
+
+
+def traced(name: str):
+    """
+    Decorator that records a span around a DSC method that takes a node as its first argument
+    :param name:
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, node, *args, **kwargs):
+            with tracer.span(name, node=node.name):
+                return method(self, node, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def command_name(program: str, args) -> str:
+    """
+    Short name for a command, e.g. "docker-machine create"
+    :param program:
+    :param args: command line or argument list
+    """
+    first = args[0] if isinstance(args, list) and args else str(args).split(" ", 1)[0]
+    return "{} {}".format(os.path.basename(program), first if not first.startswith("-") else "").strip()
+
+
+def redact_command(command: str) -> str:
+    """
+    Command line with the values of secret flags masked, for traces and reports
+    :param command:
+    """
+    return SECRET_FLAG.sub(lambda match: "{}{}***".format(match.group(1), match.group(2)), command)
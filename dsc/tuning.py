@@ -0,0 +1,166 @@
+import json
+import re
+from collections import OrderedDict
+from typing import List, Optional
+
+from dsc.inventory import ConfigError, NODE_TYPES
+
+# Settings of a tuning profile, they can also be set for all profiles directly under consul:
+PROFILE_SETTINGS = ["gomaxprocs", "raft-multiplier", "dns-allow-stale", "dns-max-stale", "dns-node-ttl",
+                    "dns-service-ttl", "recursors"]
+
+# Conditions of a tuning profile, a node has to meet all of them
+PROFILE_CONDITIONS = ["type", "max-cpus", "max-memory-mb"]
+
+# GOMAXPROCS of consul when the number of cpus of a node is unknown
+DEFAULT_GOMAXPROCS = 2
+
+# The first profile that matches a node is used
+DEFAULT_PROFILES = [
+    # One cpu or less than 1 GiB of memory: do not let consul compete with the containers of the node
+    OrderedDict([("name", "small"), ("max-cpus", 1), ("gomaxprocs", 1)]),
+    OrderedDict([("name", "small-memory"), ("max-memory-mb", 1024), ("gomaxprocs", 1)]),
+    # Servers do the raft and catalog work, they get every cpu
+    OrderedDict([("name", "server"), ("type", "master"), ("gomaxprocs", "cpus")]),
+    OrderedDict([("name", "agent"), ("type", "worker"), ("gomaxprocs", 2)]),
+]
+
+DEFAULT_SETTINGS = OrderedDict([
+    ("dns-allow-stale", True),
+    ("dns-max-stale", "10s"),
+    ("dns-node-ttl", "10s"),
+    ("dns-service-ttl", "10s"),
+])
+
+DURATION_PATTERN = re.compile(r"^[0-9]+(ns|us|ms|s|m|h)$")
+
+
+class ConsulTuning(object):
+    """
+    Consul settings per node (GOMAXPROCS, raft multiplier, DNS caching and recursors), from the consul section of
+    dsc.yaml. A node gets the settings of the first profile it matches (node type, cpus and memory from its facts),
+    on top of the settings for all nodes.
+    """
+
+    def __init__(self, settings: dict = None):
+        settings = settings or {}
+        self.defaults = OrderedDict(DEFAULT_SETTINGS)
+        self.defaults.update([(key, value) for key, value in settings.items() if key != "profiles"])
+        self.profiles = settings.get("profiles", DEFAULT_PROFILES)  # type: List[dict]
+
+    def validate(self) -> None:
+        """
+        :raises ConfigError:
+        """
+        unknown = [key for key in self.defaults if key not in PROFILE_SETTINGS]
+        if unknown:
+            raise ConfigError("consul: unknown setting(s) {}, use {} or profiles".format(
+                ", ".join(unknown), ", ".join(PROFILE_SETTINGS)))
+        _validate_settings(self.defaults, "consul")
+
+        if not isinstance(self.profiles, list):
+            raise ConfigError("consul.profiles must be a list of profiles")
+        for index, profile in enumerate(self.profiles):
+            what = "consul profile {}".format(profile.get("name", index + 1) if isinstance(profile, dict) else
+                                              index + 1)
+            if not isinstance(profile, dict):
+                raise ConfigError("{}: settings must be a mapping".format(what))
+            unknown = [key for key in profile if key not in ["name"] + PROFILE_CONDITIONS + PROFILE_SETTINGS]
+            if unknown:
+                raise ConfigError("{}: unknown setting(s) {}".format(what, ", ".join(unknown)))
+            if profile.get("type") is not None and profile["type"] not in NODE_TYPES:
+                raise ConfigError("{}: type must be one of {}".format(what, ", ".join(NODE_TYPES)))
+            for key in ["max-cpus", "max-memory-mb"]:
+                if key in profile and not _is_number(profile[key]):
+                    raise ConfigError("{}: {} must be a number".format(what, key))
+            _validate_settings(profile, what)
+
+    def settings(self, node_type: str, facts: dict) -> "OrderedDict[str, object]":
+        """
+        Consul settings of a node
+        :param node_type: master or worker
+        :param facts: facts of the node, the number of cpus and memory_kb are used
+        :return: the settings, with the name of the profile and gomaxprocs resolved to a number
+        """
+        cpus = facts.get("cpus")
+        memory_kb = facts.get("memory_kb")
+
+        settings = OrderedDict([("profile", None)])
+        settings.update(self.defaults)
+        for profile in self.profiles:
+            if _matches(profile, node_type, cpus, memory_kb):
+                settings["profile"] = profile.get("name")
+                settings.update([(key, value) for key, value in profile.items() if key in PROFILE_SETTINGS])
+                break
+
+        gomaxprocs = settings.get("gomaxprocs")
+        if gomaxprocs == "cpus":
+            gomaxprocs = cpus
+        settings["gomaxprocs"] = max(1, gomaxprocs) if gomaxprocs else DEFAULT_GOMAXPROCS
+
+        return settings
+
+    @staticmethod
+    def render_config(base_data: str, settings: dict) -> str:
+        """
+        Render consul.json: the base config with the settings of a node. The output only depends on its input.
+        :param base_data: contents of the base consul.json
+        :param settings: settings of the node, see settings()
+        :return:
+        """
+        config = json.loads(base_data, object_pairs_hook=OrderedDict)
+
+        if settings.get("recursors") is not None:
+            config["recursors"] = list(settings["recursors"])
+
+        dns_config = OrderedDict(config.get("dns_config", {}))
+        for key, name in [("dns-allow-stale", "allow_stale"), ("dns-max-stale", "max_stale"),
+                          ("dns-node-ttl", "node_ttl")]:
+            if settings.get(key) is not None:
+                dns_config[name] = settings[key]
+        if settings.get("dns-service-ttl") is not None:
+            dns_config["service_ttl"] = {"*": settings["dns-service-ttl"]}
+        if dns_config:
+            config["dns_config"] = dns_config
+
+        # Consul 0.7 and newer
+        if settings.get("raft-multiplier") is not None:
+            performance = OrderedDict(config.get("performance", {}))
+            performance["raft_multiplier"] = settings["raft-multiplier"]
+            config["performance"] = performance
+
+        return json.dumps(config, indent=4) + "\n"
+
+
+def _matches(profile: dict, node_type: str, cpus: Optional[int], memory_kb: Optional[int]) -> bool:
+    if profile.get("type") is not None and profile["type"] != node_type:
+        return False
+    # Limits only match when the facts are known
+    if profile.get("max-cpus") is not None and (cpus is None or cpus > profile["max-cpus"]):
+        return False
+    if profile.get("max-memory-mb") is not None and \
+            (memory_kb is None or memory_kb > profile["max-memory-mb"] * 1024):
+        return False
+    return True
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _validate_settings(settings: dict, what: str) -> None:
+    gomaxprocs = settings.get("gomaxprocs")
+    if gomaxprocs is not None and gomaxprocs != "cpus" and not _is_number(gomaxprocs):
+        raise ConfigError("{}: gomaxprocs must be a number or cpus".format(what))
+    multiplier = settings.get("raft-multiplier")
+    if multiplier is not None and (not _is_number(multiplier) or multiplier > 10):
+        raise ConfigError("{}: raft-multiplier must be a number from 1 to 10".format(what))
+    if settings.get("dns-allow-stale") is not None and not isinstance(settings["dns-allow-stale"], bool):
+        raise ConfigError("{}: dns-allow-stale must be true or false".format(what))
+    for key in ["dns-max-stale", "dns-node-ttl", "dns-service-ttl"]:
+        if settings.get(key) is not None and not DURATION_PATTERN.match(str(settings[key])):
+            raise ConfigError("{}: {} must be a duration like 10s, not {}".format(what, key, settings[key]))
+    recursors = settings.get("recursors")
+    if recursors is not None and (not isinstance(recursors, list) or not all(
+            [isinstance(recursor, str) for recursor in recursors])):
+        raise ConfigError("{}: recursors must be a list of addresses".format(what))
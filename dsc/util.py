@@ -1,30 +1,7 @@
-import json
 import os
-import re
+import tempfile
 from collections import OrderedDict
-
-import sys
-import yaml
-from subprocess import Popen, PIPE, STDOUT
-
-
-def get_machine_config(node, raise_error=False):
-    try:
-        with open(os.path.join(node.machine_path, "config.json")) as config_file:
-            return json.load(config_file)
-    except FileNotFoundError as ex:
-        if raise_error: raise
-        print("Machine config (config.json) not found: {}".format(ex))
-        sys.exit(1)
-
-
-def save_machine_config(node, config):
-    try:
-        with open(os.path.join(node.machine_path, "config.json"), "w") as config_file:
-            return json.dump(config, config_file)
-    except Exception as ex:
-        print("Error writing machine config: {}".format(ex))
-        sys.exit(1)
+from functools import lru_cache
 
 
 def read_file(file):
@@ -32,8 +9,7 @@ def read_file(file):
         with open(file) as handle:
             return handle.read()
     except FileNotFoundError as ex:
-        print("File not found: {}".format(ex))
-        sys.exit(1)
+        raise RuntimeError("File not found: {}".format(ex))
 
 
 def write_file(file, data):
@@ -41,8 +17,26 @@ def write_file(file, data):
         with open(file, "w") as handle:
             return handle.write(data)
     except Exception as ex:
-        print("Error writing file: {}".format(ex))
-        sys.exit(1)
+        raise RuntimeError("Error writing file: {}".format(ex))
+
+
+def write_file_atomic(file, data):
+    """
+    Write a file through a temporary file in the same directory and a rename, so readers never see a partial file
+    """
+    handle, temp_file = tempfile.mkstemp(dir=os.path.dirname(file), prefix=".{}.".format(os.path.basename(file)))
+    try:
+        with os.fdopen(handle, "w") as temp:
+            temp.write(data)
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.replace(temp_file, file)
+    except BaseException:
+        try:
+            os.unlink(temp_file)
+        except OSError:
+            pass
+        raise
 
 
 def get_env_for_node(node, is_swarm=False):
@@ -56,42 +50,14 @@ def get_env_for_node(node, is_swarm=False):
     }
 
 
-def build_command(command):
-    command = re.sub(r"\"", "'", command)
-    return [part.replace("\x00", " ") for part in
-            re.sub("'(.+?)'", lambda m: m.group(1).replace(" ", "\x00"), command).split()]
-
-
-def run_command(program, command, raise_error=True, use_shell=False, show_output=True, extra_env=None):
-    if not use_shell:
-        command = re.sub(r"\s+", " ", command)
-        command = [program] + build_command(command)
-    else:
-        command = "{} {}".format(program, command)
-
-    env = os.environ.copy()
-    env["PATH"] += ":/usr/local/bin"
-    if extra_env is not None:
-        env.update(extra_env)
-
-    process = Popen(command, stdin=PIPE, stdout=PIPE, stderr=STDOUT, shell=use_shell, env=env)
+def run_command(program, command, raise_error=True, use_shell=False, show_output=True, extra_env=None, timeout=None,
+                input=None):
+    # Imported on first use: commands that only read state (status, plan) never start a program
+    import asyncio
+    from dsc.runner import run_command_async
 
-    output = ""
-    while True:
-        nextline = process.stdout.readline()
-        if process.poll() is not None:
-            break
-        output += nextline.decode().strip()
-        if show_output:
-            sys.stdout.write("++ {}".format(nextline.decode()))
-            sys.stdout.flush()
-
-    exit_code = process.returncode
-
-    if exit_code and raise_error:
-        raise RuntimeError("command error %s: %s" % (exit_code, output))
-
-    return output
+    return asyncio.run(run_command_async(program, command, raise_error, use_shell, show_output, extra_env, timeout,
+                                         input))
 
 
 def dict_has_item(data, key, value):
@@ -105,11 +71,13 @@ def dict_has_item(data, key, value):
 
 
 def load_yaml(filename):
+    import yaml
+
     try:
         with open(filename, encoding="utf-8") as conf_file:
             # If configuration file is empty YAML returns None
             # We convert that to an empty dict
-            return yaml.safe_load(conf_file) or {}
+            return yaml.load(conf_file, Loader=_ordered_loader()) or {}
     except yaml.YAMLError:
         print("Error reading YAML configuration file {}".format(filename))
         return {}
@@ -123,5 +91,15 @@ def _ordered_dict(loader, node):
     return OrderedDict(loader.construct_pairs(node))
 
 
-yaml.SafeLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
-                                _ordered_dict)
+@lru_cache(maxsize=None)
+def _ordered_loader():
+    """
+    Safe YAML loader that keeps the order of mappings, without changing yaml.SafeLoader for everyone else. Uses the
+    loader of libyaml when PyYAML was built with it.
+    """
+    import yaml
+
+    base = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    loader = type("OrderedSafeLoader", (base,), {})
+    loader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _ordered_dict)
+    return loader
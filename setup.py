@@ -1,9 +1,10 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='docker-swarm-creator',
     version='1.0.0',
     packages=['dsc'],
+    python_requires='>=3.9',
     url='https://github.com/marijngiesen/docker-swarm-creator/',
     license='MIT',
     author='Marijn Giesen',
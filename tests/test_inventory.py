@@ -0,0 +1,63 @@
+import pytest
+
+from dsc.inventory import ConfigError, Inventory
+
+
+def test_groups_are_expanded_after_the_nodes():
+    inventory = Inventory(
+        nodes={"master001": {"type": "master", "machine-driver": "virtualbox"}},
+        groups={"workers": {"count": 3, "start": 5, "name": "worker{index:03d}", "type": "worker",
+                            "machine-driver": "virtualbox"}})
+    inventory.validate()
+
+    assert [name for name, _ in inventory.items()] == ["master001", "worker005", "worker006", "worker007"]
+
+
+def test_default_name_pattern_uses_the_group():
+    inventory = Inventory(groups={"edge": {"count": 2, "type": "worker", "machine-driver": "virtualbox"}})
+
+    assert [name for name, _ in inventory.items()] == ["edge-1", "edge-2"]
+
+
+def test_templates_are_inherited_and_overridden():
+    inventory = Inventory(
+        nodes={"master001": {"type": "master", "template": "large", "engine-opts": "--engine-label role=master"}},
+        groups={"workers": {"count": 2, "name": "worker{index}", "type": "worker", "template": "large",
+                            "machine-driver": "virtualbox"}},
+        templates={
+            "cloud": {"machine-driver": "digitalocean", "driver-opts": "--digitalocean-size 1gb",
+                      "cluster-interface": "eth1"},
+            "large": {"template": "cloud", "driver-opts": "--digitalocean-size 4gb"},
+        })
+    inventory.validate()
+    nodes = dict(inventory.items())
+
+    assert nodes["master001"]["machine-driver"] == "digitalocean"
+    assert nodes["master001"]["driver-opts"] == "--digitalocean-size 4gb"
+    assert nodes["master001"]["cluster-interface"] == "eth1"
+    assert nodes["master001"]["engine-opts"] == "--engine-label role=master"
+    assert nodes["worker1"]["machine-driver"] == "virtualbox"
+    assert nodes["worker1"]["driver-opts"] == "--digitalocean-size 4gb"
+    assert nodes["worker1"]["engine-opts"] is None
+    assert "template" not in nodes["worker1"]
+
+
+@pytest.mark.parametrize("nodes, groups, templates, error", [
+    ({"node1": {"type": "worker", "machine-driver": "virtualbox"}},
+     {"workers": {"count": 1, "name": "node1", "type": "worker", "machine-driver": "virtualbox"}}, {},
+     "configured more than once"),
+    ({}, {"workers": {"count": 2, "name": "worker", "type": "worker", "machine-driver": "virtualbox"}}, {},
+     "needs {index}"),
+    ({}, {"workers": {"count": "2", "type": "worker", "machine-driver": "virtualbox"}}, {}, "count must be"),
+    ({"node1": {"type": "worker", "machine-driver": "virtualbx"}}, {}, {}, "machine-driver must be one of"),
+    ({"node1": {"type": "manager", "machine-driver": "virtualbox"}}, {}, {}, "type must be one of"),
+    ({"node_1": {"type": "worker", "machine-driver": "virtualbox"}}, {}, {}, "Invalid node name"),
+    ({"node1": {"type": "worker", "template": "missing"}}, {}, {}, "unknown template missing"),
+    ({}, {}, {"a": {"template": "b"}, "b": {"template": "a"}}, "inherits from itself"),
+    ({}, {}, {"a": {"type": "worker"}}, "unknown setting(s) type"),
+])
+def test_invalid_config(nodes, groups, templates, error):
+    with pytest.raises(ConfigError) as raised:
+        Inventory(nodes, groups, templates).validate()
+
+    assert error in str(raised.value)
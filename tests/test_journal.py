@@ -0,0 +1,101 @@
+import os
+
+from dsc.journal import StepJournal
+from dsc.nodes import Node
+
+
+def node(name):
+    return Node.load(name=name, shortname=name.split(".")[0])
+
+
+def test_interrupted_run_is_replayed(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    master = node("master0.test")
+
+    journal = StepJournal(path)
+    assert journal.open() == 0
+    journal.record(master, "create", "a")
+    journal.record(master, "certs", "b")
+    journal.close()
+
+    journal = StepJournal(path)
+    assert journal.open() == 2
+    assert journal.done(master, "create", "a")
+    # The inputs changed since the step was completed
+    assert not journal.done(master, "certs", "c")
+    assert not journal.done(master, "consul", "b")
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    master = node("master0.test")
+
+    journal = StepJournal(path)
+    journal.open()
+    journal.record(master, "create", "a")
+    journal.close()
+    with open(path, "a") as handle:
+        handle.write('{"node": "master0.test", "st')
+
+    journal = StepJournal(path)
+    assert journal.open() == 1
+    assert journal.done(master, "create", "a")
+
+
+def test_forgotten_nodes_are_not_replayed(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    master = node("master0.test")
+    worker = node("worker0.test")
+
+    journal = StepJournal(path)
+    journal.open()
+    journal.record(master, "create", "a")
+    journal.record(worker, "create", "a")
+    # The machine was created again
+    journal.forget(worker)
+    assert not journal.done(worker, "create", "a")
+    journal.record(worker, "create", "b")
+    journal.close()
+
+    journal = StepJournal(path)
+    assert journal.open() == 2
+    assert journal.done(master, "create", "a")
+    assert journal.done(worker, "create", "b")
+
+
+def test_forget_outside_a_run_reaches_the_journal(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    worker = node("worker0.test")
+
+    journal = StepJournal(path)
+    journal.open()
+    journal.record(worker, "create", "a")
+    journal.close()
+
+    # e.g. dsc remove after an interrupted rollout
+    StepJournal(path).forget(worker)
+
+    journal = StepJournal(path)
+    assert journal.open() == 0
+    assert not journal.done(worker, "create", "a")
+
+
+def test_completed_and_fresh_runs_start_from_scratch(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    master = node("master0.test")
+
+    journal = StepJournal(path)
+    journal.open()
+    journal.record(master, "create", "a")
+    journal.close()
+
+    journal = StepJournal(path)
+    assert journal.open(resume=False) == 0
+    assert not journal.done(master, "create", "a")
+    journal.record(master, "create", "a")
+    journal.close(complete=True)
+
+    assert not os.path.exists(path)
+    # Without a journal, forget does not create one
+    StepJournal(path).forget(master)
+    assert not os.path.exists(path)
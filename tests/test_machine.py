@@ -0,0 +1,38 @@
+from dsc.machine import engine_opt_flags, merge_flags, merge_list
+
+
+def test_merge_flags_replaces_the_dns_flag_dsc_set_before():
+    # dns=8.8.8.8 is from the engine-opts of the node, dns=10.0.0.1 is the old cluster IP dsc set
+    flags = ["dns=8.8.8.8", "dns=10.0.0.1", "dns-search=test", "label=role=db"]
+    additions = ["dns=10.0.0.2", "dns-search=test"]
+
+    merged = merge_flags(flags, additions, engine_opt_flags("--engine-opt dns=8.8.8.8"))
+
+    assert merged == ["dns=8.8.8.8", "label=role=db", "dns=10.0.0.2", "dns-search=test"]
+
+
+def test_merge_flags_replaces_single_valued_flags_of_the_user():
+    flags = ["cluster-store=consul://old:8500", "cluster-advertise=eth0:2376"]
+    additions = ["cluster-store=consul://new:8500", "cluster-advertise=eth1:2376"]
+
+    merged = merge_flags(flags, additions, ["cluster-store=consul://old:8500"])
+
+    assert merged == additions
+
+
+def test_merge_flags_is_idempotent():
+    additions = ["replication=true", "advertise=10.0.0.1:3376"]
+    merged = merge_flags(None, additions)
+
+    assert merged == additions
+    assert merge_flags(merged, additions) == additions
+
+
+def test_engine_opt_flags():
+    assert engine_opt_flags(None) == []
+    assert engine_opt_flags("--engine-opt dns=8.8.8.8 --engine-opt=\"log-opt=max-size=10m\" --engine-label a=b") == \
+        ["dns=8.8.8.8", "log-opt=max-size=10m"]
+
+
+def test_merge_list_keeps_the_order():
+    assert merge_list(["b", "a"], ["a", "c", "b", "d"]) == ["b", "a", "c", "d"]
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+
+import consul  # noqa: E402
+import stubs  # noqa: E402
+from dsc.engine import EngineError  # noqa: E402
+from dsc.readiness import ConsulClient, NotReady, check, wait_for  # noqa: E402
+
+MASTER = "master000.bench.local"
+WORKER = "worker0000.bench.local"
+
+
+@pytest.fixture
+def machines(tmp_path):
+    """
+    Machine dir of the stand-in consul API: consul runs on a machine once its config.json has IsSwarm set
+    """
+    def configure(name, is_swarm=True):
+        os.makedirs(str(tmp_path / name), exist_ok=True)
+        with open(str(tmp_path / name / "config.json"), "w") as handle:
+            json.dump({"HostOptions": {"SwarmOptions": {"IsSwarm": is_swarm}}}, handle)
+
+    try:
+        server = consul.serve(str(tmp_path))
+    except OSError as ex:
+        pytest.skip("port {} is not free: {}".format(consul.PORT, ex))
+    try:
+        yield configure
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def cluster_checks(client):
+    return OrderedDict([("consul leader", check(client.leader)), ("consul catalog", check(client.registered))])
+
+
+def test_ready_cluster(machines):
+    machines(MASTER)
+    machines(WORKER)
+    client = ConsulClient(stubs.public_ip(WORKER), 1)
+    try:
+        assert wait_for(cluster_checks(client), 5, "cluster of worker") < 5
+    finally:
+        client.close()
+
+
+def test_times_out_while_consul_has_no_leader(machines):
+    # The master is not configured yet, so there is no leader
+    machines(MASTER, is_swarm=False)
+    machines(WORKER)
+    client = ConsulClient(stubs.public_ip(WORKER), 1)
+    started = time.monotonic()
+    try:
+        with pytest.raises(NotReady) as error:
+            wait_for(cluster_checks(client), 0.5, "cluster of worker")
+    finally:
+        client.close()
+
+    assert time.monotonic() - started < 3
+    # Only the checks that did not pass are reported
+    assert "consul leader" in str(error.value)
+    assert "consul catalog" not in str(error.value)
+
+
+def test_times_out_when_consul_does_not_answer(machines):
+    machines(WORKER, is_swarm=False)
+    client = ConsulClient(stubs.public_ip(WORKER), 0.5)
+    try:
+        with pytest.raises(NotReady):
+            wait_for(OrderedDict([("consul", check(lambda: client.request("GET", "/v1/status/leader")))]), 0.5,
+                     "consul of worker")
+    finally:
+        client.close()
+
+
+def test_passed_checks_are_not_polled_again():
+    calls = {"ready": 0, "later": 0}
+
+    def ready():
+        calls["ready"] += 1
+        return True
+
+    def later():
+        calls["later"] += 1
+        return calls["later"] >= 3
+
+    wait_for(OrderedDict([("ready", ready), ("later", later)]), 5, "test")
+    assert calls == {"ready": 1, "later": 3}
+
+
+def test_check_turns_unreachable_into_not_passed():
+    def unreachable():
+        raise EngineError("connection refused")
+
+    assert check(unreachable)() is False
+    assert check(lambda: "10.0.0.1:8300")() is True
+    assert check(lambda: None)() is False
@@ -0,0 +1,115 @@
+import threading
+
+from dsc.core import DSC
+from dsc.nodes import Node, NodeType
+from dsc.scheduler import Scheduler
+
+
+def recorder(ran, name, fail=False):
+    def action():
+        ran.append(name)
+        if fail:
+            raise RuntimeError("{} failed".format(name))
+    return action
+
+
+def test_ready_tasks_start_in_the_order_they_were_added():
+    ran = []
+    scheduler = Scheduler(1)
+    create = scheduler.add("create", recorder(ran, "create"))
+    scheduler.add("configure", recorder(ran, "configure"), requires=[create])
+    scheduler.add("independent", recorder(ran, "independent"))
+
+    assert scheduler.run() == ([], [])
+    # configure is ready once create is done, before independent got its turn, and was added before it
+    assert ran == ["create", "configure", "independent"]
+
+
+def test_tasks_wait_for_their_dependencies():
+    ran = []
+    scheduler = Scheduler(4)
+    masters = [scheduler.add("create master{}".format(index), recorder(ran, "master{}".format(index)))
+               for index in range(3)]
+    scheduler.add("consul", recorder(ran, "consul"), requires=masters)
+
+    assert scheduler.run() == ([], [])
+    assert ran[-1] == "consul"
+    assert sorted(ran[:3]) == ["master0", "master1", "master2"]
+
+
+def test_parallelism_is_bounded():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def action():
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        threading.Event().wait(0.02)
+        with lock:
+            running[0] -= 1
+
+    scheduler = Scheduler(3)
+    for index in range(10):
+        scheduler.add("task{}".format(index), action)
+
+    assert scheduler.run() == ([], [])
+    assert running[1] <= 3
+
+
+def test_failure_skips_the_tasks_that_require_it():
+    ran = []
+    scheduler = Scheduler(2)
+    create = scheduler.add("create", recorder(ran, "create", fail=True))
+    configure = scheduler.add("configure", recorder(ran, "configure"), requires=[create])
+    provision = scheduler.add("provision", recorder(ran, "provision"), requires=[configure])
+    wave = scheduler.add("next wave", recorder(ran, "next wave"), after=[create])
+    other = scheduler.add("other", recorder(ran, "other"))
+
+    failed, skipped = scheduler.run()
+
+    assert failed == [create]
+    assert skipped == [configure, provision]
+    # after only waits for the task to finish, not for it to succeed
+    assert sorted(ran) == sorted(["create", "next wave", "other"])
+    assert wave not in skipped and other not in skipped
+
+
+def test_makespan():
+    scheduler = Scheduler(2)
+    primary = scheduler.add("create primary", lambda: None)
+    workers = [scheduler.add("create worker{}".format(index), lambda: None, requires=[primary]) for index in range(4)]
+    durations = dict([(primary, 10.0)] + [(worker, 5.0) for worker in workers])
+
+    assert scheduler.makespan(durations) == 20.0
+    assert scheduler.makespan(durations, max_workers=1) == 30.0
+    assert scheduler.makespan(durations, max_workers=4) == 15.0
+
+
+def test_rollout_order():
+    def node(name, node_type):
+        return Node.load(name="{}.test".format(name), shortname=name, node_type=node_type, domain="test", config={})
+
+    app = DSC()
+    app.config.worker_wave_size = 2
+    app.masters = [node("master{}".format(index), NodeType.master) for index in range(3)]
+    app.masters[0].is_primary = True
+    app.workers = [node("worker{}".format(index), NodeType.worker) for index in range(3)]
+    tasks = dict([(task.name, task) for task in app._schedule_rollout().tasks])
+
+    def requires(name):
+        return sorted([task.name for task in tasks[name].requires])
+
+    masters_created = ["create master0.test", "create master1.test", "create master2.test"]
+    masters_configured = ["configure master0.test", "configure master1.test", "configure master2.test"]
+    assert requires("create master1.test") == ["create master0.test"]
+    assert requires("create worker0.test") == ["create master0.test"]
+    assert requires("configure master1.test") == masters_created
+    assert requires("configure worker0.test") == sorted(masters_created + ["create worker0.test"])
+    assert requires("provision master0.test") == sorted(masters_configured + ["wait for consul master0.test"])
+    assert requires("provision master1.test") == ["configure master1.test", "wait for swarm master0.test"]
+    assert requires("provision worker0.test") == sorted(masters_configured + ["configure worker0.test"])
+    # The second wave starts once the first one is done
+    assert sorted([task.name for task in tasks["create worker2.test"].after]) == \
+        ["ready worker0.test", "ready worker1.test"]
+    assert tasks["create worker1.test"].after == []
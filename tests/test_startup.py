@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench")
+sys.path.insert(0, BENCH_DIR)
+
+import run  # noqa: E402
+import startup  # noqa: E402
+
+
+def test_cli_only_imports_what_the_command_needs(tmp_path):
+    home = tmp_path / "home"
+    config_dir = tmp_path / "config"
+    home.mkdir()
+    config_dir.mkdir()
+    run.make_config(str(config_dir), 10, 1)
+    env = os.environ.copy()
+    env.update({"HOME": str(home), "PYTHONPATH": startup.ROOT_DIR})
+
+    assert startup.check_imports(env, str(tmp_path), str(config_dir)) == []
+
+
+@pytest.mark.skipif(not os.environ.get("DSC_STARTUP_BUDGETS"),
+                    reason="wall-clock budgets depend on the machine, set DSC_STARTUP_BUDGETS=1 to check them")
+def test_startup_within_budget():
+    process = subprocess.run([sys.executable, os.path.join(BENCH_DIR, "startup.py"), "--runs", "5"],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert process.returncode == 0, process.stdout
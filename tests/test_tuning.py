@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+from dsc.const import CONSUL_COMPOSE_DIR
+from dsc.inventory import ConfigError
+from dsc.tuning import ConsulTuning
+
+with open(os.path.join(CONSUL_COMPOSE_DIR, "config", "consul.json")) as base_file:
+    BASE_CONFIG = base_file.read()
+
+
+def test_render_config_applies_the_settings():
+    settings = ConsulTuning({"raft-multiplier": 5, "recursors": ["1.1.1.1"]}).settings("master", {"cpus": 4})
+    config = json.loads(ConsulTuning.render_config(BASE_CONFIG, settings))
+
+    assert config["recursors"] == ["1.1.1.1"]
+    assert config["dns_config"] == {"allow_stale": True, "max_stale": "10s", "node_ttl": "10s",
+                                    "service_ttl": {"*": "10s"}}
+    assert config["performance"] == {"raft_multiplier": 5}
+    # The rest of the base config is kept
+    assert config["ports"] == {"dns": 53}
+    assert config["verify_incoming"] is True
+
+
+def test_render_config_keeps_the_base_without_settings():
+    config = json.loads(ConsulTuning.render_config(BASE_CONFIG, {}))
+
+    assert config == json.loads(BASE_CONFIG)
+
+
+def test_render_config_only_depends_on_its_input():
+    settings = ConsulTuning().settings("worker", {"cpus": 2, "memory_kb": 4096000})
+
+    assert ConsulTuning.render_config(BASE_CONFIG, settings) == ConsulTuning.render_config(BASE_CONFIG, settings)
+
+
+@pytest.mark.parametrize("node_type, facts, profile, gomaxprocs", [
+    ("master", {"cpus": 8, "memory_kb": 16 * 1024 * 1024}, "server", 8),
+    ("worker", {"cpus": 8, "memory_kb": 16 * 1024 * 1024}, "agent", 2),
+    ("master", {"cpus": 1, "memory_kb": 16 * 1024 * 1024}, "small", 1),
+    ("worker", {"cpus": 4, "memory_kb": 512 * 1024}, "small-memory", 1),
+    # Limits only match when the facts are known, the number of cpus falls back to the default
+    ("master", {}, "server", 2),
+])
+def test_first_matching_profile_wins(node_type, facts, profile, gomaxprocs):
+    settings = ConsulTuning().settings(node_type, facts)
+
+    assert settings["profile"] == profile
+    assert settings["gomaxprocs"] == gomaxprocs
+
+
+def test_profile_settings_override_the_settings_for_all_nodes():
+    tuning = ConsulTuning({"dns-node-ttl": "30s",
+                           "profiles": [{"name": "edge", "type": "worker", "dns-node-ttl": "5s"}]})
+    tuning.validate()
+
+    assert tuning.settings("worker", {})["dns-node-ttl"] == "5s"
+    assert tuning.settings("master", {})["dns-node-ttl"] == "30s"
+    assert tuning.settings("master", {})["profile"] is None
+
+
+@pytest.mark.parametrize("settings, error", [
+    ({"gomaxprocs": 0}, "gomaxprocs must be"),
+    ({"raft-multiplier": 11}, "raft-multiplier must be"),
+    ({"dns-node-ttl": "10"}, "must be a duration"),
+    ({"recursors": "8.8.8.8"}, "recursors must be"),
+    ({"cache": True}, "unknown setting(s) cache"),
+    ({"profiles": [{"type": "manager"}]}, "type must be one of"),
+    ({"profiles": [{"max-cpus": "2"}]}, "max-cpus must be a number"),
+])
+def test_invalid_settings(settings, error):
+    with pytest.raises(ConfigError) as raised:
+        ConsulTuning(settings).validate()
+
+    assert error in str(raised.value)